@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import os
+import json
+import struct
+import numpy as np
+import pandas as pd
+
+from pctk import profiling
+
+
+# A cells archive stores the cells matrices of every snapshot of a run in a
+# single file. Cells are aligned by ID with the previous snapshot and each
+# column is stored as the XOR of its float64 bit pattern with the value of
+# the same cell in the previous snapshot, so unchanged values become zeros
+# and small changes only touch the low mantissa bytes. The XORed values are
+# byte-shuffled (all the first bytes, then all the second bytes, ...) and
+# compressed. Every keyframe_interval snapshots a keyframe is stored without
+# reference, which bounds the work needed to decode any snapshot. When the
+# cells change, the row of each cell in the previous snapshot (-1 for new
+# cells) is stored as well, so readers do not align the IDs again.
+#
+# Layout: MAGIC, the compressed blocks, the JSON index and the offset of the
+# index as a little-endian uint64.
+MAGIC = b"PCTKARC1"
+CODECS = ("zstd", "blosc", "zlib")
+
+
+def _get_codec(name):
+    # (name, compress, decompress) of a codec; zstd and blosc are optional
+    if name == "zstd":
+        import zstandard
+        compressor = zstandard.ZstdCompressor(level=3)
+        decompressor = zstandard.ZstdDecompressor()
+        return name, compressor.compress, decompressor.decompress
+    if name == "blosc":
+        import blosc
+        compress = lambda data: blosc.compress(data, typesize=1, shuffle=blosc.NOSHUFFLE, cname="zstd")
+        return name, compress, blosc.decompress
+    if name == "zlib":
+        import zlib
+        return name, lambda data: zlib.compress(data, 6), zlib.decompress
+    raise ValueError(f"Unknown codec {name}. The codec must be one of {', '.join(CODECS)}")
+
+
+def default_codec():
+    # Best codec available
+    for name in CODECS:
+        try:
+            return _get_codec(name)[0]
+        except ImportError:
+            continue
+
+
+def _shuffle(values):
+    return np.ascontiguousarray(values.view(np.uint8).reshape(-1, 8).T).tobytes()
+
+
+def _unshuffle(data, num_values):
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(8, num_values)
+    values = np.empty((num_values, 8), dtype=np.uint8)
+    for k in range(8):
+        values[:, k] = planes[k]
+    return values.view(np.uint64).reshape(-1)
+
+
+def _align(previous_ids, ids):
+    # Row of each cell in the previous snapshot, -1 for new cells, or None
+    # if the cells did not change
+    if len(previous_ids) == len(ids) and np.array_equal(previous_ids, ids):
+        return None
+    if len(previous_ids) == 0:
+        return np.full(len(ids), -1, dtype=np.int64)
+    order = np.argsort(previous_ids, kind="stable")
+    sorted_ids = previous_ids[order]
+    position = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[position] == ids, order[position], -1)
+
+
+def _reference(previous, index):
+    # Rows of previous (bit patterns) of each cell, zero for new cells, or
+    # previous itself if the cells did not change
+    if index is None:
+        return previous
+    reference = np.zeros((len(index),) + previous.shape[1:], dtype=previous.dtype)
+    matched = index >= 0
+    reference[matched] = previous[index[matched]]
+    return reference
+
+
+class _Writer(object):
+
+    def __init__(self, fh, codec):
+        self.fh = fh
+        self.codec, self.compress, _ = _get_codec(codec)
+
+    def block(self, values):
+        # Blocks of zeros (e.g. columns that did not change) are not stored
+        if not values.any():
+            return [self.fh.tell(), 0]
+        data = self.compress(_shuffle(values))
+        offset = self.fh.tell()
+        self.fh.write(data)
+        return [offset, len(data)]
+
+
+def write_archive(mcds, fname, keyframe_interval=10, codec=None):
+    # Writes the cells of every snapshot of a MultiCellDS into the archive
+    # fname and returns a CellArchive to read it
+    if codec is None:
+        codec = default_codec()
+    columns = mcds.cell_columns
+    id_column = columns.index("ID")
+
+    snapshots = []
+    previous = None
+    raw_bytes = 0
+    tmp_fname = fname + ".tmp"
+    with open(tmp_fname, "wb") as fh:
+        fh.write(MAGIC)
+        writer = _Writer(fh, codec)
+        for i, (time, cells) in enumerate(mcds.cells_as_matrix_iterator()):
+            with profiling.timer("archive_encode"):
+                cells = np.ascontiguousarray(cells, dtype=np.float64)
+                raw_bytes += cells.nbytes
+                ids = cells[:, id_column].astype(np.int64)
+                keyframe = previous is None or i % keyframe_interval == 0
+                entry = {"time": time, "num_cells": len(ids), "keyframe": keyframe, "columns": {}}
+
+                bits = cells.view(np.uint64)
+                if keyframe:
+                    entry["ids"] = writer.block(np.diff(ids, prepend=0).view(np.uint64))
+                else:
+                    previous_ids, previous_bits = previous
+                    index = _align(previous_ids, ids)
+                    if index is None:
+                        entry["ids"] = None
+                    else:
+                        entry["ids"] = writer.block(np.diff(ids, prepend=0).view(np.uint64))
+                        entry["rows"] = writer.block(index.view(np.uint64))
+                    bits = bits ^ _reference(previous_bits, index)
+
+                for j, column in enumerate(columns):
+                    if j != id_column:
+                        entry["columns"][column] = writer.block(np.ascontiguousarray(bits[:, j]))
+                snapshots.append(entry)
+                previous = (ids, cells.view(np.uint64))
+
+        index = {
+            "version": 2,
+            "codec": writer.codec,
+            "keyframe_interval": keyframe_interval,
+            "columns": columns,
+            "time_units": mcds.time_units,
+            "snapshots": snapshots,
+        }
+        offset = fh.tell()
+        fh.write(json.dumps(index).encode())
+        fh.write(struct.pack("<Q", offset))
+    os.replace(tmp_fname, fname)
+
+    size = os.path.getsize(fname)
+    print(f"Writing {len(snapshots)} snapshots into {fname}: {size / 2**20:.1f} MB "
+          f"({raw_bytes / max(size, 1):.1f}x smaller than the raw cells, codec {writer.codec})")
+    return CellArchive(fname)
+
+
+class CellArchive(object):
+    # Reader of a cells archive. Decoding a snapshot starts from the last
+    # keyframe or from the last decoded snapshot, which is kept, so reading
+    # the snapshots in order decodes each of them once. Only the requested
+    # columns are decoded.
+    def __init__(self, fname):
+        self._fname = fname
+        with open(fname, "rb") as fh:
+            if fh.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{fname} is not a pctk cells archive")
+            fh.seek(-8, os.SEEK_END)
+            end = fh.tell()
+            (offset,) = struct.unpack("<Q", fh.read(8))
+            fh.seek(offset)
+            self._index = json.loads(fh.read(end - offset))
+        _, _, self._decompress = _get_codec(self._index["codec"])
+        self._columns = self._index["columns"]
+        self._snapshots = self._index["snapshots"]
+        self._fh = None
+        self._state = None
+
+    def __getstate__(self):
+        # Open files and decoded snapshots are not sent to other processes
+        state = self.__dict__.copy()
+        state["_fh"] = None
+        state["_state"] = None
+        state["_decompress"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        _, _, self._decompress = _get_codec(self._index["codec"])
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    @property
+    def columns(self):
+        return self._columns
+
+    @property
+    def cell_columns(self):
+        return self._columns
+
+    @property
+    def times(self):
+        return [s["time"] for s in self._snapshots]
+
+    @property
+    def time_units(self):
+        return self._index["time_units"]
+
+    def _read(self, block, num_values, zeros=True):
+        # Values of a block; blocks of zeros are None unless zeros
+        offset, length = block
+        if length == 0:
+            return np.zeros(num_values, dtype=np.uint64) if zeros else None
+        if self._fh is None:
+            self._fh = open(self._fname, "rb")
+        data = os.pread(self._fh.fileno(), length, offset)
+        return _unshuffle(self._decompress(data), num_values)
+
+    def _step(self, i, previous, names):
+        # Decodes snapshot i given the decoded snapshot i - 1 (or None) as
+        # (ids, {column: bit patterns}). Columns without changes share the
+        # array of the previous snapshot, decoded arrays are never modified.
+        entry = self._snapshots[i]
+        n = entry["num_cells"]
+        if entry["ids"] is None:
+            ids = previous[0]
+        else:
+            ids = np.cumsum(self._read(entry["ids"], n).view(np.int64))
+
+        index = None
+        if not entry["keyframe"] and entry["ids"] is not None:
+            if "rows" in entry:
+                index = self._read(entry["rows"], n).view(np.int64)
+            else:
+                # Archives of version 1 do not store the alignment
+                index = _align(previous[0], ids)
+
+        values = {}
+        for name in names:
+            delta = self._read(entry["columns"][name], n, zeros=False)
+            if entry["keyframe"]:
+                values[name] = np.zeros(n, dtype=np.uint64) if delta is None else delta
+                continue
+            reference = _reference(previous[1][name], index)
+            values[name] = reference if delta is None else np.bitwise_xor(reference, delta, out=delta)
+        return ids, values
+
+    def _decode(self, i, names):
+        keyframe = i
+        while not self._snapshots[keyframe]["keyframe"]:
+            keyframe -= 1
+
+        start, current = keyframe, None
+        if self._state is not None:
+            last, state = self._state
+            if keyframe <= last <= i and set(names) <= set(state[1]):
+                start, current = last + 1, state
+        for j in range(start, i + 1):
+            current = self._step(j, current, names)
+        self._state = (i, current)
+        return current
+
+    def load(self, i, columns=None):
+        # Cells matrix (cells x columns) of snapshot i, rows in the original order
+        if columns is None:
+            columns = self._columns
+        names = [c for c in columns if c != "ID"]
+        profiling.count("snapshots")
+        with profiling.timer("archive_decode"):
+            ids, values = self._decode(i, names)
+            # Filled by column, one contiguous copy per column, and returned
+            # transposed like the matrices read from the .mat files
+            cells = np.empty((len(columns), len(ids)))
+            for j, column in enumerate(columns):
+                if column == "ID":
+                    cells[j] = ids
+                else:
+                    cells[j] = values[column].view(np.float64)
+            cells = cells.T
+        profiling.count("cells", cells.shape[0])
+        return cells
+
+    def get_time(self, i):
+        return self._snapshots[i]["time"]
+
+    def cells_as_matrix_iterator(self, columns=None):
+        for i in range(len(self)):
+            yield self.get_time(i), self.load(i, columns)
+
+    def cells_as_frames_iterator(self, columns=None):
+        # Same frames as MultiCellDS.cells_as_frames_iterator
+        if columns is None:
+            columns = self._columns
+        columns = list(columns)
+        if "ID" not in columns:
+            columns = ["ID"] + columns
+        for time, cells in self.cells_as_matrix_iterator(columns):
+            df = pd.DataFrame(cells, columns=columns)
+            yield time, df.set_index("ID")
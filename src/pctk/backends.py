@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import os
+import glob
+import json
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+
+from pctk import readers
+from pctk import profiling
+from pctk.multicellds import MultiCellDS
+
+
+# Canonical column names shared by all the backends, mapped to the name
+# used by each output format
+PHYSICELL_ALIASES = {
+    "ID": "ID",
+    "x": "x_position",
+    "y": "y_position",
+    "z": "z_position",
+    "phase": "current_phase",
+    "cell_type": "cell_type",
+    "total_volume": "total_volume",
+    "nuclear_volume": "nuclear_volume",
+}
+
+PHYSIBOSS_ALIASES = {
+    "ID": "ID",
+    "x": "x",
+    "y": "y",
+    "z": "z",
+    "phase": "phase",
+    "cell_type": "cell_line",
+    "radius": "radius",
+    "nuclear_radius": "radius_nuclear",
+    "total_volume": "volume_total",
+}
+
+
+def _load_task(args):
+    backend, snapshot, columns = args
+    if profiling.is_enabled():
+        profiling.count_file(backend.snapshot_source(snapshot))
+    with profiling.timer("load_columns"):
+        return backend.load_columns(snapshot, columns)
+
+
+class SnapshotBackend(object):
+    # Base class of the snapshot readers. Subclasses implement
+    # list_snapshots, get_time, load_columns and the columns property;
+    # projection, parallel loading and frames come for free. Snapshots whose
+    # columns may differ from the others override snapshot_columns.
+    format = None
+    aliases = {}
+
+    def __init__(self, output_folder):
+        self._output_folder = output_folder
+
+    @property
+    def output_folder(self):
+        return self._output_folder
+
+    @property
+    def columns(self):
+        raise NotImplementedError
+
+    @property
+    def phase_column(self):
+        return self.resolve("phase")
+
+    @property
+    def cell_type_column(self):
+        return self.resolve("cell_type")
+
+    def resolve(self, column):
+        return self.aliases.get(column, column)
+
+    def column_index(self, column):
+        return self.columns.index(self.resolve(column))
+
+    def snapshot_columns(self, snapshot):
+        return self.columns
+
+    def list_snapshots(self):
+        raise NotImplementedError
+
+    def snapshot_source(self, snapshot):
+        # File holding the cells of the snapshot, used to invalidate caches
+        return snapshot
+
+    def get_time(self, snapshot):
+        raise NotImplementedError
+
+    def load_columns(self, snapshot, columns=None):
+        raise NotImplementedError
+
+    def load_frame(self, snapshot, columns=None):
+        names = self.columns if columns is None else [self.resolve(c) for c in columns]
+        data = self.load_columns(snapshot, names)
+        return pd.DataFrame(data, columns=names)
+
+    def __len__(self):
+        return len(self.list_snapshots())
+
+    def iter_columns(self, columns=None, processes=1):
+        snapshots = self.list_snapshots()
+        if processes <= 1 or len(snapshots) <= 1:
+            for snapshot in snapshots:
+                data = _load_task((self, snapshot, columns))
+                profiling.count("snapshots")
+                profiling.count("cells", data.shape[0])
+                yield self.get_time(snapshot), data
+            return
+
+        tasks = [(self, snapshot, columns) for snapshot in snapshots]
+        with mp.Pool(processes) as pool:
+            results = profiling.collect(pool.imap(profiling.task(_load_task), tasks))
+            for snapshot, data in zip(snapshots, results):
+                profiling.count("snapshots")
+                profiling.count("cells", data.shape[0])
+                yield self.get_time(snapshot), data
+
+    def iter_frames(self, columns=None, processes=1):
+        names = self.columns if columns is None else [self.resolve(c) for c in columns]
+        for time, data in self.iter_columns(names, processes=processes):
+            with profiling.timer("dataframe"):
+                df = pd.DataFrame(data, columns=names)
+            yield time, df
+
+
+class PhysiCellMatBackend(SnapshotBackend):
+    format = "physicell"
+    aliases = PHYSICELL_ALIASES
+
+    def __init__(self, output_folder, xml_fname="initial.xml"):
+        super().__init__(output_folder)
+        mcds = MultiCellDS(output_folder=output_folder, xml_fname=xml_fname)
+        self._columns = mcds.cell_columns
+        self._sources = {}
+        self._times = {}
+        self._snapshot_columns = {}
+
+    @property
+    def columns(self):
+        return self._columns
+
+    def list_snapshots(self):
+        return sorted(glob.glob(os.path.join(self._output_folder, "output*.xml")))
+
+    def _parse(self, snapshot):
+        info = readers.read_snapshot_metadata(snapshot, sections=("time", "cells"))
+        source = info.get("cells_fname")
+        self._times[snapshot] = info["current_time"]
+        self._sources[snapshot] = os.path.join(self._output_folder, source) if source else None
+        labels = info.get("labels")
+        self._snapshot_columns[snapshot] = readers.cell_columns_from_labels(labels) if labels else self._columns
+
+    def snapshot_columns(self, snapshot):
+        # Labels of the snapshot itself, which may differ from initial.xml
+        if snapshot not in self._snapshot_columns:
+            self._parse(snapshot)
+        return self._snapshot_columns[snapshot]
+
+    def snapshot_source(self, snapshot):
+        if snapshot not in self._sources:
+            self._parse(snapshot)
+        return self._sources[snapshot]
+
+    def get_time(self, snapshot):
+        if snapshot not in self._times:
+            self._parse(snapshot)
+        return self._times[snapshot]
+
+    def load_columns(self, snapshot, columns=None):
+        rows = None
+        if columns is not None:
+            snapshot_columns = self.snapshot_columns(snapshot)
+            rows = [snapshot_columns.index(self.resolve(c)) for c in columns]
+        return readers.read_physicell_cells(self.snapshot_source(snapshot), rows=rows)
+
+
+class PhysiBoSSTextBackend(SnapshotBackend):
+    format = "physiboss"
+    aliases = PHYSIBOSS_ALIASES
+
+    def __init__(self, output_folder, sep=";"):
+        super().__init__(output_folder)
+        self._sep = sep
+        fnames = self.list_snapshots()
+        self._columns = readers.read_physiboss_header(fnames[0], sep=sep) if fnames else []
+
+    @property
+    def columns(self):
+        return self._columns
+
+    def snapshot_columns(self, snapshot):
+        return readers.read_physiboss_header(snapshot, sep=self._sep)
+
+    def list_snapshots(self):
+        return readers.physiboss_fnames(self._output_folder)
+
+    def get_time(self, snapshot):
+        # The first column of every row stores the time
+        with open(snapshot) as fh:
+            next(fh)
+            row = fh.readline()
+        if row == "":
+            return float(os.path.basename(snapshot)[6:-4])
+        return float(row.split(self._sep, 1)[0])
+
+    def load_columns(self, snapshot, columns=None):
+        if columns is not None:
+            columns = [self.resolve(c) for c in columns]
+        _, data = readers.read_physiboss_file(snapshot, columns=columns, sep=self._sep)
+        return data
+
+
+class ArchiveBackend(SnapshotBackend):
+    # Reads a cells archive written by pctk.archive.write_archive. Snapshots
+    # are identified by their position in the archive.
+    format = "physicell"
+    aliases = PHYSICELL_ALIASES
+
+    def __init__(self, archive_fname):
+        from pctk.archive import CellArchive
+        super().__init__(os.path.dirname(os.path.abspath(archive_fname)))
+        self._archive = CellArchive(archive_fname)
+        self._archive_fname = archive_fname
+
+    @property
+    def columns(self):
+        return self._archive.columns
+
+    def list_snapshots(self):
+        return list(range(len(self._archive)))
+
+    def snapshot_source(self, snapshot):
+        return self._archive_fname
+
+    def get_time(self, snapshot):
+        return self._archive.get_time(snapshot)
+
+    def load_columns(self, snapshot, columns=None):
+        if columns is not None:
+            columns = [self.resolve(c) for c in columns]
+        return self._archive.load(snapshot, columns)
+
+
+class CachedColumnarBackend(SnapshotBackend):
+    # Wraps any other backend and keeps every decoded column of a snapshot
+    # as a .npy file, so later reads only map the columns they need. Each
+    # snapshot has a small JSON entry with its time and the modification time
+    # of its source file; entries of modified sources are rebuilt.
+    def __init__(self, backend, cache_folder=None):
+        super().__init__(backend.output_folder)
+        self._backend = backend
+        if cache_folder is None:
+            cache_folder = os.path.join(backend.output_folder, ".pctk_cache")
+        self._cache_folder = cache_folder
+        os.makedirs(cache_folder, exist_ok=True)
+        self._entries = {}
+
+    @property
+    def format(self):
+        return self._backend.format
+
+    @property
+    def aliases(self):
+        return self._backend.aliases
+
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def columns(self):
+        return self._backend.columns
+
+    def snapshot_columns(self, snapshot):
+        return self._backend.snapshot_columns(snapshot)
+
+    def list_snapshots(self):
+        return self._backend.list_snapshots()
+
+    def snapshot_source(self, snapshot):
+        return self._backend.snapshot_source(snapshot)
+
+    def _key(self, snapshot):
+        if isinstance(snapshot, str):
+            return os.path.basename(snapshot)
+        # Snapshots of an archive are numbered, the archive name keeps the
+        # entries of several archives apart
+        return f"{os.path.basename(self.snapshot_source(snapshot))}.{snapshot}"
+
+    def _column_fname(self, snapshot, column):
+        return os.path.join(self._cache_folder, f"{self._key(snapshot)}.{column}.npy")
+
+    def _entry_fname(self, snapshot):
+        return os.path.join(self._cache_folder, f"{self._key(snapshot)}.json")
+
+    def _entry(self, snapshot):
+        # Returns the cache entry of the snapshot, or None if it is stale
+        mtime = os.path.getmtime(self.snapshot_source(snapshot))
+        entry = self._entries.get(snapshot)
+        if entry is None and os.path.exists(self._entry_fname(snapshot)):
+            with open(self._entry_fname(snapshot)) as fh:
+                entry = json.load(fh)
+        if entry is None or entry["mtime"] != mtime:
+            return None
+        self._entries[snapshot] = entry
+        return entry
+
+    def _update(self, snapshot):
+        data = self._backend.load_columns(snapshot)
+        for i, column in enumerate(self.snapshot_columns(snapshot)):
+            np.save(self._column_fname(snapshot, column), np.ascontiguousarray(data[:, i]))
+        entry = {
+            "time": self._backend.get_time(snapshot),
+            "mtime": os.path.getmtime(self.snapshot_source(snapshot)),
+        }
+        # The entry is written last, so a partially written cache is never used
+        tmp_fname = self._entry_fname(snapshot) + ".tmp"
+        with open(tmp_fname, "w") as fh:
+            json.dump(entry, fh)
+        os.replace(tmp_fname, self._entry_fname(snapshot))
+        self._entries[snapshot] = entry
+        return data
+
+    def get_time(self, snapshot):
+        entry = self._entry(snapshot)
+        if entry is None:
+            return self._backend.get_time(snapshot)
+        return entry["time"]
+
+    def load_columns(self, snapshot, columns=None):
+        if self._entry(snapshot) is None:
+            data = self._update(snapshot)
+            if columns is None:
+                return data
+            snapshot_columns = self.snapshot_columns(snapshot)
+            return data[:, [snapshot_columns.index(self.resolve(c)) for c in columns]]
+
+        names = self.snapshot_columns(snapshot) if columns is None else [self.resolve(c) for c in columns]
+        arrays = [np.load(self._column_fname(snapshot, c), mmap_mode="r") for c in names]
+        if len(arrays) == 0:
+            # The number of cells is taken from any stored column
+            stored = self.snapshot_columns(snapshot)
+            num_cells = len(np.load(self._column_fname(snapshot, stored[0]), mmap_mode="r")) if stored else 0
+            return np.empty((num_cells, 0))
+        return np.column_stack(arrays)
+
+
+def get_backend(output_folder, format="physicell", cache=False, cache_folder=None):
+    if format == "physicell":
+        backend = PhysiCellMatBackend(output_folder)
+    elif format == "physiboss":
+        backend = PhysiBoSSTextBackend(output_folder)
+    elif format == "archive":
+        # output_folder is the archive file
+        backend = ArchiveBackend(output_folder)
+    else:
+        raise ValueError(f"Invalid format {format}. The format must be physicell, physiboss or archive")
+    if cache:
+        backend = CachedColumnarBackend(backend, cache_folder=cache_folder)
+    return backend
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import contextlib
+import numpy as np
+import xml.etree.ElementTree as ET
+
+import pctk
+
+
+# Labels of the PhysiCell cells matrix, as (name, size)
+CELL_LABELS = [
+    ("ID", 1), ("position", 3), ("total_volume", 1), ("cell_type", 1), ("cycle_model", 1),
+    ("current_phase", 1), ("elapsed_time_in_phase", 1), ("nuclear_volume", 1),
+    ("cytoplasmic_volume", 1), ("fluid_fraction", 1), ("calcified_fraction", 1),
+    ("orientation", 3), ("polarity", 1), ("migration_speed", 1), ("motility_vector", 3),
+    ("migration_bias", 1), ("motility_bias_direction", 3), ("persistence_time", 1),
+    ("motility_reserved", 1), ("oncoprotein", 1),
+]
+
+SNAPSHOT_INTERVAL = 60.0
+
+
+def _sub(parent, tag, text=None, **attrib):
+    node = ET.SubElement(parent, tag, attrib)
+    if text is not None:
+        node.text = text
+    return node
+
+
+def _snapshot_xml(name, time, grid_coordinates, substrates):
+    root = ET.Element("MultiCellDS", {"version": "0.5", "type": "snapshot/simulation"})
+    metadata = _sub(root, "metadata")
+    _sub(metadata, "current_time", "%f" % time, units="min")
+    _sub(metadata, "current_runtime", "0.000000", units="sec")
+
+    domain = _sub(_sub(root, "microenvironment"), "domain", name="microenvironment")
+    mesh = _sub(domain, "mesh", type="Cartesian", uniform="true", regular="true", units="micron")
+    step = grid_coordinates[1] - grid_coordinates[0] if len(grid_coordinates) > 1 else 1.0
+    low, high = grid_coordinates[0] - step / 2, grid_coordinates[-1] + step / 2
+    _sub(mesh, "bounding_box", "%f %f %f %f %f %f" % (low, low, low, high, high, high),
+         type="axis-aligned", units="micron")
+    coordinates = " ".join("%f" % c for c in grid_coordinates)
+    for axis in "xyz":
+        _sub(mesh, f"{axis}_coordinates", coordinates, delimiter=" ")
+    variables = _sub(domain, "variables")
+    for i, substrate in enumerate(substrates):
+        _sub(variables, "variable", name=substrate, units="dimensionless", ID=str(i))
+    _sub(_sub(domain, "data", type="matlab"), "filename", f"{name}_microenvironment0.mat")
+
+    populations = _sub(_sub(root, "cellular_information"), "cell_populations")
+    custom = _sub(_sub(populations, "cell_population", type="individual"), "custom")
+    simplified = _sub(custom, "simplified_data", type="matlab", source="PhysiCell")
+    labels = _sub(simplified, "labels")
+    index = 0
+    for label, size in CELL_LABELS:
+        _sub(labels, "label", label, index=str(index), size=str(size))
+        index += size
+    _sub(simplified, "filename", f"{name}_cells_physicell.mat")
+    return ET.ElementTree(root)
+
+
+def _initial_cells(num_cells, rng):
+    # Cells packed in a sphere, with a mix of live, apoptotic and necrotic phases
+    num_rows = sum(size for _, size in CELL_LABELS)
+    cells = np.zeros((num_rows, num_cells))
+    radius = 8.4 * np.cbrt(num_cells)
+    direction = rng.normal(size=(3, num_cells))
+    direction /= np.linalg.norm(direction, axis=0)
+    cells[0] = np.arange(num_cells)
+    cells[1:4] = direction * radius * np.cbrt(rng.random(num_cells))
+    cells[4] = rng.normal(2494, 150, num_cells)
+    cells[5] = rng.integers(0, 2, num_cells)
+    cells[7] = rng.choice([14, 100, 101, 102], size=num_cells, p=[0.85, 0.05, 0.05, 0.05])
+    cells[8] = rng.random(num_cells) * 600
+    cells[9] = rng.normal(540, 40, num_cells)
+    cells[10] = cells[4] - cells[9]
+    cells[11] = 0.75
+    cells[27] = rng.normal(1, 0.1, num_cells)
+    return cells
+
+
+def _microenvironment(grid_coordinates, num_substrates, time, rng):
+    # Rows x, y, z, voxel volume and one row per substrate, x varying fastest
+    z, y, x = np.meshgrid(grid_coordinates, grid_coordinates, grid_coordinates, indexing="ij")
+    step = grid_coordinates[1] - grid_coordinates[0] if len(grid_coordinates) > 1 else 1.0
+    distance = np.sqrt(x**2 + y**2 + z**2).ravel()
+    data = np.empty((4 + num_substrates, distance.size))
+    data[0], data[1], data[2] = x.ravel(), y.ravel(), z.ravel()
+    data[3] = step ** 3
+    for i in range(num_substrates):
+        scale = 1 + 0.1 * i + time / 1000
+        data[4 + i] = 38 * (1 - np.exp(-distance / (200 * scale))) + rng.random(distance.size)
+    return data
+
+
+def write_synthetic_output(output_folder, num_cells=10000, num_snapshots=5, grid_size=50,
+                           num_substrates=1, seed=0, compress=False):
+    # Writes a PhysiCell-like output folder: initial.xml and outputXXXXXXXX.xml
+    # with their cells and microenvironment .mat files. The cells move a bit
+    # between snapshots, keeping their IDs.
+    from scipy.io import savemat
+
+    os.makedirs(output_folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    grid_coordinates = np.linspace(-750, 750, grid_size + 1)[:-1] + 750 / grid_size
+    substrates = [f"substrate_{i}" for i in range(num_substrates)]
+
+    cells = _initial_cells(num_cells, rng)
+    names = ["initial"] + ["output%08i" % i for i in range(num_snapshots)]
+    for i, name in enumerate(names):
+        time = max(i - 1, 0) * SNAPSHOT_INTERVAL
+        if i > 1:
+            cells[1:4] += rng.normal(0, 1, size=(3, num_cells))
+            cells[8] += SNAPSHOT_INTERVAL
+        tree = _snapshot_xml(name, time, grid_coordinates, substrates)
+        tree.write(os.path.join(output_folder, f"{name}.xml"), encoding="unicode", xml_declaration=True)
+        savemat(os.path.join(output_folder, f"{name}_cells_physicell.mat"), {"cells": cells},
+                do_compression=compress)
+        microenvironment = _microenvironment(grid_coordinates, num_substrates, time, rng)
+        savemat(os.path.join(output_folder, f"{name}_microenvironment0.mat"),
+                {"multiscale_microenvironment": microenvironment}, do_compression=compress)
+    return output_folder
+
+
+def time_it(func, repeat=3):
+    # Runs func repeat times with its output silenced and returns the timings
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _mirror_folder(src_folder, dst_folder):
+    # dst_folder with a link to (or, without symlinks, a copy of) every file of src_folder
+    os.makedirs(dst_folder)
+    for name in os.listdir(src_folder):
+        src = os.path.abspath(os.path.join(src_folder, name))
+        if not os.path.isfile(src):
+            continue
+        try:
+            os.symlink(src, os.path.join(dst_folder, name))
+        except OSError:
+            shutil.copy2(src, os.path.join(dst_folder, name))
+
+
+def _benchmark_cases(output_folder, pov_config, processes, cases=None):
+    from pctk import render
+    from pctk.archive import CellArchive, write_archive
+    from pctk.multicellds import MultiCellDS
+    from pctk.povwriter import POVWriter
+
+    mcds = MultiCellDS(output_folder=output_folder)
+    # The archive is written next to the POV config, only when it is timed
+    archive_fname = os.path.join(os.path.dirname(pov_config), "benchmark_cells.pctka")
+    if not cases or "CellArchive.cells_as_matrix_iterator" in cases:
+        with contextlib.redirect_stdout(io.StringIO()):
+            write_archive(mcds, archive_fname)
+    cases = {
+        "MultiCellDS": lambda: MultiCellDS(output_folder=output_folder),
+        "cells_as_frames_iterator": lambda: [df for df in mcds.cells_as_frames_iterator()],
+        "cells_as_frames_iterator_compact": lambda: [df for df in mcds.cells_as_frames_iterator(compact=True)],
+        "cells_as_matrix_iterator": lambda: [m for m in mcds.cells_as_matrix_iterator()],
+        "CellArchive.cells_as_matrix_iterator": lambda: [m for m in CellArchive(archive_fname).cells_as_matrix_iterator()],
+        "microenvironment_as_matrix_iterator": lambda: [m for m in mcds.microenvironment_as_matrix_iterator()],
+        "get_cells_summary_frame": lambda: mcds.get_cells_summary_frame(),
+        "POVWriter.write_pov_file": lambda: POVWriter(pov_config).write_pov_file(0),
+        "render.write_pov_files": lambda: render.write_pov_files(pov_config, index_list=None,
+                                                                 num_of_threads=processes),
+    }
+    return cases
+
+
+def run_benchmarks(output_folder, num_cells=10000, num_snapshots=5, grid_size=50, num_substrates=1,
+                   repeat=3, processes=1, existing=False, cases=None, json_fname=None):
+    # Times the main reading and writing paths of pctk on a synthetic output
+    # folder (or on an existing one) and optionally saves the results as JSON
+    from pctk.archive import default_codec
+    from pctk.povwriter import create_defulat_config
+
+    parameters = {"repeat": repeat, "processes": processes, "archive_codec": default_codec()}
+    if existing:
+        parameters["output_folder"] = os.path.abspath(output_folder)
+    else:
+        print(f"Writing synthetic output with {num_cells} cells, {num_snapshots} snapshots "
+              f"and a {grid_size}^3 grid into {output_folder}")
+        write_synthetic_output(output_folder, num_cells=num_cells, num_snapshots=num_snapshots,
+                               grid_size=grid_size, num_substrates=num_substrates)
+        parameters.update(num_cells=num_cells, num_snapshots=num_snapshots, grid_size=grid_size,
+                          num_substrates=num_substrates)
+
+    results = {}
+    # The POV config, the cells archive and, for an existing output folder,
+    # the .pov files (written next to the cells files) go to a temporary folder
+    with tempfile.TemporaryDirectory(prefix="pctk_benchmark_") as work_folder:
+        pov_folder = output_folder
+        if existing:
+            pov_folder = os.path.join(work_folder, "output")
+            _mirror_folder(output_folder, pov_folder)
+        pov_config = os.path.join(work_folder, "benchmark_povwriter.xml")
+        create_defulat_config(pov_config, pov_folder)
+
+        for name, func in _benchmark_cases(output_folder, pov_config, processes, cases).items():
+            if cases and name not in cases:
+                continue
+            try:
+                timings = time_it(func, repeat=repeat)
+                results[name] = {"min": min(timings), "mean": sum(timings) / len(timings), "timings": timings}
+                print("%-40s %10.4f s" % (name, min(timings)))
+            except Exception as e:
+                results[name] = {"error": f"{type(e).__name__}: {e}"}
+                print("%-40s %s" % (name, results[name]["error"]))
+
+    report = {
+        "pctk_version": pctk.__version__,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "parameters": parameters,
+        "results": results,
+    }
+    if json_fname:
+        with open(json_fname, "w") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Saving benchmark results as {json_fname}")
+    return report
+
+
+def compare_benchmarks(baseline, report, threshold=0.1):
+    # Compares the best timings of two reports (dicts or JSON file names) and
+    # returns the names of the cases that got slower by more than threshold
+    if isinstance(baseline, str):
+        with open(baseline) as fh:
+            baseline = json.load(fh)
+    if isinstance(report, str):
+        with open(report) as fh:
+            report = json.load(fh)
+
+    regressions = []
+    print("%-40s %10s %10s %8s" % ("case", "baseline", "current", "ratio"))
+    for name, result in report["results"].items():
+        base = baseline["results"].get(name, {})
+        if "min" not in result or "min" not in base:
+            continue
+        ratio = result["min"] / base["min"]
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = " slower"
+        print("%-40s %10.4f %10.4f %8.2f%s" % (name, base["min"], result["min"], ratio, flag))
+    return regressions
@@ -1,11 +1,12 @@
+import os
 import sys
 import re
+import glob
 import argparse
 import pctk
-from pctk import plot
-from pctk import render
-from pctk import config
-from pctk.povwriter import create_defulat_config
+
+# The modules of each sub-command are imported when the command runs, so
+# pctk --help or a small command do not pay for pandas, matplotlib or scipy
 
 
 
@@ -16,7 +17,10 @@ def parse_index_string(strn_idxs):
     pattern_all = re.compile("^all$")
     
     match = re.search(pattern_slices, strn_idxs)
-    if match:
+    if re.search(pattern_all, strn_idxs):
+        # All the output files found in the output folder
+        index_list = None
+    elif match:
         from_idx = int(match.group(1))
         to_idx = int(match.group(2))
         inc = int(match.group(3))
@@ -31,8 +35,14 @@ def main():
     
     parser = argparse.ArgumentParser(description=f"PhysiCell Tool Kit Version {pctk.__version__} for handling and processing Physicell outputs")
     parser.add_argument("output_folder", action="store", help="Folder where the simulation output is stored")
-    parser.add_argument("--format", action="store", dest="format", choices=("physicell", "physiboss"),
-                        help="Format of the input data", default="physicell")
+    parser.add_argument("--format", action="store", dest="format", choices=("physicell", "physiboss", "archive"),
+                        help="Format of the input data (archive: output_folder is a cells archive file)", default="physicell")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print the time spent in each stage and counters (snapshots, cells, bytes read) at the end. "
+                             "Stages run by worker processes are included, their times are summed over the workers")
+    parser.add_argument("--profile-out", action="store", dest="profile_out", default=None,
+                        help="Also write a cProfile dump, loadable with pstats or snakeviz, into this file. "
+                             "Only the main process is profiled, use --cpus 1 to profile the whole run")
     subparser = parser.add_subparsers(dest='command', help='sub-command help')
         
     plot_parser = subparser.add_parser('plot-time-course',
@@ -43,18 +53,136 @@ def main():
                         help="File name to save the plot")    
     plot_parser.add_argument("--csvout", action="store", dest="csv_fname", default=None,
                         help="File name to store the summary table used for the plot")
+    plot_parser.add_argument("--cache", action='store_true',
+                        help="Keep the decoded columns in output_folder/.pctk_cache to speed up later runs")
+    plot_parser.add_argument("--cpus", action="store", dest="cpus", type=int, default=1, 
+                        help="Total cpus used to decode the output files in parallel")
+
+
+    sweep_parser = subparser.add_parser('sweep-summary',
+                                        description="Summarize many output folders (output_folder is a glob pattern or a manifest file) into one table")
+    sweep_parser.add_argument("--columns", action="store", dest="columns", default="",
+                        help="Comma separated cell columns whose mean and std are added to the table")
+    sweep_parser.add_argument("--csvout", action="store", dest="csv_fname", default="./sweep_summary.csv",
+                        help="File name to store the long-format summary table")
+    sweep_parser.add_argument("--figout", action="store", dest="fig_fname", default=None,
+                        help="File name to save the mean/CI plots across replicates")
+    sweep_parser.add_argument("--confidence", action="store", dest="confidence", type=float, default=0.95,
+                        help="Confidence level of the intervals in the plots")
+    sweep_parser.add_argument("--no-cache", action='store_false', dest="cache",
+                        help="Do not reuse or store the per-folder summaries in output_folder/.pctk_cache")
+    sweep_parser.add_argument("--cpus", action="store", dest="cpus", type=int, default=1, 
+                        help="Total cpus used to summarize the output folders in parallel")
+
+
+    snap_parser = subparser.add_parser('plot-snapshots',
+                                       description="Plot a 2D cross-section of every snapshot: cells colored by phase group over a substrate heatmap")
+    snap_parser.add_argument("--out-folder", action="store", dest="out_folder", default=None,
+                        help="Folder where the figures are saved (default: output_folder)")
+    snap_parser.add_argument("--plane", action="store", dest="plane", default="xy", choices=("xy", "xz", "yz"),
+                        help="Cross-section plane")
+    snap_parser.add_argument("--position", action="store", dest="position", type=float, default=0.0,
+                        help="Position of the plane along the remaining axis")
+    snap_parser.add_argument("--substrate", action="store", dest="substrate", default=None,
+                        help="Name of the substrate drawn as heatmap (none by default)")
+    snap_parser.add_argument("--time-range", action="store", dest="time_range", default=None,
+                        help="Only plot the snapshots with start <= time <= end, given as start:end (either can be empty)")
+    snap_parser.add_argument("--fig-format", action="store", dest="fig_format", default="png",
+                        help="Image format of the figures (png, svg, pdf, ...)")
+    snap_parser.add_argument("--size", action="store", dest="size", type=float, default=6,
+                        help="Figure size in inches")
+    snap_parser.add_argument("--dpi", action="store", dest="dpi", type=int, default=150,
+                        help="Figure resolution")
+    snap_parser.add_argument("--cpus", action="store", dest="cpus", type=int, default=1, 
+                        help="Total cpus used to plot the snapshots in parallel")
+
+
+    contacts_parser = subparser.add_parser('contacts',
+                                           description="Contact graph and cluster statistics of every snapshot (cells touch when closer than the sum of their radii)")
+    contacts_parser.add_argument("--csvout", action="store", dest="csv_fname", default="./contacts.csv",
+                        help="File name to store the per-snapshot statistics")
+    contacts_parser.add_argument("--sizes-out", action="store", dest="sizes_fname", default=None,
+                        help="File name to store the number of clusters of each size in each snapshot")
+    contacts_parser.add_argument("--tolerance", action="store", dest="tolerance", type=float, default=0.0,
+                        help="Extra distance added to the sum of radii of two cells in contact")
+    contacts_parser.add_argument("--cpus", action="store", dest="cpus", type=int, default=1, 
+                        help="Total cpus used to process the snapshots in parallel")
+
+
+    bench_parser = subparser.add_parser('benchmark',
+                                        description="Time the main pctk paths on a synthetic output written into output_folder")
+    bench_parser.add_argument("--cells", action="store", dest="num_cells", type=int, default=10000,
+                        help="Number of cells of each synthetic snapshot")
+    bench_parser.add_argument("--snapshots", action="store", dest="num_snapshots", type=int, default=5,
+                        help="Number of synthetic snapshots")
+    bench_parser.add_argument("--grid", action="store", dest="grid_size", type=int, default=50,
+                        help="Voxels per axis of the synthetic microenvironment")
+    bench_parser.add_argument("--substrates", action="store", dest="num_substrates", type=int, default=1,
+                        help="Number of substrates of the synthetic microenvironment")
+    bench_parser.add_argument("--repeat", action="store", dest="repeat", type=int, default=3,
+                        help="Times each case is run, the best timing is reported")
+    bench_parser.add_argument("--cpus", action="store", dest="cpus", type=int, default=1, 
+                        help="Total cpus used by the parallel cases")
+    bench_parser.add_argument("--existing", action='store_true',
+                        help="Benchmark the output already stored in output_folder instead of writing a synthetic one")
+    bench_parser.add_argument("--out", action="store", dest="json_fname", default="benchmark.json",
+                        help="File name to store the results as JSON")
+    bench_parser.add_argument("--compare", action="store", dest="baseline", default=None,
+                        help="JSON file of a previous run to compare against; exits with 1 if a case got slower")
+    bench_parser.add_argument("--threshold", action="store", dest="threshold", type=float, default=0.1,
+                        help="Relative slowdown reported as a regression by --compare")
+
+
+    archive_parser = subparser.add_parser('archive',
+                                          description="Store the cells of every snapshot in a delta-encoded compressed archive")
+    archive_parser.add_argument("--out", action="store", dest="archive_fname", default="cells.pctka",
+                        help="Archive file name")
+    archive_parser.add_argument("--keyframes", action="store", dest="keyframe_interval", type=int, default=10,
+                        help="Snapshots between keyframes, which bound the snapshots decoded for random access")
+    archive_parser.add_argument("--codec", action="store", dest="codec", default=None, choices=("zstd", "blosc", "zlib"),
+                        help="Compression codec (default: the best one installed)")
+
+
+    serve_parser = subparser.add_parser('serve',
+                                        description="Serve the snapshots of output_folder over HTTP, keeping decoded snapshots in memory")
+    serve_parser.add_argument("--host", action="store", dest="host", default="127.0.0.1",
+                        help="Address the server listens on")
+    serve_parser.add_argument("--port", action="store", dest="port", type=int, default=8765,
+                        help="Port the server listens on")
+    serve_parser.add_argument("--cache-mb", action="store", dest="cache_mb", type=int, default=1024,
+                        help="Memory used to keep decoded snapshots, in MB")
+
+
+    cloud_parser = subparser.add_parser('point-cloud',
+                                        description="Export the cells of every snapshot as binary VTK PolyData (.vtp, with a .pvd time series) or PLY point clouds")
+    cloud_parser.add_argument("--out-folder", action="store", dest="out_folder", default=None,
+                        help="Folder to store the point cloud files (the output folder by default)")
+    cloud_parser.add_argument("--file-format", action="store", dest="file_format", default="vtp", choices=("vtp", "ply"),
+                        help="File format of the point clouds")
+    cloud_parser.add_argument("--idxs", action="store", dest="strn_idxs", default="all",
+                        help="Indexes of the snapshots to export: slices (1:10:1), indexes (1,2,5,10) or all")
+    cloud_parser.add_argument("--cpus", action="store", dest="cpus", type=int, default=1, 
+                        help="Total cpus used to export the snapshots in parallel")
 
 
     pov_parser = subparser.add_parser('povray')
     pov_parser.add_argument("--config", action="store", help="XML configuration file for creating pov files")
     pov_parser.add_argument("--render",  action='store_true',
                         help="Render the .pov files into .png. Requires PovRay ({povray_link})")
+    pov_parser.add_argument("--preview",  action='store_true',
+                        help="Render quick .png previews in-process with numpy instead of writing .pov files")
+    pov_parser.add_argument("--projection", action="store", dest="projection", default="perspective",
+                        choices=("perspective", "orthographic"), help="Camera projection used by --preview")
     pov_parser.add_argument("--width", action="store", dest="width", type=int, default=2160, 
                         help="Width for povray rendered image")
     pov_parser.add_argument("--height", action="store", dest="height", type=int, default=2160, 
                         help="Heigh for povray rendered image")
     pov_parser.add_argument("--cpus", action="store", dest="cpus", type=int, default=4, 
                         help="Total cpus available to run in parallel using multiprocessing")
+    pov_parser.add_argument("--incremental",  action='store_true',
+                        help="Skip the .pov/.png files whose config and input files did not change since the last run")
+    pov_parser.add_argument("--cache", action='store_true',
+                        help="Keep the decoded columns in output_folder/.pctk_cache to speed up later runs")
     pov_parser.add_argument("--create-config", action="store", dest="config_out", default=None,
                                 help="Create a default config XML file for generating POV files")
     pov_parser.add_argument("--idxs", action="store", dest="strn_idxs", default="",
@@ -65,22 +193,136 @@ def main():
                             - all (use glob)")
     
 
+    animate_parser = subparser.add_parser('animate',
+                                          description="Assemble the rendered frames into a GIF, MP4 or WebM animation")
+    animate_parser.add_argument("--pattern", action="store", dest="pattern", default=None,
+                        help="Glob pattern of the frames inside output_folder (default: *.png, or *.svg if there are no PNGs)")
+    animate_parser.add_argument("--out", action="store", dest="anim_fname", default="animation.gif",
+                        help="Animation file name. The format (.gif, .mp4, .webm, .mkv) is taken from the extension")
+    animate_parser.add_argument("--fps", action="store", dest="fps", type=float, default=10,
+                        help="Frames per second")
+    animate_parser.add_argument("--width", action="store", dest="width", type=int, default=None,
+                        help="Downscale the frames to this width")
+    animate_parser.add_argument("--threads", action="store", dest="threads", type=int, default=1,
+                        help="Threads used to decode and downscale the frames")
+
     args = parser.parse_args()
+    # Figures are always saved to files, no display is needed
+    os.environ.setdefault("MPLBACKEND", "Agg")
+
+    if not (args.profile or args.profile_out):
+        run_command(args, parser, pov_parser)
+        return
+
+    from pctk import profiling
+    profiling.enable()
+    profiler = None
+    if args.profile_out:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run_command(args, parser, pov_parser)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile_out)
+        print()
+        print(profiling.stats.report())
+        if profiler is not None:
+            print(f"Saving cProfile stats as {args.profile_out}")
+
+
+def run_command(args, parser, pov_parser):
     if args.command == "plot-time-course":
-        plot.plot_time_course(args.output_folder, fig_fname=args.fig_fname, csv_fname=args.csv_fname, format=args.format)
+        from pctk import plot
+        plot.plot_time_course(args.output_folder, fig_fname=args.fig_fname, csv_fname=args.csv_fname, format=args.format,
+                              cache=args.cache, processes=args.cpus)
+    elif args.command == "plot-snapshots":
+        from pctk import plot
+        if args.format != "physicell":
+            # Cross-sections need the cells positions and the mesh of the PhysiCell files
+            print(f"Error: plot-snapshots only reads PhysiCell output folders, not --format {args.format}")
+            sys.exit(1)
+        time_range = None
+        if args.time_range:
+            low, high = args.time_range.split(":")
+            time_range = (float(low) if low else None, float(high) if high else None)
+        plot.plot_snapshots(args.output_folder, out_folder=args.out_folder, plane=args.plane, 
+                            position=args.position, substrate=args.substrate, time_range=time_range,
+                            processes=args.cpus, format=args.fig_format, size=args.size, dpi=args.dpi)
+    elif args.command == "contacts":
+        from pctk import backends, contacts
+        backend = backends.get_backend(args.output_folder, format=args.format)
+        stats, sizes = contacts.contact_statistics(backend, tolerance=args.tolerance, processes=args.cpus)
+        stats.to_csv(args.csv_fname, sep="\t", index=False)
+        print("Saving csv as %s" % args.csv_fname)
+        if args.sizes_fname:
+            sizes.to_csv(args.sizes_fname, sep="\t", index=False)
+            print("Saving csv as %s" % args.sizes_fname)
+    elif args.command == "sweep-summary":
+        from pctk import sweep
+        columns = [c for c in args.columns.split(",") if c]
+        sweep.sweep_summary(args.output_folder, format=args.format, columns=columns, 
+                            csv_fname=args.csv_fname, fig_fname=args.fig_fname, cache=args.cache,
+                            processes=args.cpus, confidence=args.confidence)
+    elif args.command == "benchmark":
+        from pctk import benchmark
+        report = benchmark.run_benchmarks(args.output_folder, num_cells=args.num_cells, 
+                                          num_snapshots=args.num_snapshots, grid_size=args.grid_size,
+                                          num_substrates=args.num_substrates, repeat=args.repeat,
+                                          processes=args.cpus, existing=args.existing,
+                                          json_fname=args.json_fname)
+        if args.baseline:
+            if benchmark.compare_benchmarks(args.baseline, report, threshold=args.threshold):
+                sys.exit(1)
+    elif args.command == "archive":
+        from pctk.archive import write_archive
+        from pctk.multicellds import MultiCellDS
+        write_archive(MultiCellDS(output_folder=args.output_folder), args.archive_fname, 
+                      keyframe_interval=args.keyframe_interval, codec=args.codec)
+    elif args.command == "serve":
+        from pctk import server
+        server.serve(args.output_folder, host=args.host, port=args.port, cache_mb=args.cache_mb)
+    elif args.command == "point-cloud":
+        from pctk.pointcloud import write_point_clouds
+        write_point_clouds(args.output_folder, index_list=parse_index_string(args.strn_idxs), format=args.format,
+                           out_folder=args.out_folder, file_format=args.file_format, processes=args.cpus)
     elif args.command == "povray":
+        from pctk import render
+        from pctk.povwriter import create_defulat_config
         if args.config_out:
             print(f"Writing default POV-write config into {args.config_out}.")
             create_defulat_config(args.config_out, args.output_folder)
         else:
             if args.config:
                 index_list = parse_index_string(args.strn_idxs)
+                if args.preview:
+                    render.write_preview_files(args.config, index_list=index_list, format=args.format,
+                                               width=args.width, height=args.height, 
+                                               projection=args.projection, cache=args.cache)
+                    return
                 render.write_pov_files(args.config, index_list=index_list, format=args.format,
                                        num_of_threads=args.cpus, render=args.render, 
-                                       width=args.width, height=args.height)
+                                       width=args.width, height=args.height,
+                                       incremental=args.incremental, cache=args.cache)
             else:
                 print("Error: --config is required parameter")
                 pov_parser.print_help()
+    elif args.command == "animate":
+        from pctk import render
+        if args.pattern:
+            frames = sorted(glob.glob(os.path.join(args.output_folder, args.pattern)))
+        else:
+            frames = sorted(glob.glob(os.path.join(args.output_folder, "*.png")))
+            if len(frames) == 0:
+                frames = sorted(glob.glob(os.path.join(args.output_folder, "*.svg")))
+        if len(frames) == 0:
+            print(f"Error: no frames found in {args.output_folder}")
+            sys.exit(1)
+        render.animate_pngs(frames, out_fname=args.anim_fname, fps=args.fps, 
+                            width=args.width, threads=args.threads)
+        print(f"Saving animation as {args.anim_fname}")
     else:
         parser.parse_args(["--help"])
         sys.exit(0)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import numpy as np
+
+
+# Phase groups of the statistics tables, cells whose phase has no group in
+# the phase_grouping of the config are reported as "other"
+PHASE_GROUPS = ["alive", "apoptotic", "necrotic", "other"]
+
+DEFAULT_STATISTICS = ("count", "mean", "std", "min", "max")
+
+
+def phase_group_lookup(phases_dict, phase_grouping, groups=PHASE_GROUPS):
+    # Array mapping each phase code to the position of its group in groups
+    lookup = np.full(max(phases_dict) + 1, len(groups) - 1, dtype=np.int64)
+    for code, name in phases_dict.items():
+        if name in phase_grouping:
+            lookup[code] = groups.index(phase_grouping[name])
+    return lookup
+
+
+def phase_groups(phase, lookup, other):
+    codes = phase.astype(np.int64)
+    groups = np.full(codes.shape, other, dtype=np.int64)
+    known = (codes >= 0) & (codes < len(lookup))
+    groups[known] = lookup[codes[known]]
+    return groups
+
+
+def quantile_name(q):
+    return "q%g" % (100 * q)
+
+
+def grouped_statistics(values, keys, num_groups, statistics=DEFAULT_STATISTICS, quantiles=()):
+    # Statistics of each column of values (cells x columns) for the cells of
+    # each group (keys in [0, num_groups)), ignoring NaNs. Returns a dict of
+    # (num_groups, columns) arrays; groups without cells are NaN (count 0).
+    num_columns = values.shape[1]
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    values = values[order]
+
+    sizes = np.bincount(keys, minlength=num_groups)
+    present = np.flatnonzero(sizes)
+    starts = np.searchsorted(keys, present)
+
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    counts = np.zeros((num_groups, num_columns), dtype=np.int64)
+    if len(present):
+        counts[present] = np.add.reduceat(valid, starts, axis=0)
+
+    def empty():
+        return np.full((num_groups, num_columns), np.nan)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = empty()
+        if len(present):
+            mean[present] = np.add.reduceat(filled, starts, axis=0) / counts[present]
+
+        results = {}
+        for statistic in statistics:
+            result = empty()
+            if statistic == "count":
+                result = counts.copy()
+            elif statistic == "mean":
+                result = mean
+            elif statistic == "std":
+                # Two-pass sample standard deviation, as pandas
+                deviation = np.where(valid, values - mean[keys], 0.0)
+                if len(present):
+                    squares = np.add.reduceat(deviation * deviation, starts, axis=0)
+                    result[present] = np.sqrt(squares / (counts[present] - 1))
+                result[counts < 2] = np.nan
+            elif statistic == "min" and len(present):
+                result[present] = np.fmin.reduceat(values, starts, axis=0)
+            elif statistic == "max" and len(present):
+                result[present] = np.fmax.reduceat(values, starts, axis=0)
+            elif statistic not in ("min", "max"):
+                raise ValueError(f"Unknown statistic {statistic}")
+            results[statistic] = result
+
+        if len(quantiles) and len(present):
+            # Sorting the values of each group (NaNs go last) and interpolating
+            # linearly between the closest ranks
+            q = np.asarray(quantiles, dtype=float)
+            for j in range(num_columns):
+                sorted_values = values[np.lexsort((values[:, j], keys)), j]
+                n = counts[present, j][:, None]
+                position = q[None, :] * np.maximum(n - 1, 0)
+                low = np.floor(position).astype(np.int64)
+                high = np.minimum(low + 1, np.maximum(n - 1, 0))
+                base = starts[:, None]
+                value = sorted_values[base + low] + (position - low) * (sorted_values[base + high] - sorted_values[base + low])
+                value[n[:, 0] == 0] = np.nan
+                for i, qi in enumerate(q):
+                    name = quantile_name(qi)
+                    results.setdefault(name, empty())[present, j] = value[:, i]
+        for qi in quantiles:
+            results.setdefault(quantile_name(qi), empty())
+    return results
+
+
+def grouped_histogram(values, keys, num_groups, edges):
+    # Number of cells of each group in each bin; like numpy.histogram the
+    # last bin includes its right edge and NaNs or values outside are dropped
+    edges = np.asarray(edges, dtype=float)
+    num_bins = len(edges) - 1
+    bins = np.searchsorted(edges, values, side="right") - 1
+    bins[values == edges[-1]] = num_bins - 1
+    inside = (bins >= 0) & (bins < num_bins)
+    flat = keys[inside] * num_bins + bins[inside]
+    return np.bincount(flat, minlength=num_groups * num_bins).reshape(num_groups, num_bins)
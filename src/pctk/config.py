@@ -43,6 +43,13 @@ phases_dict = {
     104: "debris"
     }
 
+# Integer coded cell columns and their dtype in compact cell frames
+integer_columns = {
+    "ID": "int32",
+    "cell_type": "int16",
+    "cycle_model": "int16",
+    }
+
 default_cell_colors = {
     'alive': '#75db75', 
     'apoptotic': '#ef4242', 
@@ -82,6 +89,10 @@ DEFAULT_XML = """<?xml version="1.0" encoding="UTF-8"?>
 		<nuclear_offset units="micron">0.1</nuclear_offset> <!-- how far to clip nuclei in front of cyto --> 
 		<cell_bound units="micron">500</cell_bound> <!-- only plot if |x| , |y| , |z| < cell_bound -->
 		<threads>1</threads>
+		<frustum_culling>false</frustum_culling> <!-- skip cells outside the camera view (also drops their shadows) -->
+		<occlusion_culling>false</occlusion_culling> <!-- skip cells buried inside dense spheroids -->
+		<occlusion_voxel_size units="micron">0</occlusion_voxel_size> <!-- 0: use the median cell diameter -->
+		<lod_pixels>0</lod_pixels> <!-- merge cells projecting smaller than this radius in pixels; 0 disables --> 
 	</options>
 
 	<save> 
@@ -95,6 +106,23 @@ DEFAULT_XML = """<?xml version="1.0" encoding="UTF-8"?>
 		<clipping_plane>-1,0,0,0</clipping_plane>
 		<clipping_plane>0,0,1,0</clipping_plane>
 	</clipping_planes>
+
+	<!-- optional named views, each one writes its own output_<view>.pov from a single read of the cells file. -->
+	<!-- a view overrides the camera and/or clipping planes above; an empty clipping_planes node removes them -->
+	<!--
+	<views>
+		<view name="front">
+			<clipping_planes/>
+		</view>
+		<view name="top">
+			<camera>
+				<distance_from_origin units="micron">750</distance_from_origin>
+				<xy_angle>3.92699081699</xy_angle>
+				<yz_angle>0.01</yz_angle>
+			</camera>
+		</view>
+	</views>
+	-->
 	
 	<!-- if using standard coloring (above), these will be used --> 
 	<!-- otherwise, the code will look for a user-defined color/finish function -->  <!-- done --> 
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from pctk import profiling
+
+
+def cell_radii(total_volume):
+    # Radius of the sphere with the volume of each cell
+    return np.cbrt(3 * np.asarray(total_volume, dtype=float) / (4 * np.pi))
+
+
+def contact_pairs(positions, radii, tolerance=0.0):
+    # (i, j) pairs of touching cells, distance < radii[i] + radii[j] + tolerance,
+    # found with a KD-tree among the pairs closer than the largest possible sum
+    positions = np.asarray(positions, dtype=float)
+    if len(positions) < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    tree = cKDTree(positions)
+    pairs = tree.query_pairs(2 * radii.max() + tolerance, output_type="ndarray")
+    distance = np.sqrt(((positions[pairs[:, 0]] - positions[pairs[:, 1]]) ** 2).sum(axis=1))
+    return pairs[distance < radii[pairs[:, 0]] + radii[pairs[:, 1]] + tolerance]
+
+
+def contact_graph(pairs, num_cells):
+    # Symmetric sparse adjacency matrix of the contact graph
+    rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    cols = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    data = np.ones(len(rows), dtype=np.int8)
+    return coo_matrix((data, (rows, cols)), shape=(num_cells, num_cells)).tocsr()
+
+
+def snapshot_contacts(positions, radii, tolerance=0.0):
+    # Number of neighbors of each cell and the cluster (connected component
+    # of the contact graph) each cell belongs to
+    num_cells = len(positions)
+    pairs = contact_pairs(positions, radii, tolerance=tolerance)
+    neighbors = np.bincount(pairs.reshape(-1), minlength=num_cells)
+    if num_cells == 0:
+        return neighbors, np.zeros(0, dtype=np.int64)
+    _, labels = connected_components(contact_graph(pairs, num_cells), directed=False)
+    return neighbors, labels
+
+
+def cluster_statistics(neighbors, labels):
+    # Summary of the contact graph of one snapshot and the number of
+    # clusters of each size
+    sizes = np.bincount(labels) if len(labels) else np.zeros(0, dtype=np.int64)
+    size_values, size_counts = np.unique(sizes, return_counts=True)
+    stats = {
+        "num_cells": len(labels),
+        "num_contacts": int(neighbors.sum()) // 2,
+        "mean_neighbors": neighbors.mean() if len(neighbors) else np.nan,
+        "max_neighbors": int(neighbors.max()) if len(neighbors) else 0,
+        "isolated_cells": int((neighbors == 0).sum()),
+        "num_clusters": len(sizes),
+        "largest_cluster": int(sizes.max()) if len(sizes) else 0,
+        "mean_cluster_size": sizes.mean() if len(sizes) else np.nan,
+    }
+    return stats, dict(zip(size_values.tolist(), size_counts.tolist()))
+
+
+def _radius_columns(backend):
+    # PhysiBoSS outputs store the radius, PhysiCell the total volume
+    if "radius" in backend.aliases:
+        return backend.resolve("radius"), False
+    return backend.resolve("total_volume"), True
+
+
+def _contacts_task(args):
+    backend, snapshot, tolerance = args
+    columns = [backend.resolve("x"), backend.resolve("y"), backend.resolve("z")]
+    radius_column, from_volume = _radius_columns(backend)
+    data = backend.load_columns(snapshot, columns + [radius_column])
+    radii = cell_radii(data[:, 3]) if from_volume else data[:, 3]
+    with profiling.timer("contact_graph"):
+        neighbors, labels = snapshot_contacts(data[:, :3], radii, tolerance=tolerance)
+    return backend.get_time(snapshot), cluster_statistics(neighbors, labels)
+
+
+def contact_statistics(backend, tolerance=0.0, processes=1):
+    # Contact graph and cluster statistics of every snapshot of a backend
+    # (see pctk.backends), one snapshot per task in a pool of processes.
+    # Returns a table with one row per snapshot and a long table with the
+    # number of clusters of each size in each snapshot.
+    tasks = [(backend, snapshot, tolerance) for snapshot in backend.list_snapshots()]
+    if processes > 1 and len(tasks) > 1:
+        with mp.Pool(processes) as pool:
+            results = list(profiling.collect(pool.imap(profiling.task(_contacts_task), tasks)))
+    else:
+        results = [_contacts_task(task) for task in tasks]
+
+    rows = []
+    sizes = []
+    for time, (stats, size_counts) in results:
+        rows.append(dict(time=time, **stats))
+        sizes += [(time, size, count) for size, count in size_counts.items()]
+    stats = pd.DataFrame(rows, columns=["time", "num_cells", "num_contacts", "mean_neighbors", "max_neighbors",
+                                        "isolated_cells", "num_clusters", "largest_cluster", "mean_cluster_size"])
+    sizes = pd.DataFrame(sizes, columns=["time", "cluster_size", "num_clusters"])
+    return stats, sizes
+
+
+def frames_contacts_iterator(mcds, tolerance=0.0):
+    # Per-cell neighbor counts and cluster labels of every snapshot of a
+    # MultiCellDS, yielded as (time, frame with "neighbors" and "cluster"
+    # columns indexed by cell ID)
+    for time, df in mcds.cells_as_frames_iterator():
+        positions = df[["x_position", "y_position", "z_position"]].values
+        neighbors, labels = snapshot_contacts(positions, cell_radii(df["total_volume"].values), tolerance=tolerance)
+        yield time, pd.DataFrame({"neighbors": neighbors, "cluster": labels}, index=df.index)
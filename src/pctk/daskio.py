@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import os
+import glob
+import numpy as np
+import pandas as pd
+
+from pctk import readers
+
+
+# Lazy dask views over every snapshot of a MultiCellDS. Nothing is read
+# until a result is computed: each snapshot is a partition (or a chunk)
+# loaded by its own task, so the queries run in parallel with the local
+# scheduler, and the cells partitions only read the columns the query uses.
+
+_dask = None
+
+
+def _load_dask():
+    global _dask
+    if _dask is None:
+        try:
+            import dask
+            import dask.array as da
+            import dask.dataframe as dd
+            _dask = (dask, da, dd)
+        except ImportError:
+            _dask = False
+    return _dask
+
+
+def _require_dask():
+    if not _load_dask():
+        raise ImportError("The dask views of pctk require dask, install it with pip install pctk[dask]")
+    return _dask
+
+
+def load_snapshot_cells(snapshot, output_folder, cell_columns, columns=None):
+    # Cells of one snapshot, given as (time, cells file), with the time as a
+    # column. dask passes the columns used by the query, the others are not read.
+    time, cells_fname = snapshot
+    if columns is None:
+        columns = ["time"] + list(cell_columns)
+    names = [c for c in columns if c != "time"]
+    # At least one column is read to know the number of cells
+    cells = _read_cells(output_folder, cells_fname, cell_columns, names or list(cell_columns[:1]))
+    data = {"time": np.full(cells.shape[0], time, dtype=np.int64)}
+    for i, name in enumerate(names):
+        data[name] = cells[:, i]
+    return pd.DataFrame(data, columns=list(columns))
+
+
+def _read_cells(output_folder, cells_fname, cell_columns, names):
+    if cells_fname is None:
+        return np.zeros((0, len(names)))
+    rows = [cell_columns.index(c) for c in names]
+    return readers.read_physicell_cells(os.path.join(output_folder, cells_fname), rows=rows)
+
+
+def _snapshots(mcds, section):
+    # (time, file name) of every snapshot, from the given section of its XML
+    key = {"cells": "cells_fname", "microenvironment": "microenvironment_fname"}[section]
+    snapshots = []
+    for xml_fname in sorted(glob.glob(mcds._globing)):
+        info = mcds._parse_snapshot(xml_fname, sections=("time", section))
+        snapshots.append((info["time"], info[key]))
+    return snapshots
+
+
+def cells_to_dask(mcds, columns=None):
+    # dask DataFrame with the cells of every snapshot, one partition per
+    # snapshot, the time as a column and the cell_columns (or columns)
+    _, _, dd = _require_dask()
+    cell_columns = list(mcds.cell_columns)
+    if columns is None:
+        columns = cell_columns
+    columns = ["time"] + [c for c in columns if c != "time"]
+    meta = load_snapshot_cells((0, None), mcds._output_folder, cell_columns, columns=columns)
+    snapshots = _snapshots(mcds, "cells")
+    return dd.from_map(load_snapshot_cells, snapshots, args=[mcds._output_folder, cell_columns],
+                       columns=columns, meta=meta, label="pctk-cells")
+
+
+def _substrate_grids(mcds, matfile, shape):
+    # Rows x, y, z, voxel volume and one row per substrate, x varying fastest
+    matrix = mcds._read_microenvironment_matrix(matfile)
+    return matrix[4:4 + shape[0]].reshape(shape)
+
+
+def microenvironment_to_dask(mcds, cube=False):
+    # dask array of shape (time, substrate, nz, ny, nx), one chunk per
+    # snapshot. With cube the chunks are read from the memory mapped
+    # substrate cube (see pctk.substrates), one substrate grid per chunk.
+    dask, da, _ = _require_dask()
+    if cube:
+        data = mcds.get_substrate_cube().data
+        return da.from_array(data, chunks=(1, 1) + data.shape[2:])
+
+    x, y, z = mcds.get_mesh_coordinates()
+    shape = (len(mcds.microenvironment_columns), len(z), len(y), len(x))
+    load = dask.delayed(_substrate_grids, pure=True)
+    chunks = [da.from_delayed(load(mcds, matfile, shape), shape=shape, dtype=np.float64)
+              for _, matfile in _snapshots(mcds, "microenvironment")]
+    if len(chunks) == 0:
+        return da.zeros((0,) + shape, chunks=(1,) + shape)
+    return da.stack(chunks)
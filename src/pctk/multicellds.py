@@ -1,11 +1,17 @@
 import os
 import glob
+import numpy as np
 import pandas as pd
 from scipy.io import loadmat    
 import xml.etree.ElementTree as ET
 
+from . import profiling
+from . import readers
+from . import column_stats
+from .reducers import CountReducer
 from .config import phases_dict as default_phases_dict
 from .config import phase_grouping as default_phase_grouping
+from .config import integer_columns as default_integer_columns
 
 __author__ = "Miguel Ponce de Leon"
 __copyright__ = "Copyright 2020, PhysiCell ToolKit project"
@@ -19,6 +25,15 @@ __status__ = "dev"
 
 class Metadata(object):
     def __init__(self, tree):
+        # tree is either an ElementTree or the dict returned by
+        # readers.read_snapshot_metadata
+        if isinstance(tree, dict):
+            self._current_time = int(tree["current_time"])
+            self._time_units = tree["time_units"]
+            self._current_runtime = tree["current_runtime"]
+            self._runtime_units = tree["runtime_units"]
+            self._spatial_units = tree["spatial_units"]
+            return
 
         root = tree.getroot()
         metadata_node = root.find("metadata")
@@ -71,20 +86,25 @@ class MultiCellDS(object):
         self._phases_dict = default_phases_dict
         self._phase_grouping = default_phase_grouping
 
-        xml_fname = os.path.join(output_folder, xml_fname)
-        self._tree = ET.parse(xml_fname)
+        # The initial XML is streamed for its metadata, the full tree is only
+        # parsed if some method asks for it
+        self._xml_fname = os.path.join(output_folder, xml_fname)
+        self._parsed_tree = None
+        self._info = readers.read_snapshot_metadata(self._xml_fname)
 
-        self._metadata = Metadata(self._tree)
+        self._metadata = Metadata(self._info)
         self._cell_columns = self._get_cell_columns()
         self._microenvironment_columns = self._get_microenvironment_columns()
 
 
+    @property
+    def _tree(self):
+        if self._parsed_tree is None:
+            self._parsed_tree = ET.parse(self._xml_fname)
+        return self._parsed_tree
+
     def _get_time_units(self):
-        root = self._tree.getroot()
-        node = root.find("metadata")
-        node = node.find("current_time")
-        units = node.attrib['units']
-        return units
+        return self._info["time_units"]
 
     def _get_cell_info_recursive(self, node):
 
@@ -100,55 +120,14 @@ class MultiCellDS(object):
         return self._get_cell_info_recursive(childs[0])
     
     def _get_cell_columns(self):
-        root = self._tree.getroot()
-        node = root.find("cellular_information")
-        
-        node = self._get_cell_info_recursive(node)
-        cellular_info_node = node.find("labels")
-        
-        cell_columns = []
-        for child in cellular_info_node:
-            column = child.text
-            index = child.attrib["index"]
-            size = int(child.attrib["size"])
-            if size < 1:
-                return cell_columns
-            if size == 1:
-                cell_columns.append(column)
-                continue
-            if size == 2:
-                for i, v in enumerate(['x', 'y']):
-                    cell_columns.append(v + self._separator + column)
-                    if i == size: 
-                        break
-            if size == 3:
-                for i, v in enumerate(['x', 'y', 'z']):
-                    cell_columns.append(v + self._separator + column)
-                    if i == size: 
-                        break
-            if size > 3:
-                for I in range(size):
-                    cell_columns.append(f"{v}{self._separator}{column}")
-                    if i == size: 
-                        break
-                
-                
-        return cell_columns
+        return readers.cell_columns_from_labels(self._info["labels"], sep=self._separator)
 
     def _get_microenvironment_columns(self):
-        root = self._tree.getroot()
-        node = root.find("microenvironment")
-        node = node.find("domain")
-        node = node.find("variables")
-        
-        columns = []
-        for child in node.findall("variable"):
-            name = child.attrib['name']
-            units = child.attrib['units']
-            ID = child.attrib['ID']
-            columns.append((name, units, ID))
-            
-        return columns
+        return list(self._info["variables"])
+
+    def get_mesh_coordinates(self):
+        # Centers of the microenvironment voxels along each axis
+        return tuple(self._info[f"{axis}_coordinates"] for axis in ("x", "y", "z"))
 
     @property
     def current_time(self):
@@ -188,7 +167,9 @@ class MultiCellDS(object):
 
     def _read_matlab_mat(self, fname, column):
         try:
-            stru = loadmat(fname)
+            profiling.count_file(fname)
+            with profiling.timer("loadmat"):
+                stru = loadmat(fname)
             data = stru[column]
             return data
         except:
@@ -212,32 +193,232 @@ class MultiCellDS(object):
         return node.text
 
     def get_cells_matrix(self, tree):
-        matfile = self.get_cells_fname(tree)
+        return self._read_cells_matrix(self.get_cells_fname(tree))
+
+    def _read_cells_matrix(self, matfile):
         matfile = os.path.join(self._output_folder, matfile)
         data = self._read_matlab_mat(matfile, "cells")
         return data.T
 
+    def _parse_snapshot(self, xml_fname, sections=("time", "cells")):
+        # Only the given sections of the snapshot XML are read (see
+        # readers.read_snapshot_metadata), current_time rounded like get_time
+        profiling.count("snapshots")
+        profiling.count_file(xml_fname)
+        with profiling.timer("xml_parse"):
+            info = readers.read_snapshot_metadata(xml_fname, sections=sections)
+        info["time"] = int(info["current_time"])
+        return info
+
     def cells_as_matrix_iterator(self):
         xml_list = sorted(glob.glob(self._globing))
         for xml_fname in xml_list:
-            tree = ET.parse(xml_fname)
-            cell_matrix = self.get_cells_matrix(tree)
+            info = self._parse_snapshot(xml_fname)
+            cell_matrix = self._read_cells_matrix(info["cells_fname"])
+            profiling.count("cells", cell_matrix.shape[0])
             
-            time = self.get_time(tree)
-            yield (time, cell_matrix)
-
-    def cells_as_frames_iterator(self):
+            yield (info["time"], cell_matrix)
+
+    def _compact_frame(self, cell_matrix, float32=False, phase_col="current_phase"):
+        # Integer coded columns (see config.integer_columns) as small integers,
+        # phases as a Categorical of the phases_dict names and, optionally,
+        # every other column as float32. Columns whose values do not fit the
+        # integer dtype are kept as floats and unknown phase codes become
+        # categories named after the code.
+        data = {}
+        for i, name in enumerate(self._cell_columns):
+            values = cell_matrix[:, i]
+            dtype = default_integer_columns.get(name)
+            if name == phase_col:
+                codes = values.astype(np.int64)
+                known = list(self.phases_dict)
+                unknown = np.setdiff1d(codes, known)
+                categories = [self.phases_dict[k] for k in known] + [str(k) for k in unknown.tolist()]
+                lookup = np.concatenate([np.array(known, dtype=np.int64), unknown])
+                order = np.argsort(lookup)
+                positions = order[np.searchsorted(lookup[order], codes)]
+                data[name] = pd.Categorical.from_codes(positions, categories=categories)
+            elif dtype is not None and np.array_equal(values, values.astype(dtype)):
+                data[name] = values.astype(dtype)
+            elif float32:
+                data[name] = values.astype(np.float32)
+            else:
+                data[name] = values
+        return pd.DataFrame(data)
+
+    def cells_as_frames_iterator(self, compact=False, float32=False):
+        # With compact the frames use small integer dtypes and a Categorical
+        # phase column instead of float64 (see _compact_frame). Most columns
+        # are continuous, so compact alone saves little memory; float32,
+        # which implies compact, also stores them as float32 and halves it.
         xml_list = sorted(glob.glob(self._globing))
         for xml_fname in xml_list:
-            tree = ET.parse(xml_fname)
-            cell_matrix = self.get_cells_matrix(tree)
+            info = self._parse_snapshot(xml_fname)
+            cell_matrix = self._read_cells_matrix(info["cells_fname"])
+            profiling.count("cells", cell_matrix.shape[0])
             
-            df = pd.DataFrame(cell_matrix, columns=self._cell_columns)
-            df = df.set_index("ID")
+            with profiling.timer("dataframe"):
+                if compact or float32:
+                    df = self._compact_frame(cell_matrix, float32=float32)
+                else:
+                    df = pd.DataFrame(cell_matrix, columns=self._cell_columns)
+                df = df.set_index("ID")
         
-            time = self.get_time(tree)
-            yield (time, df)
+            yield (info["time"], df)
   
+    def reduce_cells_iterator(self, make_reducers, chunk_size=2**18):
+        # Feeds the cells of every snapshot, in blocks of chunk_size cells, to
+        # the reducers returned by make_reducers() (a fresh list per snapshot)
+        # and yields (time, reducers). Only the columns used by the reducers
+        # are decoded and memory use does not depend on the number of cells.
+        xml_list = sorted(glob.glob(self._globing))
+        for xml_fname in xml_list:
+            info = self._parse_snapshot(xml_fname)
+            reducers = make_reducers()
+            names = []
+            for reducer in reducers:
+                names += [c for c in reducer.columns if c not in names]
+            index = {name: i for i, name in enumerate(names)}
+            rows = [self._cell_columns.index(name) for name in names]
+
+            matfile = os.path.join(self._output_folder, info["cells_fname"])
+            profiling.count_file(matfile)
+            for chunk in readers.iter_physicell_cells_chunks(matfile, chunk_size=chunk_size, rows=rows):
+                profiling.count("cells", chunk.shape[0])
+                with profiling.timer("reduce"):
+                    for reducer in reducers:
+                        reducer.update(chunk, index)
+
+            yield (info["time"], reducers)
+
+    def _phase_counts_iterator(self, phase_col, chunk_size=None):
+        # Yields (time, {phase name: number of cells}) for every snapshot
+        if chunk_size is not None:
+            make_reducers = lambda: [CountReducer(phase_col)]
+            for time, (reducer,) in self.reduce_cells_iterator(make_reducers, chunk_size=chunk_size):
+                counts = {self.phases_dict.get(int(k), k): v for k, v in reducer.result().items()}
+                yield time, counts
+            return
+
+        for time, df in self.cells_as_frames_iterator():
+            # Rename the phases integer codes using the phases_dict as the mapping
+            with profiling.timer("phase_replace"):
+                s = df[phase_col]
+                s.replace(to_replace=self.phases_dict, inplace=True)
+
+            # Count the number of cells in each phase
+            with profiling.timer("phase_counts"):
+                counts = s.value_counts()
+            yield time, counts.to_dict()
+
+    def _grouped_cells_iterator(self, columns, group_by, phase_col, cell_type_col):
+        # Yields (time, values, keys, labels) for every snapshot: the given
+        # columns of the cells, the group of each cell and the (phase group,
+        # cell type) label of each group
+        group_by = list(group_by)
+        for name in group_by:
+            if name not in ("phase_group", "cell_type"):
+                raise ValueError(f"Cells can only be grouped by phase_group and cell_type, not {name}")
+        groups = column_stats.PHASE_GROUPS
+        lookup = column_stats.phase_group_lookup(self.phases_dict, self.phase_grouping)
+
+        names = list(columns) + [phase_col, cell_type_col]
+        rows = [self._cell_columns.index(name) for name in names]
+        num_columns = len(columns)
+
+        xml_list = sorted(glob.glob(self._globing))
+        for xml_fname in xml_list:
+            info = self._parse_snapshot(xml_fname)
+            matfile = os.path.join(self._output_folder, info["cells_fname"])
+            profiling.count_file(matfile)
+            with profiling.timer("loadmat"):
+                cells = readers.read_physicell_cells(matfile, rows=rows)
+            profiling.count("cells", cells.shape[0])
+
+            phase = column_stats.phase_groups(cells[:, num_columns], lookup, len(groups) - 1)
+            types, type_keys = np.unique(cells[:, num_columns + 1].astype(np.int64), return_inverse=True)
+            keys = np.zeros(cells.shape[0], dtype=np.int64)
+            labels = [(None, None)]
+            if group_by == ["phase_group"]:
+                keys = phase
+                labels = [(g, None) for g in groups]
+            elif group_by == ["cell_type"]:
+                keys = type_keys.reshape(-1)
+                labels = [(None, t) for t in types.tolist()]
+            elif group_by:
+                keys = phase * len(types) + type_keys.reshape(-1)
+                labels = [(g, t) for g in groups for t in types.tolist()]
+            yield info["time"], cells[:, :num_columns], keys, labels
+
+    def _grouped_frame(self, times, labels, data, group_by, columns):
+        # Tidy table indexed by time and the grouping variables
+        group_by = list(group_by)
+        index = {"time": times}
+        if "phase_group" in group_by:
+            index["phase_group"] = [label[0] for label in labels]
+        if "cell_type" in group_by:
+            index["cell_type"] = [label[1] for label in labels]
+        index = pd.MultiIndex.from_arrays(list(index.values()), names=list(index.keys()))
+        return pd.DataFrame(data, index=index, columns=columns)
+
+    def get_column_statistics(self, columns=None, statistics=column_stats.DEFAULT_STATISTICS, quantiles=(),
+                              group_by=("phase_group", "cell_type"), phase_col="current_phase", 
+                              cell_type_col="cell_type"):
+        # Statistics of the given cell columns (by default every column but ID
+        # and position) in every snapshot, for each phase group and cell type.
+        # Each snapshot is summarized in one vectorized pass ignoring NaNs and
+        # the result is a table indexed by (time, phase_group, cell_type) with
+        # (column, statistic) columns. Groups without cells are left out.
+        if columns is None:
+            columns = self._cell_columns[4:]
+        columns = list(columns)
+        stat_names = list(statistics) + [column_stats.quantile_name(q) for q in quantiles]
+
+        # Preallocated results, grown by doubling when a snapshot has more groups than expected
+        capacity = max(self.cells_file_count(), 1) * len(column_stats.PHASE_GROUPS)
+        data = np.empty((capacity, len(columns), len(stat_names)))
+        times, labels = [], []
+        size = 0
+        for time, values, keys, snapshot_labels in self._grouped_cells_iterator(columns, group_by, phase_col, 
+                                                                                   cell_type_col):
+            with profiling.timer("column_statistics"):
+                results = column_stats.grouped_statistics(values, keys, len(snapshot_labels), 
+                                                          statistics=statistics, quantiles=quantiles)
+            present = np.flatnonzero(np.bincount(keys, minlength=len(snapshot_labels)))
+            if size + len(present) > data.shape[0]:
+                grown = np.empty((2 * (size + len(present)),) + data.shape[1:])
+                grown[:size] = data[:size]
+                data = grown
+            for i, name in enumerate(stat_names):
+                data[size:size + len(present), :, i] = results[name][present]
+            times += [time] * len(present)
+            labels += [snapshot_labels[g] for g in present]
+            size += len(present)
+
+        header = pd.MultiIndex.from_product([columns, stat_names], names=["column", "statistic"])
+        return self._grouped_frame(times, labels, data[:size].reshape(size, -1), group_by, header)
+
+    def get_column_histograms(self, column, bins, group_by=("phase_group", "cell_type"), 
+                              phase_col="current_phase", cell_type_col="cell_type"):
+        # Number of cells in each bin (given by its edges) of a column in every
+        # snapshot, for each phase group and cell type. Columns are the bins.
+        edges = np.asarray(bins, dtype=float)
+        counts, times, labels = [], [], []
+        for time, values, keys, snapshot_labels in self._grouped_cells_iterator([column], group_by, phase_col, 
+                                                                                   cell_type_col):
+            histogram = column_stats.grouped_histogram(values[:, 0], keys, len(snapshot_labels), edges)
+            present = np.flatnonzero(np.bincount(keys, minlength=len(snapshot_labels)))
+            counts.append(histogram[present])
+            times += [time] * len(present)
+            labels += [snapshot_labels[g] for g in present]
+
+        data = np.concatenate(counts) if counts else np.zeros((0, len(edges) - 1), dtype=np.int64)
+        # Like numpy.histogram the last bin also counts the values equal to
+        # its right edge. An IntervalIndex has a single closed side, so the
+        # header shows it as closed on the left only, like the other bins.
+        header = pd.IntervalIndex.from_breaks(edges, closed="left", name=column)
+        return self._grouped_frame(times, labels, data, group_by, header)
+
     def get_microenvironment_fname(self, tree):
         root = tree.getroot()
         node = root.find("microenvironment")
@@ -247,7 +428,9 @@ class MultiCellDS(object):
         return node.text
 
     def get_microenvironment_matrix(self, tree):
-        matfile = self.get_microenvironment_fname(tree)
+        return self._read_microenvironment_matrix(self.get_microenvironment_fname(tree))
+
+    def _read_microenvironment_matrix(self, matfile):
         matfile = os.path.join(self._output_folder, matfile)
         data = self._read_matlab_mat(matfile, "multiscale_microenvironment")
         return data
@@ -255,12 +438,30 @@ class MultiCellDS(object):
     def microenvironment_as_matrix_iterator(self):
         xml_list = sorted(glob.glob(self._globing))
         for xml_fname in xml_list:
-            tree = ET.parse(xml_fname)
-            microenv_matrix = self.get_microenvironment_matrix(tree)
-            time = self.get_time(tree)
-            yield (time, microenv_matrix)
-
-    def get_cells_summary_frame(self, phase_col="current_phase"):
+            info = self._parse_snapshot(xml_fname, sections=("time", "microenvironment"))
+            microenv_matrix = self._read_microenvironment_matrix(info["microenvironment_fname"])
+            yield (info["time"], microenv_matrix)
+
+    def get_substrate_cube(self, cache_folder=None, dtype=np.float64, rebuild=False):
+        # Substrate grids of every snapshot as one memory mapped
+        # (time, substrate, nz, ny, nx) array, see pctk.substrates
+        from .substrates import build_substrate_cube
+        return build_substrate_cube(self, cache_folder=cache_folder, dtype=dtype, rebuild=rebuild)
+
+    def to_dask(self, columns=None):
+        # Lazy dask DataFrame with the cells of every snapshot, one partition
+        # per snapshot and the time as a column (see pctk.daskio). Requires dask.
+        from .daskio import cells_to_dask
+        return cells_to_dask(self, columns=columns)
+
+    def microenvironment_to_dask(self, cube=False):
+        # Lazy dask array of the substrates, shaped (time, substrate, nz, ny, nx)
+        from .daskio import microenvironment_to_dask
+        return microenvironment_to_dask(self, cube=cube)
+
+    def get_cells_summary_frame(self, phase_col="current_phase", chunk_size=None):
+        # With chunk_size the cells are read in blocks of chunk_size cells
+        # instead of loading each snapshot as a DataFrame
         cell_phases = list(set(self.phase_grouping.values()))
         num_of_files = self.cells_file_count()
 
@@ -269,19 +470,12 @@ class MultiCellDS(object):
         columns = ["time"] + cell_phases
         df_time_course = pd.DataFrame(columns=columns, dtype=int, index=index, data=0)
         
-        for i, (time, df) in enumerate(self.cells_as_frames_iterator()):
+        for i, (time, counts) in enumerate(self._phase_counts_iterator(phase_col, chunk_size=chunk_size)):
             df_time_course.iloc[i, 0] = time
 
-            # Rename the phases integer codes using the phases_dict as the mapping
-            s = df[phase_col]
-            s.replace(to_replace=self.phases_dict, value=None, inplace=True)
-
-            # Count the number of cells in each phase
-            counts = s.value_counts()
-
             # group the previous phases count into the three general classes:
             # Alive, Apoptotic, Necrotic
-            for k, v in counts.to_dict().items():
+            for k, v in counts.items():
                 if k not in self.phase_grouping:
                     continue
                 df_time_course.loc[i, self.phase_grouping[k]] += v
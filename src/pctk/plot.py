@@ -2,48 +2,83 @@
 # coding: utf-8
 
 import os
+import sys
 import glob
 
 import numpy as np
 import pandas as pd
 
-import matplotlib.pyplot as plt
 from pctk import multicellds 
+from pctk import readers
+from pctk import backends
+from pctk import profiling
+from pctk.reducers import InFilter, MeanReducer
 from pctk.config import default_cell_colors
 
     
 
-def pb_output_iterator(output_folder, sep=";"):
-    globing = os.path.join(output_folder, "cells_[0-9]*.txt")
-    for fname in sorted(glob.glob(globing)):
-        df = pd.read_csv(fname, sep=sep)
+def get_pyplot():
+    # pyplot takes long to import, so it is only loaded when a figure is created.
+    # pctk only saves figures to files, so the first import selects Agg and no
+    # display is needed, unless pyplot is already in use or MPLBACKEND is set.
+    if "matplotlib.pyplot" not in sys.modules and not os.environ.get("MPLBACKEND"):
+        import matplotlib
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def pb_output_iterator(output_folder, sep=";", columns=None, processes=1):
+    fnames = readers.physiboss_fnames(output_folder)
+    if columns is not None and "Time" not in columns:
+        columns = ["Time"] + list(columns)
+    for fname, names, data in readers.read_physiboss_files(fnames, columns=columns, sep=sep, 
+                                                           processes=processes):
+        df = pd.DataFrame(data, columns=names)
         t = df.Time[0]
         yield (t, df)
 
 def count_pb_files(output_folder):
-    globing = os.path.join(output_folder, "cells_[0-9]*.txt")
-    return len(glob.glob(globing))
-
-
-def get_timeserie_mean(mcds, filter_alive=True):
-    time = []
-    values = []
-    filter_alive = True
-    for t, df in mcds.cells_as_frames_iterator():
-        time.append(t)
-        df = df.iloc[:,3:]
-        if filter_alive:
-            mask = df['current_phase'] <= 14
-            df = df[mask]
-        values.append(df.mean(axis=0).values)
-
-    cell_columns = df.columns.tolist()
-    df = pd.DataFrame(values, columns=cell_columns)
-    df['time'] = time
+    return len(readers.physiboss_fnames(output_folder))
+
+
+def get_timeserie_mean(mcds, filter_alive=True, chunk_size=None):
+    # Mean of every cell column except ID and position in each snapshot,
+    # only over the alive cells (according to the phase grouping) if filter_alive
+    cell_columns = mcds.cell_columns[4:]
+    if chunk_size is not None:
+        # Reading the cells in blocks
+        alive = [code for code, name in mcds.phases_dict.items() if mcds.phase_grouping.get(name) == "alive"]
+        where = InFilter('current_phase', alive) if filter_alive else None
+        make_reducers = lambda: [MeanReducer(cell_columns, where=where)]
+        time = []
+        values = []
+        for t, (reducer,) in mcds.reduce_cells_iterator(make_reducers, chunk_size=chunk_size):
+            time.append(t)
+            values.append(reducer.result())
+        df = pd.DataFrame(values, columns=cell_columns)
+        df['time'] = time
+        return df[['time'] + cell_columns]
+
+    group_by = ("phase_group",) if filter_alive else ()
+    df = mcds.get_column_statistics(cell_columns, statistics=("mean",), group_by=group_by)
+    df.columns = df.columns.get_level_values("column")
+    if filter_alive:
+        # Snapshots without alive cells are kept as NaN rows
+        times = df.index.get_level_values("time").unique()
+        alive = df.index.get_level_values("phase_group") == "alive"
+        df = df[alive].droplevel("phase_group").reindex(times)
+    df = df.reset_index()
     return df[['time'] + cell_columns]
 
 
-def get_timeserie_density(mcds):
+def get_timeserie_density(mcds, cube=False):
+    # Total of the second substrate in each snapshot; with cube the grids
+    # are read from (and on first use written to) the substrate cube
+    if cube:
+        totals = mcds.get_substrate_cube().totals()
+        df = pd.DataFrame({'time': totals.index.values, 'tnf': totals.iloc[:, 1].values})
+        return df
     data = []
     for t,m in mcds.microenvironment_as_matrix_iterator():
         data.append((t, m[5,:].sum()))
@@ -81,20 +116,16 @@ def plot_cells(df_time_course, color_dict, ax, xlabel="Time (min)", ylabel="Nº
 
 
 
-def plot_time_course(output_folder, fig_fname="time_course.png", csv_fname="time_course.csv", format="physicell"):
+def plot_time_course(output_folder, fig_fname="time_course.png", csv_fname="time_course.csv", format="physicell",
+                     cache=False, processes=1):
     phases_dict = multicellds.default_phases_dict
     phase_grouping = multicellds.default_phase_grouping
     print(phases_dict)
-    # Globing output files according to the output format specified
-    if format == 'physicell':
-        phase_col = "current_phase"
-        mcds = multicellds.MultiCellDS(output_folder=output_folder)
-        df_iterator = mcds.cells_as_frames_iterator()
-        num_of_files = mcds.cells_file_count()
-    elif format == 'physiboss':
-        phase_col = "phase"
-        df_iterator = pb_output_iterator(output_folder)
-        num_of_files = count_pb_files(output_folder)
+    # Reading only the phase column of the output files through the backend of the format specified
+    backend = backends.get_backend(output_folder, format=format, cache=cache)
+    phase_col = backend.phase_column
+    df_iterator = backend.iter_frames(columns=[phase_col], processes=processes)
+    num_of_files = len(backend)
     
     # Initializing a Pandas Databrafe to store the data
     
@@ -109,11 +140,13 @@ def plot_time_course(output_folder, fig_fname="time_course.png", csv_fname="time
         print("\tProcessing time step: %.0f" % t)
 
         # Rename the phases integer codes using the phases_dict as the mapping
-        s = df[phase_col]
-        s.replace(to_replace=phases_dict, inplace=True)
+        with profiling.timer("phase_replace"):
+            s = df[phase_col]
+            s.replace(to_replace=phases_dict, inplace=True)
         
         # Count the number of cells in each phase
-        counts = s.value_counts()
+        with profiling.timer("phase_counts"):
+            counts = s.value_counts()
     
         df_time_course.loc[i, 'time'] = t
         # group the previous phases count into the three general classes:
@@ -127,6 +160,7 @@ def plot_time_course(output_folder, fig_fname="time_course.png", csv_fname="time
     
         # plot Alive vs Time
     print("Creating figure")
+    plt = get_pyplot()
     fig, ax = plt.subplots(1, 1, figsize=(8,3), dpi=300)
     plot_cells(df_time_course, default_cell_colors, ax)
 
@@ -149,3 +183,162 @@ def plot_time_course(output_folder, fig_fname="time_course.png", csv_fname="time
 
 
 
+
+
+# Axis fixed by each cross-section plane, and the horizontal and vertical axes
+SECTION_PLANES = {"xy": (2, 0, 1), "xz": (1, 0, 2), "yz": (0, 1, 2)}
+SECTION_COLUMNS = ["x_position", "y_position", "z_position", "total_volume", "current_phase"]
+OTHER_CELL_COLOR = "#bdbdbd"
+
+
+def snapshot_times(output_folder):
+    # (time, xml file name) of every snapshot, reading only the time of each XML
+    xml_list = sorted(glob.glob(os.path.join(output_folder, "output*.xml")))
+    return [(readers.read_snapshot_metadata(f, sections=("time",))["current_time"], f) for f in xml_list]
+
+
+class SnapshotPlotter(object):
+    # Draws the 2D cross-section of a snapshot: the cells cut by the plane,
+    # colored by phase group, over a heatmap of a substrate. The figure and
+    # its artists are created once and only their data is replaced for each
+    # snapshot, so a single plotter renders many frames quickly.
+    def __init__(self, output_folder, plane="xy", position=0.0, substrate=None, cube_folder=None,
+                 cell_colors=default_cell_colors, size=6, dpi=150):
+        from matplotlib.collections import EllipseCollection
+        from matplotlib.colors import to_rgba
+        from pctk.substrates import SubstrateCube
+
+        self.output_folder = output_folder
+        self.axis, self.horizontal, self.vertical = SECTION_PLANES[plane]
+        self.position = position
+
+        mcds = multicellds.MultiCellDS(output_folder=output_folder)
+        self._rows = [mcds.cell_columns.index(c) for c in SECTION_COLUMNS]
+        coordinates = mcds.get_mesh_coordinates()
+        edges = [(c[0] - (c[1] - c[0]) / 2, c[-1] + (c[-1] - c[-2]) / 2) if len(c) > 1 else (c[0] - 0.5, c[0] + 0.5) 
+                 for c in coordinates]
+        extent = edges[self.horizontal] + edges[self.vertical]
+
+        # Color of each phase code, cells with unknown phases are drawn in gray
+        self._lookup = np.tile(to_rgba(OTHER_CELL_COLOR), (max(mcds.phases_dict) + 2, 1))
+        for code, name in mcds.phases_dict.items():
+            group = mcds.phase_grouping.get(name)
+            if group in cell_colors:
+                self._lookup[code] = to_rgba(cell_colors[group])
+
+        plt = get_pyplot()
+        self.fig, self.ax = plt.subplots(1, 1, figsize=(size, size), dpi=dpi)
+        labels = "xyz"
+        self.ax.set_xlabel(f"{labels[self.horizontal]} ({mcds.spatial_units})")
+        self.ax.set_ylabel(f"{labels[self.vertical]} ({mcds.spatial_units})")
+        self.ax.set_xlim(extent[0], extent[1])
+        self.ax.set_ylim(extent[2], extent[3])
+        self.ax.set_aspect("equal")
+
+        self.cube = None
+        self.image = None
+        if substrate is not None:
+            self.cube = SubstrateCube(cube_folder)
+            self.substrate = self.cube.substrate_index(substrate)
+            name = self.cube.substrates[self.substrate]
+            # Same color scale in every frame
+            values = self.cube.data[:, self.substrate]
+            vmin, vmax = float(values.min()), float(values.max())
+            shape = (len(coordinates[self.vertical]), len(coordinates[self.horizontal]))
+            self.image = self.ax.imshow(np.zeros(shape), origin="lower", extent=extent, cmap="viridis",
+                                        vmin=vmin, vmax=vmax, interpolation="nearest")
+            self.fig.colorbar(self.image, ax=self.ax, fraction=0.046, pad=0.04,
+                              label=f"{name} ({self.cube.units[name]})")
+
+        self.cells = EllipseCollection([], [], [], units="xy", offsets=np.zeros((0, 2)),
+                                       offset_transform=self.ax.transData, edgecolors="k", linewidths=0.2)
+        self.ax.add_collection(self.cells)
+        self.title = self.ax.set_title("")
+        self.fig.tight_layout()
+
+    def _section(self, cells):
+        # Cells cut by the plane and the radius of their section
+        radius = np.cbrt(3 * cells[:, 3] / (4 * np.pi))
+        distance = cells[:, self.axis] - self.position
+        cut = np.abs(distance) < radius
+        section = np.sqrt(radius[cut] ** 2 - distance[cut] ** 2)
+        return cells[cut], section
+
+    def draw(self, xml_fname, fig_fname):
+        info = readers.read_snapshot_metadata(xml_fname, sections=("time", "cells"))
+        with profiling.timer("read_cells"):
+            matfile = os.path.join(self.output_folder, info["cells_fname"])
+            cells = readers.read_physicell_cells(matfile, rows=self._rows)
+        profiling.count("cells", cells.shape[0])
+
+        cells, section = self._section(cells)
+        phase = np.clip(cells[:, 4].astype(np.int64), -1, len(self._lookup) - 1)
+        offsets = cells[:, [self.horizontal, self.vertical]]
+        self.cells.set_offsets(offsets)
+        self.cells.set_widths(2 * section)
+        self.cells.set_heights(2 * section)
+        self.cells.set_angles(np.zeros(len(section)))
+        self.cells.set_facecolors(self._lookup[phase])
+
+        if self.image is not None:
+            self.image.set_data(self.cube.get_slice(self.substrate, axis="xyz"[self.axis], position=self.position,
+                                                    time=info["current_time"]))
+        self.title.set_text("time %.0f min" % info["current_time"])
+        with profiling.timer("plot_save"):
+            self.fig.savefig(fig_fname)
+        return fig_fname
+
+
+_plotter = None
+
+
+def _init_plotter(kwargs):
+    # Each worker process creates its own figure once, without a display
+    import matplotlib
+    matplotlib.use("Agg")
+    global _plotter
+    _plotter = SnapshotPlotter(**kwargs)
+
+
+def _draw_task(args):
+    return _plotter.draw(*args)
+
+
+def plot_snapshots(output_folder, out_folder=None, plane="xy", position=0.0, substrate=None, time_range=None,
+                   processes=1, format="png", size=6, dpi=150):
+    # Writes one cross-section figure per snapshot (see SnapshotPlotter) into
+    # out_folder, for the snapshots with time_range[0] <= time <= time_range[1]
+    # (either can be None). Frames are split across a pool of processes.
+    if out_folder is None:
+        out_folder = output_folder
+    os.makedirs(out_folder, exist_ok=True)
+
+    snapshots = snapshot_times(output_folder)
+    if time_range is not None:
+        low, high = time_range
+        snapshots = [(t, f) for t, f in snapshots 
+                     if (low is None or t >= low) and (high is None or t <= high)]
+
+    kwargs = {"output_folder": output_folder, "plane": plane, "position": position, "substrate": substrate,
+              "size": size, "dpi": dpi}
+    if substrate is not None:
+        # The substrate grids are read once into the cube shared by the workers
+        multicellds.MultiCellDS(output_folder=output_folder).get_substrate_cube()
+        kwargs["cube_folder"] = os.path.join(output_folder, ".pctk_cache")
+
+    tasks = []
+    for t, xml_fname in snapshots:
+        name = os.path.basename(xml_fname)[:-4]
+        tasks.append((xml_fname, os.path.join(out_folder, f"{name}_{plane}.{format}")))
+
+    print(f"Plotting {len(tasks)} snapshots with {processes} processes")
+    if processes > 1 and len(tasks) > 1:
+        import multiprocessing as mp
+        with mp.Pool(processes, initializer=_init_plotter, initargs=(kwargs,)) as pool:
+            chunksize = max(1, len(tasks) // (4 * processes))
+            fig_fnames = list(profiling.collect(pool.imap(profiling.task(_draw_task), tasks, chunksize=chunksize)))
+    else:
+        plotter = SnapshotPlotter(**kwargs)
+        fig_fnames = [plotter.draw(*task) for task in tasks]
+    print(f"Saving {len(fig_fnames)} figures into {out_folder}")
+    return fig_fnames
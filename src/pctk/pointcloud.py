@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import os
+import numpy as np
+import multiprocessing as mp
+
+from pctk import profiling
+from pctk import column_stats
+from pctk.readers import read_snapshot_metadata
+from pctk.config import phases_dict, phase_grouping
+from pctk.povwriter import POVWriter
+
+
+# Each snapshot is written as one binary file with a point per cell, for
+# ParaView (VTK PolyData, .vtp) or any point cloud tool (.ply), next to a
+# .pvd collection with the time of every snapshot. Points carry the radii
+# drawn in the .pov files, the cell type, the phase and the phase group
+# (the position in column_stats.PHASE_GROUPS). The arrays are written as
+# raw little-endian bytes, without formatting any cell.
+FILE_FORMATS = ("vtp", "ply")
+PVD_NAME = "cells.pvd"
+
+# (name, numpy type, VTK type, PLY type) of each point attribute
+POINT_ATTRIBUTES = [
+    ("radius", "<f4", "Float32", "float"),
+    ("nuclear_radius", "<f4", "Float32", "float"),
+    ("cell_type", "<i4", "Int32", "int"),
+    ("phase", "<i4", "Int32", "int"),
+    ("phase_group", "<i4", "Int32", "int"),
+]
+
+
+def point_attributes(geometry):
+    # Point attributes of a povwriter Cells_Geometry
+    lookup = column_stats.phase_group_lookup(phases_dict, phase_grouping)
+    groups = column_stats.phase_groups(geometry.phase, lookup, len(column_stats.PHASE_GROUPS) - 1)
+    values = {"radius": geometry.cyto_radius, "nuclear_radius": geometry.nuc_radius,
+              "cell_type": geometry.cell_type, "phase": geometry.phase, "phase_group": groups}
+    return {name: np.ascontiguousarray(values[name], dtype=dtype) for name, dtype, _, _ in POINT_ATTRIBUTES}
+
+
+def write_vtp(fname, centers, attributes):
+    # VTK XML PolyData with the arrays in an appended raw section, each
+    # preceded by its size in bytes as a uint64
+    n = len(centers)
+    arrays = [("Points", np.ascontiguousarray(centers, dtype="<f4"), "Float32", 3)]
+    arrays += [(name, attributes[name], vtk_type, 1) for name, _, vtk_type, _ in POINT_ATTRIBUTES]
+    arrays += [("connectivity", np.arange(n, dtype="<i8"), "Int64", 1),
+               ("offsets", np.arange(1, n + 1, dtype="<i8"), "Int64", 1)]
+
+    offsets = {}
+    offset = 0
+    for name, values, _, _ in arrays:
+        offsets[name] = offset
+        offset += 8 + values.nbytes
+
+    def data_array(name, vtk_type, components):
+        return (f'<DataArray type="{vtk_type}" Name="{name}" NumberOfComponents="{components}" '
+                f'format="appended" offset="{offsets[name]}"/>')
+
+    point_data = "".join(data_array(name, vtk_type, 1) for name, _, vtk_type, _ in POINT_ATTRIBUTES)
+    header = ('<?xml version="1.0"?>\n'
+              '<VTKFile type="PolyData" version="1.0" byte_order="LittleEndian" header_type="UInt64">\n'
+              '<PolyData>\n'
+              f'<Piece NumberOfPoints="{n}" NumberOfVerts="{n}" NumberOfLines="0" NumberOfStrips="0" NumberOfPolys="0">\n'
+              f'<PointData Scalars="phase_group">{point_data}</PointData>\n'
+              f'<Points>{data_array("Points", "Float32", 3)}</Points>\n'
+              f'<Verts>{data_array("connectivity", "Int64", 1)}{data_array("offsets", "Int64", 1)}</Verts>\n'
+              '</Piece>\n'
+              '</PolyData>\n'
+              '<AppendedData encoding="raw">\n_')
+    with open(fname, "wb") as fh:
+        fh.write(header.encode())
+        for _, values, _, _ in arrays:
+            fh.write(np.uint64(values.nbytes).astype("<u8").tobytes())
+            fh.write(values.tobytes())
+        fh.write(b"\n</AppendedData>\n</VTKFile>\n")
+
+
+def write_ply(fname, centers, attributes):
+    # Binary little-endian PLY, one vertex record per cell
+    fields = [(axis, "<f4") for axis in "xyz"] + [(name, dtype) for name, dtype, _, _ in POINT_ATTRIBUTES]
+    vertices = np.empty(len(centers), dtype=fields)
+    for i, axis in enumerate("xyz"):
+        vertices[axis] = centers[:, i]
+    for name, _, _, _ in POINT_ATTRIBUTES:
+        vertices[name] = attributes[name]
+
+    properties = [f"property float {axis}" for axis in "xyz"]
+    properties += [f"property {ply_type} {name}" for name, _, _, ply_type in POINT_ATTRIBUTES]
+    header = ["ply", "format binary_little_endian 1.0", "comment PhysiCell cells exported by pctk",
+              f"element vertex {len(centers)}"] + properties + ["end_header"]
+    with open(fname, "wb") as fh:
+        fh.write(("\n".join(header) + "\n").encode())
+        fh.write(vertices.tobytes())
+
+
+def write_pvd(fname, entries):
+    # ParaView collection of (time, file name relative to the .pvd) entries
+    with open(fname, "w") as fh:
+        fh.write('<?xml version="1.0"?>\n')
+        fh.write('<VTKFile type="Collection" version="0.1" byte_order="LittleEndian">\n<Collection>\n')
+        for time, data_fname in entries:
+            fh.write(f'<DataSet timestep="{time}" group="" part="0" file="{data_fname}"/>\n')
+        fh.write('</Collection>\n</VTKFile>\n')
+
+
+class PointCloudWriter(object):
+    # Reads the cells files with the same columns and radii as POVWriter
+    def __init__(self, output_folder="output", format="physicell", out_folder=None, file_format="vtp"):
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"Unknown file format {file_format}. The format must be one of {', '.join(FILE_FORMATS)}")
+        self.pov_writer = POVWriter(None, format=format)
+        self.options.output_folder = output_folder
+        if out_folder is None:
+            # Next to the cells files, or to the archive holding them
+            out_folder = os.path.dirname(os.path.abspath(output_folder)) if format == "archive" else output_folder
+        self.out_folder = out_folder
+        self.file_format = file_format
+
+    @property
+    def options(self):
+        return self.pov_writer.options
+
+    def available_indexes(self):
+        return self.options.available_indexes()
+
+    def file_name(self, idx):
+        base = os.path.basename(self.options.output_base(idx))
+        return os.path.join(self.out_folder, f"{base}.{self.file_format}")
+
+    def snapshot_time(self, idx):
+        # PhysiBoSS cells files do not store the time, the index is used instead
+        if self.options.format == "physicell":
+            return float(read_snapshot_metadata(self.options.snapshot_xml_name(idx), sections=("time",))["current_time"])
+        elif self.options.format == "archive":
+            return float(self.pov_writer.backend.get_time(idx))
+        return float(idx)
+
+    def write(self, idx):
+        fname = self.options.create_file_name(idx)
+        profiling.count("snapshots")
+        profiling.count_file(fname)
+        with profiling.timer("read_cells"):
+            cells = self.pov_writer.read_cells(idx)
+        profiling.count("cells", cells.shape[0])
+        with profiling.timer("cells_geometry"):
+            geometry = self.pov_writer._cells_geometry(cells)
+            attributes = point_attributes(geometry)
+
+        out_fname = self.file_name(idx)
+        with profiling.timer("point_cloud_write"):
+            if self.file_format == "vtp":
+                write_vtp(out_fname, geometry.centers, attributes)
+            else:
+                write_ply(out_fname, geometry.centers, attributes)
+        profiling.count_file(out_fname, "bytes_written")
+        return self.snapshot_time(idx), out_fname
+
+
+def _write_task(args):
+    writer, idx = args
+    return writer.write(idx)
+
+
+def write_point_clouds(output_folder, index_list=None, format="physicell", out_folder=None,
+                       file_format="vtp", processes=1):
+    # Writes every snapshot (or those of index_list) as a point cloud file
+    # and, for .vtp files, the .pvd collection. Returns the written files.
+    writer = PointCloudWriter(output_folder, format=format, out_folder=out_folder, file_format=file_format)
+    os.makedirs(writer.out_folder, exist_ok=True)
+    if index_list is None or len(index_list) == 0:
+        index_list = writer.available_indexes()
+
+    tasks = [(writer, idx) for idx in index_list]
+    print(f"Writing {len(tasks)} snapshots as .{file_format} files into {writer.out_folder}")
+    if processes > 1 and len(tasks) > 1:
+        with mp.Pool(processes) as pool:
+            entries = list(profiling.collect(pool.imap(profiling.task(_write_task), tasks)))
+    else:
+        entries = [_write_task(task) for task in tasks]
+
+    fnames = [fname for _, fname in entries]
+    if file_format == "vtp":
+        pvd_fname = os.path.join(writer.out_folder, PVD_NAME)
+        write_pvd(pvd_fname, [(time, os.path.basename(fname)) for time, fname in sorted(entries)])
+        print(f"Writing time series {pvd_fname}")
+        fnames.append(pvd_fname)
+    return fnames
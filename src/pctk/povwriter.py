@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 # coding: utf-8
 import os
+import re
+import copy
+import hashlib
 import numpy as np
 from math import pi, sin, cos
 import xml.etree.ElementTree as ET
 
+from pctk import backends
+from pctk import profiling
 from pctk.config import DEFAULT_XML
 from pctk.config import phase_grouping 
 from pctk.config import phases_dict
@@ -24,7 +29,15 @@ __status__ = "dev"
 class InvalidFormatException(Exception):
     def __init__(self, format):
         self.format = format
-        self.message = f"Invalid format {format}. The format must be PhysiCell or legacy PhysiBoSS"
+        self.message = f"Invalid format {format}. The format must be PhysiCell, legacy PhysiBoSS or a pctk archive"
+        super().__init__(self.message)
+
+
+class MissingColumnsException(Exception):
+    def __init__(self, fname, columns):
+        self.fname = fname
+        self.columns = columns
+        self.message = f"Columns {', '.join(columns)} not found in {fname}"
         super().__init__(self.message)
 
 
@@ -60,10 +73,25 @@ class Clipping_Plane:
         return out
 
 
+class Cells_Geometry:
+
+    def __init__(self, centers, cyto_radius, nuc_radius, cell_type, phase):
+        self.centers = centers
+        self.cyto_radius = cyto_radius
+        self.nuc_radius = nuc_radius
+        self.cell_type = cell_type
+        self.phase = phase
+
+    def __len__(self):
+        return self.centers.shape[0]
+
+
 class PC_Options:
     def __init__(self, output_folder="output", filebase="output", format="physicell",
                  time_index=0, nuclear_offset=0.1, cell_bound=750, 
-                 threads=1, use_standard_colors=True):
+                 threads=1, use_standard_colors=True, frustum_culling=False,
+                 occlusion_culling=False, occlusion_voxel_size=0, lod_pixels=0,
+                 image_width=1024):
 
         self.output_folder = output_folder
         self.filebase = filebase
@@ -76,24 +104,64 @@ class PC_Options:
         self.threads = threads
         self.use_standard_colors = use_standard_colors
 
-        self.columns_index_dict = {}
-        if self.format == 'physicell':
-            self.columns_index_dict = { "cyto_volume": 4, "cell_type": 5, "phase": 7, "nuc_volume": 9}
+        # Culling and level of detail (disabled by default, see _visible_cells)
+        self.frustum_culling = frustum_culling
+        self.occlusion_culling = occlusion_culling
+        self.occlusion_voxel_size = occlusion_voxel_size
+        self.lod_pixels = lod_pixels
+        self.image_width = image_width
+
+        self.set_columns_names_dict()
+
+    def set_columns_names_dict(self):
+        # Name of the column storing each cell variable used to draw the cells;
+        # the positions are resolved from the labels of every snapshot
+        self.columns_names_dict = {}
+        if self.format in ('physicell', 'archive'):
+            self.columns_names_dict = { "x": "x_position", "y": "y_position", "z": "z_position",
+                                        "cyto_volume": "total_volume", "nuc_volume": "nuclear_volume",
+                                        "cell_type": "cell_type", "phase": "current_phase"}
         elif self.format == 'physiboss':
-            self.columns_index_dict = { "cyto_radius": 4, "cell_type": 11, "phase": 13, "nuc_radius": 6}
+            self.columns_names_dict = { "x": "x", "y": "y", "z": "z",
+                                        "cyto_radius": "radius", "nuc_radius": "radius_nuclear",
+                                        "cell_type": "cell_line", "phase": "phase"}
         else:
             raise InvalidFormatException(self.format)
 
+    def snapshot_xml_name(self, index):
+        return os.path.join(self.output_folder, f"{self.filebase}{index:08}.xml")
+
     def create_file_name(self, index):
         if self.format == 'physicell':
             fname  = f"{self.filebase}{index:08}_cells_physicell.mat"
         elif self.format == 'physiboss':
             fname  = f"cells_{index:05}.txt"
+        elif self.format == 'archive':
+            # output_folder is the archive file holding every snapshot
+            return self.output_folder
         else:
             fname = None
         fname = os.path.join(self.output_folder, fname)
         return fname
 
+    def output_base(self, index):
+        # Path without extension of the files written for a snapshot
+        if self.format == 'archive':
+            return f"{os.path.splitext(self.output_folder)[0]}_{index:08}"
+        return self.create_file_name(index)[:-4]
+
+    def available_indexes(self):
+        if self.format == 'archive':
+            return list(range(len(backends.get_backend(self.output_folder, format='archive'))))
+        if self.format == 'physicell':
+            pattern = re.compile(re.escape(self.filebase) + r"(\d+)_cells_physicell\.mat$")
+        elif self.format == 'physiboss':
+            pattern = re.compile(r"cells_(\d+)\.txt$")
+        else:
+            raise InvalidFormatException(self.format)
+        matches = [pattern.match(f) for f in os.listdir(self.output_folder)]
+        return sorted(int(m.group(1)) for m in matches if m)
+
 
 class POV_Options():
     
@@ -138,13 +206,58 @@ class POV_Options():
         self.camera_position[1] = self.domain_center[1] + self.camera_distance * sin(self.camera_theta)*sin(self.camera_phi)
         self.camera_position[2] = self.domain_center[2] + self.camera_distance * cos(self.camera_phi)
 
+    def camera_basis(self):
+        # Unit vectors of the camera frame as POV-Ray builds it from look_at and
+        # sky. Like POV-Ray, right is sky x direction only if up, the default
+        # direction <0,0,1> and camera_right are left handed; otherwise it is
+        # flipped. With camera_right <-1,0,0> the frame is right handed.
+        direction = self.camera_look_at - self.camera_position
+        direction = direction / np.linalg.norm(direction)
+        right = np.cross(self.camera_sky, direction)
+        right = right / np.linalg.norm(right)
+        up = np.cross(direction, right)
+        handedness = np.dot(np.cross(self.camera_up, [0, 0, 1]), self.camera_right)
+        if handedness == 0:
+            # up along <0,0,1>, as in the default camera, gives no handedness.
+            # POV-Ray only keeps right for a positive one, so it is flipped.
+            right = -right
+        elif handedness < 0:
+            right = -right
+        return direction, right, up
+
+    def frustum_tangents(self):
+        # Half-angle tangents of the default perspective camera (direction length 1)
+        tan_h = 0.5 * np.linalg.norm(self.camera_right)
+        tan_v = 0.5 * np.linalg.norm(self.camera_up)
+        return tan_h, tan_v
+
 
 class POVWriter_config():
     def __init__(self):
         self.options = PC_Options()
         self.pov_options = POV_Options()
         self.cell_color_definitions = {0: default_pov_colors}
+        self.views = {}
+
+    def view_options(self, view=None):
+        if view is None:
+            return self.pov_options
+        return self.views[view]
 
+    def _parse_camera(self, node, pov_options):
+        pov_options.camera_distance = float(node.find("distance_from_origin").text)
+        pov_options.camera_theta = float(node.find("xy_angle").text)
+        pov_options.camera_phi = float(node.find("yz_angle").text)
+        pov_options.set_camera_from_spherical_location()
+
+    def _parse_clipping_planes(self, node, pov_options):
+        pov_options.clipping_planes = []
+        for cp_node in node:
+            cp = Clipping_Plane()
+            vec = np.array([float(i) for i in cp_node.text.split(",")])
+            cp.coefficients = vec
+            cp.coefficients_to_normal_point()
+            pov_options.clipping_planes.append(cp)
 
     # This method parse XML povwriter config file
     def load_config_file(self, fname):
@@ -164,6 +277,10 @@ class POVWriter_config():
         self.options.nuclear_offset = float(node.find("nuclear_offset").text)
         self.options.cell_bound = float(node.find("cell_bound").text)
         self.options.threads = int(node.find("threads").text)
+        self.options.frustum_culling = _find_bool(node, "frustum_culling", self.options.frustum_culling)
+        self.options.occlusion_culling = _find_bool(node, "occlusion_culling", self.options.occlusion_culling)
+        self.options.occlusion_voxel_size = _find_float(node, "occlusion_voxel_size", self.options.occlusion_voxel_size)
+        self.options.lod_pixels = _find_float(node, "lod_pixels", self.options.lod_pixels)
 
         use_standard_colors = node.find("use_standard_colors").text == 'true'
         if use_standard_colors:
@@ -173,23 +290,27 @@ class POVWriter_config():
 
         # Parsing camera node
         node = root.find("camera")
-        self.pov_options.camera_distance = float(node.find("distance_from_origin").text)
-        self.pov_options.camera_theta = float(node.find("xy_angle").text)
-        self.pov_options.camera_phi = float(node.find("yz_angle").text)
-        
-        self.pov_options.set_camera_from_spherical_location()
+        self._parse_camera(node, self.pov_options)
         self.pov_options.light_position[0] *= 0.5
         
         # Parsing clipping_planes node
         node = root.find("clipping_planes")
-        for cp_node in node:
-            cp = Clipping_Plane()
-            vec = np.array([float(i) for i in cp_node.text.split(",")])
-            cp.coefficients = vec
-            cp.coefficients_to_normal_point()
-            self.pov_options.clipping_planes.append(cp)
+        self._parse_clipping_planes(node, self.pov_options)
         print("Found %i clipping planes" % len(self.pov_options.clipping_planes))
 
+        # Parsing the optional views node. Each named view starts from the 
+        # camera and clipping planes above and overrides the ones it defines
+        node = root.find("views")
+        if node is not None:
+            for view_node in node.findall("view"):
+                pov_options = copy.deepcopy(self.pov_options)
+                if view_node.find("camera") is not None:
+                    self._parse_camera(view_node.find("camera"), pov_options)
+                if view_node.find("clipping_planes") is not None:
+                    self._parse_clipping_planes(view_node.find("clipping_planes"), pov_options)
+                self.views[view_node.attrib["name"]] = pov_options
+            print("Found %i views: %s" % (len(self.views), ", ".join(self.views)))
+
         # Parsing cell_color_definitions node
         node = root.find("cell_color_definitions")
         for cell_cd_node in node:
@@ -207,17 +328,57 @@ class POVWriter_config():
         
         print("Found %i cell color definitions ... " % len(self.cell_color_definitions) )
 
+    # Hash of every setting affecting the content of the .pov files of a view
+    def digest(self, view=None):
+        pov = self.view_options(view)
+        colors = {t: {phase: {comp: np.asarray(v).tolist() for comp, v in sorted(comps.items())}
+                      for phase, comps in sorted(phase_colors.items())}
+                  for t, phase_colors in sorted(self.cell_color_definitions.items())}
+        items = [self.options.format, self.options.nuclear_offset, self.options.cell_bound,
+                 self.options.frustum_culling, self.options.occlusion_culling, 
+                 self.options.occlusion_voxel_size, self.options.lod_pixels, self.options.image_width,
+                 pov.max_trace_level, pov.assumed_gamma, pov.background.tolist(),
+                 pov.camera_position.tolist(), pov.camera_look_at.tolist(), pov.camera_right.tolist(),
+                 pov.camera_up.tolist(), pov.camera_sky.tolist(), pov.light_position.tolist(),
+                 pov.light_rgb, pov.light_fade_distance, pov.light_fade_power,
+                 [cp.coefficients.tolist() for cp in pov.clipping_planes], colors]
+        return hashlib.sha1(repr(items).encode()).hexdigest()
+
 
 class POVWriter():
-    def __init__(self, xml_config, format='physicell'):
+    def __init__(self, xml_config, format='physicell', cache=False):
 
+        # Without a config file only the default options are set, enough to
+        # read the cells files and compute their geometry
         self._config = POVWriter_config()
-        self._config.load_config_file(xml_config)
+        if xml_config is not None:
+            self._config.load_config_file(xml_config)
         self.format = format
+        self.cache = cache
+        self._view = None
+        self._backend = None
     
     @property
     def pov_options(self):
-        return self._config.pov_options
+        # Camera and clipping planes of the view being written
+        return self._config.view_options(self._view)
+
+    @property
+    def views(self):
+        # Names of the views defined in the config, None stands for the default one
+        if len(self._config.views) == 0:
+            return [None]
+        return list(self._config.views)
+
+    @property
+    def view(self):
+        return self._view
+
+    @view.setter
+    def view(self, view):
+        if view is not None and view not in self._config.views:
+            raise KeyError(f"Unknown view {view}")
+        self._view = view
 
     @property
     def options(self):
@@ -231,6 +392,26 @@ class POVWriter():
     def format(self):
         return self.options.format
 
+    @property
+    def backend(self):
+        # Snapshot backend of the output folder, created when first needed and
+        # again if the folder, the format or the cache change
+        key = (self.options.output_folder, self.format, self.cache)
+        if self._backend is None or self._backend[0] != key:
+            backend = backends.get_backend(self.options.output_folder, format=self.format, cache=self.cache)
+            self._backend = (key, backend)
+        return self._backend[1]
+
+    def snapshot(self, idx):
+        # Snapshot idx as known by the backend
+        if self.format == 'physicell':
+            return self.options.snapshot_xml_name(idx)
+        elif self.format == 'physiboss':
+            return self.options.create_file_name(idx)
+        elif self.format == 'archive':
+            return idx
+        raise InvalidFormatException(self.format)
+
     @property
     def cell_color_definitions(self):
         return self._config.cell_color_definitions
@@ -238,6 +419,7 @@ class POVWriter():
     @format.setter
     def format(self, format):
         self.options.format = format
+        self.options.set_columns_names_dict()
 
     def _write_pov_header(self, fh):
         fh.write("#include \"colors.inc\"\n")
@@ -283,45 +465,174 @@ class POVWriter():
         fh.write("  fade_power %i\n" % (self.pov_options.light_fade_power) )
         fh.write("}\n\n")
 
-    def _write_all_cells(self, fh, cells):
+    def _cells_geometry(self, cells):
+        # cells holds the columns of options.columns_names_dict, in the same order
+        index = {key: i for i, key in enumerate(self.options.columns_names_dict)}
+
+        centers = cells[:, [index["x"], index["y"], index["z"]]]
+        if self.options.format == 'physiboss':
+            cyto_radius = cells[:, index["cyto_radius"]]
+            nuc_radius = cells[:, index["nuc_radius"]]
+        else:
+            cyto_radius = np.cbrt(3/(4*pi) * np.abs(cells[:, index["cyto_volume"]]))
+            nuc_radius = np.cbrt(3/(4*pi) * np.abs(cells[:, index["nuc_volume"]]))
+
+        cell_type = cells[:, index["cell_type"]].astype(int)
+        phase = cells[:, index["phase"]].astype(int)
+        return Cells_Geometry(centers, cyto_radius, nuc_radius, cell_type, phase)
+
+    def _cell_colors(self, cell_type, phase):
+        current_phase_name = phases_dict[phase]
+        current_phase_name = phase_grouping[current_phase_name]
+        # Unknown cell types default to the colors of type 0
+        if cell_type not in self.cell_color_definitions:
+            cell_type = 0
+        return self.cell_color_definitions[cell_type][current_phase_name]
+
+    def _clipping_distances(self, centers):
+        planes = self.pov_options.clipping_planes
+        if len(planes) == 0:
+            return np.zeros((centers.shape[0], 0))
+        coefficients = np.array([cp.coefficients for cp in planes])
+        return centers @ coefficients[:, :3].T + coefficients[:, 3]
+
+    def _camera_coordinates(self, centers):
+        direction, right, up = self.pov_options.camera_basis()
+        v = centers - self.pov_options.camera_position
+        return v @ right, v @ up, v @ direction
+
+    def _in_frustum(self, x, y, depth, radius):
+        tan_h, tan_v = self.pov_options.frustum_tangents()
+        # Distance from the sphere center to each side plane of the view pyramid
+        out_h = (np.abs(x) - tan_h * depth) / np.sqrt(1 + tan_h**2)
+        out_v = (np.abs(y) - tan_v * depth) / np.sqrt(1 + tan_v**2)
+        return (depth > -radius) & (out_h <= radius) & (out_v <= radius)
+
+    def _occluded(self, centers, radius, solid):
+        # Cells whose 3x3x3 voxel neighbourhood is completely filled by other
+        # solid (non clipped) cells are considered hidden inside the spheroid
+        occluded = np.zeros(centers.shape[0], dtype=bool)
+        if not solid.any():
+            return occluded
+        voxel_size = self.options.occlusion_voxel_size
+        if voxel_size <= 0:
+            voxel_size = 2 * np.median(radius[solid])
+
+        origin = centers[solid].min(axis=0)
+        voxels = np.floor((centers - origin) / voxel_size).astype(int) + 1
+        shape = voxels[solid].max(axis=0) + 2
+        grid = np.zeros(shape, dtype=bool)
+        idx = voxels[solid]
+        grid[idx[:, 0], idx[:, 1], idx[:, 2]] = True
+        from scipy.ndimage import binary_erosion
+        interior = binary_erosion(grid, structure=np.ones((3, 3, 3), dtype=bool))
+        occluded[solid] = interior[idx[:, 0], idx[:, 1], idx[:, 2]]
+        return occluded
+
+    def _color_groups(self, cell_type, phase):
+        # Index every cell into the list of distinct color definitions it uses
+        pairs, inverse = np.unique(np.stack([cell_type, phase], axis=1), axis=0, return_inverse=True)
+        keys = {}
+        colors_list = []
+        pair_group = np.empty(len(pairs), dtype=np.int64)
+        for i, (t, p) in enumerate(pairs):
+            key = (t if t in self.cell_color_definitions else 0, phase_grouping[phases_dict[p]])
+            if key not in keys:
+                keys[key] = len(colors_list)
+                colors_list.append(self._cell_colors(int(t), int(p)))
+            pair_group[i] = keys[key]
+        return pair_group[inverse.ravel()], colors_list
+
+    def _merge_lod_cells(self, geometry, depth, lod):
+        # Tiny cells are binned in a world grid whose voxel projects to about
+        # lod_pixels at the cell depth (depth rounded down to a power of two)
+        # and merged into one volume-preserving sphere per voxel and color.
+        tan_h, _ = self.pov_options.frustum_tangents()
+        focal = self.options.image_width / (2 * tan_h)
+        level = np.floor(np.log2(np.maximum(depth[lod], 1.0)))
+        voxel_size = 2 * self.options.lod_pixels * np.power(2.0, level) / focal
+        voxels = np.floor(geometry.centers[lod] / voxel_size[:, None]).astype(np.int64)
+        color_group, colors_list = self._color_groups(geometry.cell_type[lod], geometry.phase[lod])
+
+        keys = np.column_stack([color_group, level.astype(np.int64), voxels])
+        keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+
+        volume = geometry.cyto_radius[lod]**3
+        total = np.bincount(inverse, weights=volume, minlength=len(keys))
+        centers = np.column_stack([np.bincount(inverse, weights=volume * geometry.centers[lod, i], minlength=len(keys))
+                                   for i in range(3)])
+        centers = centers / np.maximum(total, np.finfo(float).tiny)[:, None]
+        radius = np.cbrt(total)
+        colors = [colors_list[g] for g in keys[:, 0]]
+        return centers, radius, colors, lod.sum()
+
+    def _visible_cells(self, geometry):
+        # Returns the mask of cells written one by one plus the merged
+        # level-of-detail spheres replacing the tiny distant cells
+        centers = geometry.centers
         bound = self.options.cell_bound
-        for i,row in enumerate(cells):
-            if row[1] < -bound or bound < row[1]:
-                continue
-            if row[2] < -bound or bound < row[2]:
-                continue
-            if row[3] < -bound or bound < row[3]:
-                continue
-            
-            self._write_cell(fh, row)
-
-    def _write_cell(self, fh, row):
-        
-        cell_type_index = self.options.columns_index_dict["cell_type"]
-        phase_idx = self.options.columns_index_dict["phase"]
+        visible = np.all((-bound <= centers) & (centers <= bound), axis=1)
+
+        # Cells lying completely on the removed side of the clipping planes
+        outer_radius = np.maximum(geometry.cyto_radius, geometry.nuc_radius + self.options.nuclear_offset)
+        dists = self._clipping_distances(centers)
+        solid = visible.copy()
+        if dists.shape[1] > 0:
+            visible &= np.any(dists <= outer_radius[:, None], axis=1)
+            cut = np.any((-outer_radius[:, None] < dists) & (dists <= outer_radius[:, None]), axis=1)
+            solid = visible & ~cut
+
+        lod_spheres = None
+        if self.options.frustum_culling or self.options.lod_pixels > 0:
+            x, y, depth = self._camera_coordinates(centers)
+            if self.options.frustum_culling:
+                visible &= self._in_frustum(x, y, depth, outer_radius)
+
+        if self.options.occlusion_culling:
+            visible &= ~self._occluded(centers, geometry.cyto_radius, solid)
+
+        if self.options.lod_pixels > 0:
+            tan_h, _ = self.pov_options.frustum_tangents()
+            focal = self.options.image_width / (2 * tan_h)
+            pixels = geometry.cyto_radius * focal / np.maximum(depth, np.finfo(float).tiny)
+            lod = visible & solid & (depth > 0) & (pixels < self.options.lod_pixels)
+            if lod.any():
+                lod_spheres = self._merge_lod_cells(geometry, depth, lod)
+                visible &= ~lod
+
+        return visible, dists, lod_spheres
+
+    def _write_all_cells(self, fh, geometry):
+        with profiling.timer("pov_culling"):
+            visible, dists, lod_spheres = self._visible_cells(geometry)
         
-        cell_type = int(row[cell_type_index])
-        current_phase_idx = int(row[phase_idx])
+        with profiling.timer("pov_formatting"):
+            for i in np.flatnonzero(visible):
+                colors = self._cell_colors(geometry.cell_type[i], geometry.phase[i])
+                self._write_cell(fh, geometry.centers[i], geometry.cyto_radius[i], 
+                                 geometry.nuc_radius[i], colors, dists[i])
         
-        current_phase_name = phases_dict[current_phase_idx]
-        current_phase_name = phase_grouping[current_phase_name]
-        colors = self.cell_color_definitions[cell_type][current_phase_name]
-
-        center = row[1:4]
-
-        # cytoplasm radius
-        if self.options.format == 'physiboss':
-            col_idx = self.options.columns_index_dict["cyto_radius"]
-            radius = row[col_idx]
+            num_of_merged = 0
+            if lod_spheres is not None:
+                centers, radii, colors_list, num_of_merged = lod_spheres
+                for center, radius, colors in zip(centers, radii, colors_list):
+                    self._write_pov_sphere(fh, center, radius, colors["cytoplasm"], colors["finish"])
+                print("Merged %i tiny cells into %i LOD spheres ... " % (num_of_merged, len(radii)))
         
-        elif self.options.format == 'physicell':
-            col_idx = self.options.columns_index_dict["cyto_volume"]
-            radius = pow( 3/(4*pi) * abs(row[col_idx]), (1./3.) )
+        num_of_culled = len(geometry) - visible.sum() - num_of_merged
+        profiling.count("cells_written", int(visible.sum()))
+        profiling.count("cells_merged", int(num_of_merged))
+        profiling.count("cells_culled", int(num_of_culled))
+        if num_of_culled > 0:
+            print("Culled %i cells ... " % num_of_culled)
+
+    def _write_cell(self, fh, center, radius, nuc_radius, colors, dists):
         
+        # cytoplasm
         render = len(self.pov_options.clipping_planes) == 0
         intersect = False
-        for i,cp in enumerate(self.pov_options.clipping_planes):
-            dist = cp.signed_distance_to_plane(center)
+        for dist in dists:
             if dist <= -radius:
                 render = True
             if -radius < dist <= radius:
@@ -352,18 +663,11 @@ class POVWriter():
             fh.write("}\n")    
 
 
-        # nuclear radius
-        col_idx = self.options.columns_index_dict["nuc_volume"]
-        radius = pow( 3/(4*pi) * abs(row[col_idx]), (1./3.) )
-        if self.options.format == 'physiboss':
-            col_idx = self.options.columns_index_dict["nuc_radius"]
-            radius = row[col_idx]
-
-        
+        # nucleus
+        radius = nuc_radius
         render = len(self.pov_options.clipping_planes) == 0
         intersect = False
-        for i,cp in enumerate(self.pov_options.clipping_planes):
-            dist = cp.signed_distance_to_plane(center)        
+        for dist in dists:
             if dist <= -(radius + self.options.nuclear_offset):
                 render = True
             if -(radius + self.options.nuclear_offset) < dist <= (radius + self.options.nuclear_offset):
@@ -404,40 +708,110 @@ class POVWriter():
             fh.write(" no_reflection ")
         fh.write("}\n")
 
+    def pov_file_name(self, idx, view=None):
+        base = self.options.output_base(idx)
+        if view is None:
+            return base + ".pov"
+        return f"{base}_{view}.pov"
+
+    def frame_digest(self, idx, view=None):
+        # The .pov file depends on the config of the view and on the input cells file
+        fname = self.options.create_file_name(idx)
+        stat = os.stat(fname)
+        strn = f"{self._config.digest(view)}:{stat.st_mtime_ns}:{stat.st_size}"
+        return hashlib.sha1(strn.encode()).hexdigest()
+
+    def is_up_to_date(self, idx, view=None):
+        pov_fname = self.pov_file_name(idx, view)
+        return os.path.exists(pov_fname) and read_digest(pov_fname) == self.frame_digest(idx, view)
+
     def write_pov_file(self, idx):
+        return self.write_pov_views(idx, views=[None])[0]
+
+    def write_pov_views(self, idx, views=None):
+        # The cells file is read and the cells geometry computed once, then
+        # one .pov file is written for each view
+        if views is None:
+            views = self.views
 
         fname = self.options.create_file_name(idx)
         print("Processing file ", fname)
         
-        mat = self.read_cells_file(fname)
+        profiling.count("snapshots")
+        profiling.count_file(fname)
+        with profiling.timer("read_cells"):
+            mat = self.read_cells(idx)
         print("Matrix size: %i x %i " % mat.shape)
+        profiling.count("cells", mat.shape[0])
+        with profiling.timer("cells_geometry"):
+            geometry = self._cells_geometry(mat)
+
+        pov_files = []
+        for view in views:
+            self.view = view
+            pov_fname = self.pov_file_name(idx, view)
+            with open(pov_fname, 'w') as fh:
+                print("Creating file %s for output ... " % pov_fname)
+                self._write_pov_header(fh)       
+                print("Writing %i cells ... " % mat.shape[0])
+                self._write_all_cells(fh, geometry)
+            write_digest(pov_fname, self.frame_digest(idx, view))
+            profiling.count("pov_files")
+            profiling.count_file(pov_fname, "bytes_written")
+            pov_files.append(pov_fname)
+        self.view = None
         
-        pov_fname = fname[:-4] + ".pov"
-        with open(pov_fname, 'w') as fh:
-            print("Creating file %s for output ... " % pov_fname)
-            self._write_pov_header(fh)       
-            print("Writing %i cells ... " % mat.shape[0])
-            self._write_all_cells(fh, mat)
-        
-        return pov_fname
+        return pov_files
+
+    def read_cells(self, idx):
+        # Only the columns needed to draw the cells are loaded, in the
+        # order of options.columns_names_dict. They are found by name in the
+        # columns of the snapshot itself.
+        snapshot = self.snapshot(idx)
+        names = list(self.options.columns_names_dict.values())
+        columns = self.backend.snapshot_columns(snapshot)
+        missing = [name for name in names if name not in columns]
+        if missing:
+            raise MissingColumnsException(self.backend.snapshot_source(snapshot), missing)
+        return self.backend.load_columns(snapshot, names)
 
     def read_cells_file(self, fname):
+        # fname is a cells file of the output folder
         if self.format == 'physicell':
-            from scipy.io import loadmat
-            mat = loadmat(fname)['cells'].T
-            return mat
+            pattern = re.escape(self.options.filebase) + r"(\d+)_cells_physicell\.mat$"
         elif self.format == 'physiboss':
-            data = []
-            with open(fname) as fh:
-                header = next(fh)
-                for row in fh:
-                    data.append([float(i) for i in row.split(";")])
-                data = np.array(data)
-                # Removing time storing column
-                data = data[:,1:]
-            return data
+            pattern = r"cells_(\d+)\.txt$"
         else:
             raise InvalidFormatException(self.format)
+        return self.read_cells(int(re.match(pattern, os.path.basename(fname)).group(1)))
+
+
+def read_digest(fname):
+    # Digests are stored next to the outputs as <fname>.sha1
+    try:
+        with open(fname + ".sha1") as fh:
+            return fh.read().strip()
+    except OSError:
+        return None
+
+
+def write_digest(fname, digest):
+    with open(fname + ".sha1", "w") as fh:
+        fh.write(digest + "\n")
+
+
+def _find_bool(node, tag, default):
+    child = node.find(tag)
+    if child is None:
+        return default
+    return child.text.strip() == 'true'
+
+
+def _find_float(node, tag, default):
+    child = node.find(tag)
+    if child is None:
+        return default
+    return float(child.text)
 
 
 def create_defulat_config(xml_fname, output_folder):
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import os
+import time
+
+
+class Stats(object):
+    # Accumulated time and number of calls of each stage, plus free counters
+    # such as snapshots, cells or bytes read
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.times = {}
+        self.calls = {}
+        self.counters = {}
+
+    def add_time(self, stage, seconds):
+        self.times[stage] = self.times.get(stage, 0.0) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, other):
+        # Adds the stats of other, given as returned by as_dict
+        for stage, entry in other["stages"].items():
+            self.times[stage] = self.times.get(stage, 0.0) + entry["seconds"]
+            self.calls[stage] = self.calls.get(stage, 0) + entry["calls"]
+        for name, value in other["counters"].items():
+            self.count(name, value)
+
+    def as_dict(self):
+        stages = {stage: {"calls": self.calls[stage], "seconds": self.times[stage]} for stage in self.times}
+        return {"stages": stages, "counters": dict(self.counters)}
+
+    def report(self):
+        lines = ["%-32s %8s %12s %12s" % ("stage", "calls", "total (s)", "mean (ms)")]
+        for stage, seconds in sorted(self.times.items(), key=lambda item: -item[1]):
+            calls = self.calls[stage]
+            lines.append("%-32s %8i %12.4f %12.3f" % (stage, calls, seconds, 1000 * seconds / calls))
+        if self.counters:
+            lines.append("")
+            lines.append("%-32s %12s" % ("counter", "value"))
+            for name, value in sorted(self.counters.items()):
+                lines.append("%-32s %12i" % (name, value))
+        return "\n".join(lines)
+
+
+class Timer(object):
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        stats.add_time(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+# Instrumentation is disabled by default: timer() then returns a shared no-op
+# context manager and count() returns right away
+stats = Stats()
+_enabled = False
+_null_timer = _NullTimer()
+
+
+def enable(flag=True):
+    global _enabled
+    _enabled = flag
+
+
+def is_enabled():
+    return _enabled
+
+
+def timer(stage):
+    if not _enabled:
+        return _null_timer
+    return Timer(stage)
+
+
+def count(name, value=1):
+    if _enabled:
+        stats.count(name, value)
+
+
+class _Task(object):
+    # Pool task returning (result, stats of the call) when profiling was
+    # enabled in the process that created it, so the work done by the
+    # workers is reported by the parent (see collect)
+    def __init__(self, func):
+        self.func = func
+        self.enabled = _enabled
+
+    def __call__(self, *args):
+        if not self.enabled:
+            return self.func(*args), None
+        enable()
+        # Forked workers start with a copy of the stats of the parent
+        stats.reset()
+        result = self.func(*args)
+        return result, stats.as_dict()
+
+
+def task(func):
+    return _Task(func)
+
+
+def collect(results):
+    # Yields the results of task(func) calls, merging their stats
+    for result, worker_stats in results:
+        if worker_stats is not None:
+            stats.merge(worker_stats)
+        yield result
+
+
+def count_file(fname, name="bytes_read"):
+    # The size of the file is only looked up when profiling is enabled
+    if _enabled:
+        stats.count(name, os.path.getsize(fname))
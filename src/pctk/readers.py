@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import os
+import glob
+import numpy as np
+import multiprocessing as mp
+
+from pctk import profiling
+
+# pyarrow is optional and slow to import, so it is only loaded on first use
+_pyarrow = None
+
+
+def _load_pyarrow():
+    global _pyarrow
+    if _pyarrow is None:
+        try:
+            import pyarrow as pa
+            from pyarrow import csv as pa_csv
+            _pyarrow = (pa, pa_csv)
+        except ImportError:
+            _pyarrow = False
+    return _pyarrow
+
+
+def read_physicell_cells(fname, rows=None):
+    # The cells matrix is stored with one row per variable; the result has
+    # one row per cell, keeping only the requested variables
+    from scipy.io import loadmat
+    mat = loadmat(fname)['cells']
+    if rows is not None:
+        mat = mat[rows, :]
+    return mat.T
+
+
+# MAT files: PhysiCell writes level 4 files, scipy.io.savemat level 5
+# ones, optionally with zlib compressed variables. Matrices are stored by
+# columns, so each cell of a (variables, cells) matrix is contiguous.
+MAT4_TYPES = {0: "f8", 1: "f4", 2: "i4", 3: "i2", 4: "u2", 5: "u1"}
+MAT5_TYPES = {1: "i1", 2: "u1", 3: "i2", 4: "u2", 5: "i4", 6: "u4", 7: "f4", 9: "f8", 12: "i8", 13: "u8"}
+MAT5_MATRIX = 14
+MAT5_COMPRESSED = 15
+
+
+class _MatStream(object):
+    # Sequential reads over a file, or over the decompressed bytes of a zlib
+    # compressed element, never holding more than the requested bytes
+    def __init__(self, fh, compressed_bytes=None):
+        self._fh = fh
+        self._left = compressed_bytes
+        self._zlib = None
+        self._buffer = b""
+        if compressed_bytes is not None:
+            import zlib
+            self._zlib = zlib.decompressobj()
+
+    def read(self, nbytes):
+        if self._zlib is None:
+            return self._fh.read(nbytes)
+        parts = [self._buffer]
+        size = len(self._buffer)
+        while size < nbytes:
+            if self._zlib.unconsumed_tail:
+                data = self._zlib.decompress(self._zlib.unconsumed_tail, nbytes - size)
+            elif self._left > 0:
+                raw = self._fh.read(min(self._left, 2**20))
+                self._left -= len(raw)
+                if not raw:
+                    break
+                data = self._zlib.decompress(raw, nbytes - size)
+            else:
+                break
+            parts.append(data)
+            size += len(data)
+        data = b"".join(parts)
+        self._buffer = data[nbytes:]
+        return data[:nbytes]
+
+
+def _mat5_tag(stream, endian):
+    # Returns (type, nbytes, data); data is only set for small elements,
+    # which are packed into the tag itself
+    raw = stream.read(8)
+    if len(raw) < 8:
+        return None, 0, None
+    mtype = int(np.frombuffer(raw[:4], endian + "u4")[0])
+    if mtype >> 16:
+        nbytes = mtype >> 16
+        return mtype & 0xffff, nbytes, raw[4:4 + nbytes]
+    return mtype, int(np.frombuffer(raw[4:], endian + "u4")[0]), None
+
+
+def _mat5_element(stream, endian):
+    mtype, nbytes, data = _mat5_tag(stream, endian)
+    if data is None:
+        data = stream.read(nbytes)
+        stream.read(-nbytes % 8)
+    return mtype, data
+
+
+def _mat5_matrix_header(stream, endian):
+    # Array flags, dimensions and name, then the tag of the real part
+    _, flags = _mat5_element(stream, endian)
+    _, dims = _mat5_element(stream, endian)
+    _, name = _mat5_element(stream, endian)
+    mtype, nbytes, _ = _mat5_tag(stream, endian)
+    info = {
+        "name": name.decode("ascii"),
+        "class": int(np.frombuffer(flags[:4], endian + "u4")[0]) & 0xff,
+        "complex": bool(int(np.frombuffer(flags[:4], endian + "u4")[0]) & 0x800),
+        "shape": tuple(np.frombuffer(dims, endian + "i4").tolist()),
+        "dtype": np.dtype(endian + MAT5_TYPES[mtype]) if mtype in MAT5_TYPES else None,
+    }
+    return info
+
+
+def _find_mat_variable(fh, fname, variable):
+    # Returns (info, stream, offset) of a 2D real variable: offset is the
+    # position of its data for uncompressed files (so it can be memory
+    # mapped), otherwise the data is read from the returned stream.
+    from scipy.io.matlab import matfile_version
+
+    major, _ = matfile_version(fname)
+    if major == 0:
+        while True:
+            header = fh.read(20)
+            if len(header) < 20:
+                return None
+            mopt, mrows, ncols, imagf, namlen = np.frombuffer(header, "<i4").tolist()
+            endian = "<"
+            if mopt < 0 or mopt > 4052:
+                endian = ">"
+                mopt, mrows, ncols, imagf, namlen = np.frombuffer(header, ">i4").tolist()
+            name = fh.read(namlen).rstrip(b"\x00").decode("ascii")
+            dtype = np.dtype(endian + MAT4_TYPES.get((mopt // 10) % 10, "f8"))
+            if name == variable:
+                if mopt % 10 != 0 or imagf:
+                    return None
+                info = {"name": name, "shape": (mrows, ncols), "dtype": dtype}
+                return info, fh, fh.tell()
+            fh.seek(mrows * ncols * dtype.itemsize * (2 if imagf else 1), 1)
+
+    if major != 1:
+        return None
+    header = fh.read(128)
+    endian = "<" if header[126:128] == b"IM" else ">"
+    while True:
+        position = fh.tell()
+        mtype, nbytes, _ = _mat5_tag(fh, endian)
+        if mtype is None:
+            return None
+        if mtype == MAT5_MATRIX:
+            info = _mat5_matrix_header(fh, endian)
+            offset = fh.tell()
+            stream = fh
+        elif mtype == MAT5_COMPRESSED:
+            stream = _MatStream(fh, nbytes)
+            mtype, _, _ = _mat5_tag(stream, endian)
+            info = _mat5_matrix_header(stream, endian) if mtype == MAT5_MATRIX else {"name": None}
+            offset = None
+        else:
+            info = {"name": None}
+        if info["name"] == variable:
+            # mxDOUBLE_CLASS and the other numeric classes are 6 to 15
+            if len(info["shape"]) != 2 or info["complex"] or info["dtype"] is None or info["class"] < 6:
+                return None
+            return info, stream, offset
+        fh.seek(position + 8 + nbytes)
+
+
+def iter_physicell_cells_chunks(fname, chunk_size=2**18, rows=None, variable="cells"):
+    # Yields blocks of at most chunk_size cells, with one row per cell and
+    # the requested variables (rows of the matrix) as columns. Uncompressed
+    # files are memory mapped and compressed ones decoded as a stream, so
+    # memory use depends on chunk_size and not on the number of cells.
+    with open(fname, "rb") as fh:
+        found = _find_mat_variable(fh, fname, variable)
+        if found is None:
+            # Layouts not handled above are read at once
+            mat = read_physicell_cells(fname, rows=rows)
+            for start in range(0, mat.shape[0], chunk_size):
+                yield mat[start:start + chunk_size]
+            return
+
+        info, stream, offset = found
+        num_rows, num_cells = info["shape"]
+        dtype = info["dtype"]
+        if num_cells == 0:
+            return
+        if offset is not None:
+            cells = np.memmap(fname, dtype=dtype, mode="r", offset=offset, shape=(num_cells, num_rows))
+        for start in range(0, num_cells, chunk_size):
+            size = min(chunk_size, num_cells - start)
+            if offset is not None:
+                block = cells[start:start + size]
+            else:
+                block = np.frombuffer(stream.read(size * num_rows * dtype.itemsize), dtype).reshape(size, num_rows)
+            if rows is not None:
+                block = block[:, rows]
+            yield np.array(block, dtype=np.float64)
+
+
+# Sections of a MultiCellDS snapshot XML read by read_snapshot_metadata
+SNAPSHOT_SECTIONS = ("time", "mesh", "microenvironment", "cells")
+
+
+# Elements kept until the section containing them ends
+_SECTION_CHILDREN = {"current_time", "current_runtime", "x_coordinates", "y_coordinates", "z_coordinates",
+                     "variables", "variable", "data", "filename", "labels", "label"}
+
+
+def read_snapshot_metadata(xml_fname, sections=SNAPSHOT_SECTIONS):
+    # Streams a MultiCellDS XML and returns a dict with the requested sections:
+    #   time: current_time, time_units, current_runtime, runtime_units
+    #   mesh: spatial_units and the x/y/z_coordinates of the voxel centers
+    #   microenvironment: variables (name, units, ID) and microenvironment_fname
+    #   cells: labels (name, index, size) and cells_fname of the PhysiCell data
+    # Each section is read when its element ends and then cleared, and the
+    # parsing stops as soon as all the requested sections were found.
+    import xml.etree.ElementTree as ET
+
+    pending = set(sections)
+    info = {}
+    with open(xml_fname, "rb") as fh:
+        for _, elem in ET.iterparse(fh):
+            tag = elem.tag
+            if tag == "metadata":
+                for name in ("time", "runtime"):
+                    node = elem.find(f"current_{name}")
+                    if node is not None:
+                        info[f"current_{name}"] = float(node.text)
+                        info[f"{name}_units"] = node.attrib.get("units")
+                pending.discard("time")
+            elif tag == "mesh" and "mesh" in pending:
+                info["spatial_units"] = elem.attrib.get("units")
+                for axis in "xyz":
+                    node = elem.find(f"{axis}_coordinates")
+                    if node is not None:
+                        delimiter = node.attrib.get("delimiter", " ")
+                        values = [v for v in node.text.split(delimiter) if v.strip()]
+                        info[f"{axis}_coordinates"] = np.array(values, dtype=float)
+                pending.discard("mesh")
+            elif tag == "domain":
+                info["variables"] = [(v.attrib["name"], v.attrib["units"], v.attrib["ID"])
+                                     for v in elem.iterfind("variables/variable")]
+                info["microenvironment_fname"] = elem.findtext("data/filename")
+                pending.discard("microenvironment")
+            elif tag == "simplified_data" and elem.attrib.get("source") == "PhysiCell":
+                info["labels"] = [(label.text, int(label.attrib["index"]), int(label.attrib["size"]))
+                                  for label in elem.iterfind("labels/label")]
+                info["cells_fname"] = elem.findtext("filename")
+                pending.discard("cells")
+            elif tag in _SECTION_CHILDREN:
+                # Read with their section
+                continue
+            # Everything else (e.g. full cell data) is released as it ends
+            elem.clear()
+            if not pending:
+                break
+    return info
+
+
+def cell_columns_from_labels(labels, sep="_"):
+    # Column names of a PhysiCell cells matrix from the (name, index, size)
+    # labels of its snapshot: vectors of up to 3 values are split into
+    # x_name, y_name and z_name, longer ones into name_0, name_1, ...
+    cell_columns = []
+    for column, index, size in sorted(labels, key=lambda label: label[1]):
+        if size < 1:
+            return cell_columns
+        if size == 1:
+            cell_columns.append(column)
+        elif size <= 3:
+            for v in ['x', 'y', 'z'][:size]:
+                cell_columns.append(v + sep + column)
+        else:
+            for i in range(size):
+                cell_columns.append(f"{column}{sep}{i}")
+    return cell_columns
+
+
+def physiboss_fnames(output_folder):
+    globing = os.path.join(output_folder, "cells_[0-9]*.txt")
+    return sorted(glob.glob(globing))
+
+
+def read_physiboss_header(fname, sep=";"):
+    with open(fname) as fh:
+        return fh.readline().strip().split(sep)
+
+
+def read_physiboss_file(fname, columns=None, sep=";", dtype=np.float64):
+    # Reads a PhysiBoSS cells_XXXXX.txt file with a C parser into a 2D array.
+    # Columns can be selected by name or position, so the unused ones are
+    # never converted. Returns the list of column names and the array.
+    header = read_physiboss_header(fname, sep=sep)
+    if columns is None:
+        usecols = list(range(len(header)))
+    else:
+        usecols = [header.index(c) if isinstance(c, str) else c for c in columns]
+    names = [header[i] for i in usecols]
+
+    if _load_pyarrow():
+        pa, pa_csv = _pyarrow
+        table = pa_csv.read_csv(fname,
+                                parse_options=pa_csv.ParseOptions(delimiter=sep),
+                                convert_options=pa_csv.ConvertOptions(
+                                    include_columns=list(dict.fromkeys(names)),
+                                    column_types={c: pa.from_numpy_dtype(np.dtype(dtype)) for c in names}))
+        data = np.empty((table.num_rows, len(names)), dtype=dtype)
+        for i, name in enumerate(names):
+            data[:, i] = table.column(name).to_numpy()
+        return names, data
+
+    data = np.loadtxt(fname, delimiter=sep, skiprows=1, usecols=usecols, dtype=dtype, ndmin=2)
+    return names, data
+
+
+def _read_physiboss_file(args):
+    fname, columns, sep, dtype = args
+    return read_physiboss_file(fname, columns=columns, sep=sep, dtype=dtype)
+
+
+def read_physiboss_files(fnames, columns=None, sep=";", dtype=np.float64, processes=1):
+    # Yields (fname, names, data) in order, decoding the files in a pool of
+    # processes when processes > 1
+    tasks = [(fname, columns, sep, dtype) for fname in fnames]
+    if processes <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield (task[0],) + _read_physiboss_file(task)
+        return
+
+    with mp.Pool(processes) as pool:
+        for fname, (names, data) in zip(fnames, profiling.collect(pool.imap(profiling.task(_read_physiboss_file), tasks))):
+            yield fname, names, data
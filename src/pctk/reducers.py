@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import numpy as np
+
+
+# Reducers summarize the cells of a snapshot one block of cells at a time.
+# update(chunk, index) takes a 2D block with one row per cell, where index
+# maps each column name to its position in the block; merge() combines the
+# partial results of two reducers of the same kind (e.g. computed on
+# different blocks or in different processes) and result() returns the
+# summary. The columns property lists the names the reducer needs.
+
+
+class Filter(object):
+    # Keeps the cells with low <= column <= high
+    def __init__(self, column, low=-np.inf, high=np.inf):
+        self.column = column
+        self.low = low
+        self.high = high
+
+    @property
+    def columns(self):
+        return [self.column]
+
+    def __call__(self, chunk, index):
+        values = chunk[:, index[self.column]]
+        return (self.low <= values) & (values <= self.high)
+
+
+class InFilter(object):
+    # Keeps the cells whose column takes one of the given values
+    def __init__(self, column, values):
+        self.column = column
+        self.values = np.asarray(list(values), dtype=float)
+
+    @property
+    def columns(self):
+        return [self.column]
+
+    def __call__(self, chunk, index):
+        return np.isin(chunk[:, index[self.column]], self.values)
+
+
+class Reducer(object):
+
+    def __init__(self, columns, where=None):
+        self._columns = list(columns)
+        self.where = where
+
+    @property
+    def columns(self):
+        if self.where is None:
+            return list(self._columns)
+        return list(self._columns) + [c for c in self.where.columns if c not in self._columns]
+
+    def _select(self, chunk, index):
+        if self.where is None:
+            return chunk
+        return chunk[self.where(chunk, index)]
+
+    def update(self, chunk, index):
+        raise NotImplementedError
+
+    def merge(self, other):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class CountReducer(Reducer):
+    # Number of cells for each value of a column
+    def __init__(self, column, where=None):
+        super().__init__([column], where=where)
+        self.column = column
+        self.counts = {}
+
+    def update(self, chunk, index):
+        chunk = self._select(chunk, index)
+        values, counts = np.unique(chunk[:, index[self.column]], return_counts=True)
+        for value, count in zip(values.tolist(), counts.tolist()):
+            self.counts[value] = self.counts.get(value, 0) + count
+
+    def merge(self, other):
+        for value, count in other.counts.items():
+            self.counts[value] = self.counts.get(value, 0) + count
+        return self
+
+    def result(self):
+        return dict(sorted(self.counts.items()))
+
+
+class MeanReducer(Reducer):
+    # Mean and standard deviation of each column
+    def __init__(self, columns, where=None):
+        super().__init__(columns, where=where)
+        self.count = 0
+        self.sums = np.zeros(len(self._columns))
+        self.squares = np.zeros(len(self._columns))
+
+    def update(self, chunk, index):
+        chunk = self._select(chunk, index)
+        values = chunk[:, [index[c] for c in self._columns]]
+        self.count += values.shape[0]
+        self.sums += values.sum(axis=0)
+        self.squares += (values * values).sum(axis=0)
+
+    def merge(self, other):
+        self.count += other.count
+        self.sums += other.sums
+        self.squares += other.squares
+        return self
+
+    def mean(self):
+        if self.count == 0:
+            return np.full(len(self._columns), np.nan)
+        return self.sums / self.count
+
+    def std(self):
+        if self.count == 0:
+            return np.full(len(self._columns), np.nan)
+        mean = self.mean()
+        return np.sqrt(np.maximum(self.squares / self.count - mean * mean, 0))
+
+    def result(self):
+        return self.mean()
+
+
+class HistogramReducer(Reducer):
+    # Histogram of a column over fixed bin edges, so partial results can be added
+    def __init__(self, column, bins, where=None):
+        super().__init__([column], where=where)
+        self.column = column
+        self.edges = np.asarray(bins, dtype=float)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+
+    def update(self, chunk, index):
+        chunk = self._select(chunk, index)
+        self.counts += np.histogram(chunk[:, index[self.column]], bins=self.edges)[0]
+
+    def merge(self, other):
+        self.counts += other.counts
+        return self
+
+    def result(self):
+        return self.counts, self.edges
+
+
+class SpatialBinReducer(Reducer):
+    # Number of cells in each bin of a regular grid, and the mean of an
+    # optional value column in each bin. edges has one array per axis.
+    def __init__(self, edges, value=None, position=("x_position", "y_position", "z_position"), where=None):
+        self.position = list(position)[:len(edges)]
+        self.value = value
+        super().__init__(self.position + ([value] if value else []), where=where)
+        self.edges = [np.asarray(e, dtype=float) for e in edges]
+        shape = tuple(len(e) - 1 for e in self.edges)
+        self.counts = np.zeros(shape, dtype=np.int64)
+        self.sums = np.zeros(shape) if value else None
+
+    def update(self, chunk, index):
+        chunk = self._select(chunk, index)
+        sample = chunk[:, [index[c] for c in self.position]]
+        self.counts += np.histogramdd(sample, bins=self.edges)[0].astype(np.int64)
+        if self.value:
+            self.sums += np.histogramdd(sample, bins=self.edges, weights=chunk[:, index[self.value]])[0]
+
+    def merge(self, other):
+        self.counts += other.counts
+        if self.value:
+            self.sums += other.sums
+        return self
+
+    def result(self):
+        if not self.value:
+            return self.counts
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.counts, self.sums / self.counts
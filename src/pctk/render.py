@@ -3,36 +3,440 @@
 
 import os
 import shutil
+import hashlib
+import subprocess
 import numpy as np
 
 import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pctk import profiling
 from pctk.povwriter import POVWriter
+from pctk.povwriter import read_digest, write_digest
 
 povray_path = None
+ffmpeg_path = None
 
 def check_povray(exec='povray'):
     global povray_path
     povray_path = shutil.which(exec)
     return (povray_path is not None)
 
-def local_write_pov_file(writer, idx):
-    fname = writer.write_pov_file(idx)
-    return fname
+def check_ffmpeg(exec='ffmpeg'):
+    global ffmpeg_path
+    ffmpeg_path = shutil.which(exec)
+    return (ffmpeg_path is not None)
+
+def local_write_pov_file(writer, idx, views=None):
+    fnames = writer.write_pov_views(idx, views=views)
+    return fnames
 
 def render_to_png(pov_fname, width=1024, height=1024, png_fname=None):
     if png_fname is None:
         png_fname = pov_fname[0:-4] + ".png"
     cmd_line = f"{povray_path} +H{height} +W{width} +I{pov_fname} +O{png_fname} -d"
-    exit_flag = os.system(cmd_line)
+    with profiling.timer("povray"):
+        exit_flag = os.system(cmd_line)
     if exit_flag != 0:
         print(f"Somthing went wrong running povray {cmd_line}. Command finished with exit flag {exit_flag}")
+        return None
     return png_fname
 
-def animate_pngs(png_files):
-    pass
+class GifEncoder():
+    # Writes the GIF frame by frame, each one with its own adaptive palette,
+    # so only the current frame is kept in memory
+    def __init__(self, fname, fps=10, loop=0):
+        self.fname = fname
+        self.duration = int(round(1000 / fps))
+        self.loop = loop
+        self.size = None
+        self._fh = open(fname, "wb")
+
+    def write(self, image):
+        from PIL import GifImagePlugin
+        
+        if self.size is None:
+            self.size = image.size
+        elif image.size != self.size:
+            image = image.resize(self.size)
+        
+        frame = image.convert("RGB").quantize(colors=256)
+        if self._fh.tell() == 0:
+            header, _ = GifImagePlugin.getheader(frame, info={"loop": self.loop, "duration": self.duration})
+            for block in header:
+                self._fh.write(block)
+        for block in GifImagePlugin.getdata(frame, duration=self.duration, include_color_table=True):
+            self._fh.write(block)
+
+    def close(self):
+        self._fh.write(b";")
+        self._fh.close()
+
+class FFmpegEncoder():
+    # Pipes raw RGB frames into ffmpeg, which encodes them on the fly
+    codecs = {
+        ".mp4": ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-crf", "20"],
+        ".webm": ["-c:v", "libvpx-vp9", "-pix_fmt", "yuv420p", "-b:v", "0", "-crf", "32"],
+        ".mkv": ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-crf", "20"],
+    }
+
+    def __init__(self, fname, fps=10):
+        if not check_ffmpeg():
+            raise RuntimeError("ffmpeg is required to write %s" % fname)
+        self.fname = fname
+        self.fps = fps
+        self.size = None
+        self._process = None
+
+    def _open(self, size):
+        self.size = size
+        ext = os.path.splitext(self.fname)[1].lower()
+        cmd_line = [ffmpeg_path, "-y", "-loglevel", "error",
+                    "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", "%ix%i" % size, "-r", str(self.fps), "-i", "-",
+                    "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2"] + self.codecs[ext] + [self.fname]
+        self._process = subprocess.Popen(cmd_line, stdin=subprocess.PIPE)
+
+    def write(self, image):
+        if self._process is None:
+            self._open(image.size)
+        elif image.size != self.size:
+            image = image.resize(self.size)
+        self._process.stdin.write(image.convert("RGB").tobytes())
+
+    def close(self):
+        if self._process is None:
+            return
+        self._process.stdin.close()
+        exit_flag = self._process.wait()
+        if exit_flag != 0:
+            print(f"Somthing went wrong running ffmpeg. Command finished with exit flag {exit_flag}")
+
+def load_frame(fname, width=None, dpi=200):
+    from PIL import Image
+
+    if fname.lower().endswith(".svg"):
+        from svglib.svglib import svg2rlg
+        from reportlab.graphics import renderPM
+        image = renderPM.drawToPIL(svg2rlg(fname), dpi=dpi)
+    else:
+        image = Image.open(fname)
+        image.load()
+    image = image.convert("RGB")
+    
+    if width is not None and width != image.size[0]:
+        height = int(round(image.size[1] * width / image.size[0]))
+        image = image.resize((width, height), Image.LANCZOS)
+    return image
+
+def iter_frames(fnames, width=None, threads=1):
+    # Decoding and downscaling run in worker threads, with at most a couple
+    # of frames per thread in flight to keep memory bounded
+    if threads <= 1:
+        for fname in fnames:
+            yield load_frame(fname, width=width)
+        return
+
+    with ThreadPoolExecutor(threads) as executor:
+        pending = deque()
+        for fname in fnames:
+            pending.append(executor.submit(load_frame, fname, width))
+            if len(pending) >= 2 * threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def animate_pngs(png_files, out_fname="animation.gif", fps=10, width=None, threads=1, loop=0):
+    ext = os.path.splitext(out_fname)[1].lower()
+    if ext == ".gif":
+        encoder = GifEncoder(out_fname, fps=fps, loop=loop)
+    elif ext in FFmpegEncoder.codecs:
+        encoder = FFmpegEncoder(out_fname, fps=fps)
+    else:
+        raise ValueError(f"Unsupported animation format {ext}")
+
+    try:
+        for i, frame in enumerate(iter_frames(png_files, width=width, threads=threads)):
+            print("Processing frame %i/%i" % (i+1, len(png_files)))
+            with profiling.timer("encode_frame"):
+                encoder.write(frame)
+            profiling.count("frames")
+    finally:
+        encoder.close()
+    return out_fname
+
+def _preview_spheres(pov_writer, geometry):
+    # Spheres drawn by the preview: the cytoplasm of every visible cell, the
+    # nucleus of the cells cut by a clipping plane (otherwise hidden inside
+    # the cytoplasm) and the merged level-of-detail spheres.
+    visible, dists, lod_spheres = pov_writer._visible_cells(geometry)
+    color_group, colors_list = pov_writer._color_groups(geometry.cell_type, geometry.phase)
+
+    offset = pov_writer.options.nuclear_offset
+    outer_radius = np.maximum(geometry.cyto_radius, geometry.nuc_radius + offset)
+    cut = visible & np.any(np.abs(dists) <= outer_radius[:, None], axis=1)
+
+    centers = [geometry.centers[visible], geometry.centers[cut]]
+    radius = [geometry.cyto_radius[visible], geometry.nuc_radius[cut]]
+    plane_offset = [np.zeros(visible.sum()), np.full(cut.sum(), offset)]
+    # Colors are looked up in a table per color group, not cell by cell
+    cytoplasm = np.array([c["cytoplasm"][:3] for c in colors_list], dtype=float).reshape(-1, 3)
+    nuclear = np.array([c["nuclear"][:3] for c in colors_list], dtype=float).reshape(-1, 3)
+    finishes = np.array([c["finish"][:3] for c in colors_list], dtype=float).reshape(-1, 3)
+    colors = [cytoplasm[color_group[visible]], nuclear[color_group[cut]]]
+    finish = [finishes[color_group[visible]], finishes[color_group[cut]]]
+    
+    if lod_spheres is not None:
+        lod_centers, lod_radius, lod_colors, _ = lod_spheres
+        centers.append(lod_centers)
+        radius.append(lod_radius)
+        plane_offset.append(np.zeros(len(lod_radius)))
+        colors.append(np.array([c["cytoplasm"][:3] for c in lod_colors], dtype=float).reshape(-1, 3))
+        finish.append(np.array([c["finish"][:3] for c in lod_colors], dtype=float).reshape(-1, 3))
+
+    centers = np.concatenate(centers)
+    radius = np.concatenate(radius)
+    plane_offset = np.concatenate(plane_offset)
+    colors = np.concatenate(colors)
+    finish = np.concatenate(finish)
+    return centers, radius, plane_offset, colors, finish
+
+def _trace_fragments(O, D, C, R, plane_offset, planes):
+    # Exact ray/sphere intersection of every fragment, honoring the clipping
+    # planes as PhysiCell-povwriter does: the part of the sphere kept is the 
+    # union of the negative half-spaces of the planes. Returns the hits, the
+    # distance to the visible point and the plane of the cap it lies on (-1
+    # for points on the sphere).
+    oc = O - C
+    b = np.einsum("ij,ij->i", oc, D)
+    c = np.einsum("ij,ij->i", oc, oc) - R**2
+    disc = b**2 - c
+    hit = disc >= 0
+    sq = np.sqrt(np.where(hit, disc, 0))
+    t = -b - sq
+    t1 = -b + sq
+    hit &= t1 > 0
+    cap_plane = np.full(len(t), -1)
+    if len(planes) == 0:
+        return hit, t, cap_plane
+
+    n = planes[:, :3]
+    d = planes[:, 3][None, :] - plane_offset[:, None]
+    # Spheres inside the negative half-space of a plane are kept whole and
+    # those outside every plane are dropped; only the others are cut
+    centers = C @ n.T + d
+    whole = np.any(centers <= -R[:, None], axis=1)
+    cut = np.flatnonzero(~whole & np.any(centers < R[:, None], axis=1))
+    cut_hit = hit[cut]
+    hit &= whole
+    O, D, d, t0, t1 = O[cut], D[cut], d[cut], t[cut], t1[cut]
+
+    # Front points of the sphere already inside the kept region
+    P0 = O + t0[:, None] * D
+    kept = np.any(P0 @ n.T + d <= 0, axis=1)
+
+    # Otherwise the ray may enter the kept region through a cap on a plane
+    dn = D @ n.T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tp = -(O @ n.T + d) / dn
+    valid = (tp >= t0[:, None]) & (tp <= t1[:, None]) & (dn != 0)
+    tp = np.where(valid, tp, np.inf)
+    k = np.argmin(tp, axis=1)
+    t_cap = tp[np.arange(len(k)), k]
+    cap = ~kept & np.isfinite(t_cap)
+
+    t[cut[cap]] = t_cap[cap]
+    cap_plane[cut[cap]] = k[cap]
+    hit[cut] = cut_hit & (kept | cap)
+    return hit, t, cap_plane
+
+# Side in pixels of the blocks of the coarse depth test of render_preview
+PREVIEW_TILE = 8
+
+def render_preview(pov_writer, cells, width=512, height=512, projection="perspective", 
+                   max_fragments=2**16, geometry=None):
+    pov_options = pov_writer.pov_options
+    if geometry is None:
+        geometry = pov_writer._cells_geometry(cells)
+    centers, radius, plane_offset, colors, finish = _preview_spheres(pov_writer, geometry)
+    planes = np.array([cp.coefficients for cp in pov_options.clipping_planes]).reshape(-1, 4)
+
+    direction, right, up = pov_options.camera_basis()
+    camera = pov_options.camera_position.astype(float)
+    tan_h, tan_v = pov_options.frustum_tangents()
+    if projection == "perspective":
+        focal_x = width / (2 * tan_h)
+        focal_y = height / (2 * tan_v)
+    elif projection == "orthographic":
+        # Same field of view as the perspective camera at the look_at point
+        distance = np.linalg.norm(pov_options.camera_look_at - camera)
+        focal_x = width / (2 * tan_h * distance)
+        focal_y = height / (2 * tan_v * distance)
+    else:
+        raise ValueError(f"Unknown projection {projection}")
+
+    # Project the sphere centers and bounding squares on the image plane
+    v = centers - camera
+    x, y, depth = v @ right, v @ up, v @ direction
+    if projection == "perspective":
+        front = depth > radius
+        scale = 1 / np.sqrt(np.maximum(depth**2 - radius**2, np.finfo(float).tiny))
+        u_c, v_c = x / depth, y / depth
+        half = np.ceil(radius * scale * max(focal_x, focal_y)).astype(int) + 1
+        nearest = np.linalg.norm(v, axis=1) - radius
+    else:
+        front = depth > -radius
+        u_c, v_c = x, y
+        half = np.ceil(radius * max(focal_x, focal_y)).astype(int) + 1
+        nearest = depth - radius
+    px = width / 2 + u_c * focal_x
+    py = height / 2 - v_c * focal_y
+    front &= (px + half >= 0) & (px - half < width) & (py + half >= 0) & (py - half < height)
+    cx = np.round(np.where(front, px, 0)).astype(int)
+    cy = np.round(np.where(front, py, 0)).astype(int)
+
+    # The buffers are padded to whole tiles of PREVIEW_TILE x PREVIEW_TILE
+    # pixels; zmax holds the farthest depth of the z-buffer in each tile
+    tiles_y, tiles_x = -(-height // PREVIEW_TILE), -(-width // PREVIEW_TILE)
+    padded_width = tiles_x * PREVIEW_TILE
+    zbuffer = np.full(tiles_y * PREVIEW_TILE * padded_width, np.inf)
+    image = np.tile(np.asarray(pov_options.background, dtype=float), (len(zbuffer), 1))
+    tiles = zbuffer.reshape(tiles_y, PREVIEW_TILE, tiles_x, PREVIEW_TILE)
+    zmax = np.full((tiles_y, tiles_x), np.inf)
+    light = np.asarray(pov_options.light_position, dtype=float)
+
+    # Spheres are splatted front to back in chunks. Those behind the zmax of
+    # every tile their square touches are dropped before splatting, and the
+    # fragments behind the z-buffer of the previous chunks before tracing.
+    spheres = np.flatnonzero(front)
+    spheres = spheres[np.argsort(nearest[spheres])]
+    start = 0
+    while start < len(spheres):
+        h = half[spheres[start]]
+        chunk = max(1, max_fragments // (2 * h + 1)**2)
+        idx = spheres[start:start+chunk]
+        if start > 0:
+            x0, x1, y0, y1 = [np.clip((c[idx] + sign * half[idx]) // PREVIEW_TILE, 0, n - 1) 
+                              for c, sign, n in ((cx, -1, tiles_x), (cx, 1, tiles_x), 
+                                                 (cy, -1, tiles_y), (cy, 1, tiles_y))]
+            k = np.arange(max((x1 - x0).max(), (y1 - y0).max()) + 1)
+            ty = np.minimum(y0[:, None] + k, y1[:, None])
+            tx = np.minimum(x0[:, None] + k, x1[:, None])
+            farthest = zmax[ty[:, :, None], tx[:, None, :]].max(axis=(1, 2))
+            idx = idx[nearest[idx] < farthest]
+        start += chunk
+        if len(idx) == 0:
+            continue
+        h = half[idx].max()
+        offsets = np.arange(-h, h + 1)
+        dx, dy = [a.ravel() for a in np.meshgrid(offsets, offsets)]
+
+        # Every (sphere, offset) pair inside the disc of the sphere is a
+        # fragment; only those in the image and not behind the z-buffer are kept
+        rows, cols = np.nonzero((dx**2 + dy**2)[None, :] <= half[idx, None]**2)
+        sphere = idx[rows]
+        fx = cx[sphere] + dx[cols]
+        fy = cy[sphere] + dy[cols]
+        keep = np.flatnonzero((fx >= 0) & (fx < width) & (fy >= 0) & (fy < height))
+        keep = keep[nearest[sphere[keep]] < zbuffer[fy[keep] * padded_width + fx[keep]]]
+        fx, fy, sphere = fx[keep], fy[keep], sphere[keep]
+        pixel = fy * padded_width + fx
+
+        # One ray per fragment through the pixel center
+        su = (fx + 0.5 - width / 2) / focal_x
+        sv = (height / 2 - (fy + 0.5)) / focal_y
+        if projection == "perspective":
+            D = direction[None, :] + su[:, None] * right[None, :] + sv[:, None] * up[None, :]
+            D /= np.linalg.norm(D, axis=1)[:, None]
+            O = np.broadcast_to(camera, D.shape)
+        else:
+            D = np.broadcast_to(direction, (len(fx), 3))
+            O = camera + su[:, None] * right[None, :] + sv[:, None] * up[None, :]
+
+        hit, t, cap_plane = _trace_fragments(O, D, centers[sphere], radius[sphere], 
+                                             plane_offset[sphere], planes)
+
+        # Keep the nearest fragment per pixel, then test against the z-buffer
+        hit = np.flatnonzero(hit)
+        order = hit[np.lexsort((t[hit], pixel[hit]))]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = pixel[order[1:]] != pixel[order[:-1]]
+        keep = order[first]
+        keep = keep[t[keep] < zbuffer[pixel[keep]]]
+        pixel, t, sphere, cap_plane = pixel[keep], t[keep], sphere[keep], cap_plane[keep]
+        D = D[keep]
+        P = O[keep] + t[:, None] * D
+
+        # Normals of the sphere surface, or of the cap facing the camera
+        normal = (P - centers[sphere]) / radius[sphere, None]
+        on_cap = cap_plane >= 0
+        if on_cap.any():
+            cap_normal = planes[cap_plane[on_cap], :3]
+            cap_normal = cap_normal / np.linalg.norm(cap_normal, axis=1)[:, None]
+            facing = np.einsum("ij,ij->i", cap_normal, D[on_cap]) > 0
+            cap_normal[facing] *= -1
+            normal[on_cap] = cap_normal
+
+        # Lambertian shading using the ambient and diffuse terms of the finish
+        L = light - P
+        L /= np.linalg.norm(L, axis=1)[:, None]
+        lambert = np.clip(np.einsum("ij,ij->i", normal, L), 0, 1)
+        shade = finish[sphere, 0] + finish[sphere, 1] * lambert
+        zbuffer[pixel] = t
+        image[pixel] = colors[sphere] * shade[:, None]
+        ty, tx = np.divmod(np.unique(fy[keep] // PREVIEW_TILE * tiles_x + fx[keep] // PREVIEW_TILE), tiles_x)
+        zmax[ty, tx] = tiles[ty, :, tx, :].max(axis=(1, 2))
+
+    image = np.clip(image, 0, 1).reshape(tiles_y * PREVIEW_TILE, padded_width, 3)[:height, :width]
+    return (image * 255).round().astype(np.uint8)
+
+def preview_to_png(pov_writer, idx, width=512, height=512, png_fname=None, projection="perspective"):
+    from PIL import Image
+
+    if png_fname is None:
+        png_fname = pov_writer.options.output_base(idx) + ".png"
+    cells = pov_writer.read_cells(idx)
+    image = render_preview(pov_writer, cells, width=width, height=height, projection=projection)
+    Image.fromarray(image).save(png_fname)
+    return png_fname
+
+def write_preview_files(pov_config, index_list=[], format='physicell', width=512, height=512, 
+                        projection="perspective", cache=False):
+    from PIL import Image
+
+    pov_writer = POVWriter(pov_config, format=format, cache=cache)
+    pov_writer.options.image_width = width
+
+    if index_list is None:
+        index_list = pov_writer.options.available_indexes()
+    elif len(index_list) == 0:
+        index_list = [pov_writer.options.time_index]
+
+    png_files = []
+    for idx in index_list:
+        fname = pov_writer.options.create_file_name(idx)
+        profiling.count("snapshots")
+        profiling.count_file(fname)
+        with profiling.timer("read_cells"):
+            cells = pov_writer.read_cells(idx)
+        profiling.count("cells", cells.shape[0])
+        with profiling.timer("cells_geometry"):
+            geometry = pov_writer._cells_geometry(cells)
+        for view in pov_writer.views:
+            pov_writer.view = view
+            png_fname = pov_writer.pov_file_name(idx, view)[:-4] + ".png"
+            with profiling.timer("preview_render"):
+                image = render_preview(pov_writer, cells, width=width, height=height, 
+                                       projection=projection, geometry=geometry)
+            with profiling.timer("png_save"):
+                Image.fromarray(image).save(png_fname)
+            print(f"Writing preview {png_fname}")
+            png_files.append(png_fname)
+        pov_writer.view = None
+    return png_files
 
 def write_pov_files(pov_config, index_list=[], format='physicell', 
-                    width=1024, height=1024, render=False, num_of_threads=None):
+                    width=1024, height=1024, render=False, num_of_threads=None,
+                    incremental=False, cache=False):
     
     if render:
         assert check_povray()
@@ -41,33 +445,54 @@ def write_pov_files(pov_config, index_list=[], format='physicell',
         num_of_threads = os.cpu_count()
     
     # Loadgin XML configuration 
-    pov_writer = POVWriter(pov_config, format=format)
+    pov_writer = POVWriter(pov_config, format=format, cache=cache)
+    pov_writer.options.image_width = width
 
-    if len(index_list) == 0:
+    if index_list is None:
+        index_list = pov_writer.options.available_indexes()
+    elif len(index_list) == 0:
         index_list = [pov_writer.options.time_index]
+
+    # Skipping the frames and views whose config and input file did not change
+    pov_files = []
+    tasks = []
+    for idx in index_list:
+        views = pov_writer.views
+        if incremental:
+            up_to_date = [pov_writer.is_up_to_date(idx, view) for view in views]
+            pov_files += [pov_writer.pov_file_name(idx, view) for view, done in zip(views, up_to_date) if done]
+            views = [view for view, done in zip(views, up_to_date) if not done]
+        if len(views) > 0:
+            tasks.append((pov_writer, idx, views))
+    if incremental:
+        print(f"Skipping {len(pov_files)} up-to-date .pov files")
     
     print(f"Start processing  {num_of_threads} cpus")
-    if num_of_threads > 1:
-
+    if num_of_threads > 1 and len(tasks) > 1:
         pool = mp.Pool(num_of_threads)
-        pov_files = [pool.apply(local_write_pov_file, args=((pov_writer,idx)))
-                                        for idx in index_list]
+        for fnames in profiling.collect(pool.starmap(profiling.task(local_write_pov_file), tasks)):
+            pov_files += fnames
         pool.close()
-        print("Finished!")
-        if render:
-            png_files = []
-            for pov_fname in pov_files:
-                png = render_to_png(pov_fname, width=width, height=height)
-                png_files.append(png)
-            
-            pool.close()
+        pool.join()
     else:
-        for idx in index_list:
-            pov_fname = pov_writer.write_pov_file(idx)
-
-            if render:
-                png_files = []
-                for pov_fname in pov_files:
-                    png = render_to_png(pov_fname, width=width, height=height)
-                    png_files.append(png)
-                
+        for task in tasks:
+            pov_files += local_write_pov_file(*task)
+    print("Finished!")
+
+    if render:
+        png_files = []
+        for pov_fname in sorted(pov_files):
+            png_fname = pov_fname[0:-4] + ".png"
+            digest = hashlib.sha1(f"{read_digest(pov_fname)}:{width}x{height}".encode()).hexdigest()
+            if incremental and os.path.exists(png_fname) and read_digest(png_fname) == digest:
+                print(f"Skipping up-to-date {png_fname}")
+            else:
+                png_fname = render_to_png(pov_fname, width=width, height=height, png_fname=png_fname)
+                if png_fname is None:
+                    continue
+                write_digest(png_fname, digest)
+            png_files.append(png_fname)
+        return png_files
+
+    return pov_files
+
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import io
+import os
+import glob
+import json
+import asyncio
+import threading
+import http.client
+import numpy as np
+import pandas as pd
+from urllib.parse import urlsplit, parse_qs, urlencode
+from collections import OrderedDict
+
+from pctk import readers
+from pctk import profiling
+from pctk.multicellds import MultiCellDS
+
+
+# pctk serve keeps the snapshot index of an output folder and an LRU cache
+# of decoded snapshots in memory and answers plain HTTP GET requests:
+#   /index                       JSON with columns, times, mesh and substrates
+#   /cells?snapshot=i&columns=a,b cells matrix of a snapshot (cells x columns)
+#   /time-course                 phase group counts of every snapshot
+#   /microenvironment?substrate=name&axis=z&position=0[&snapshot=i]
+#                                substrate plane of one or every snapshot
+# Arrays are sent as .npy payloads, or as Arrow IPC streams with format=arrow
+# (tables keep their column names in the X-Pctk-Columns header with .npy).
+DEFAULT_PORT = 8765
+
+
+class SnapshotCache(object):
+    # Decoded cells matrices of the most recently used snapshots, up to
+    # max_bytes in total
+    def __init__(self, output_folder, max_bytes=2**30):
+        self.output_folder = output_folder
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # One lock per shared value, so concurrent misses build it once
+        self._build_locks = {"_time_course": threading.Lock(), "_cube": threading.Lock()}
+        self._time_course = None
+        self._cube = None
+        self.refresh()
+
+    def refresh(self):
+        # Snapshot index: time and cells file of every snapshot XML. The
+        # MultiCellDS and the substrate cube are rebuilt for the new snapshots.
+        mcds = MultiCellDS(output_folder=self.output_folder)
+        xml_list = sorted(glob.glob(os.path.join(self.output_folder, "output*.xml")))
+        snapshots = []
+        for xml_fname in xml_list:
+            info = readers.read_snapshot_metadata(xml_fname, sections=("time", "cells"))
+            snapshots.append((int(info["current_time"]), os.path.join(self.output_folder, info["cells_fname"])))
+        with self._lock:
+            self.mcds = mcds
+            self.snapshots = snapshots
+            self._entries.clear()
+            self._bytes = 0
+            self._time_course = None
+            self._cube = None
+
+    def index(self):
+        mcds = self.mcds
+        return {
+            "output_folder": os.path.abspath(self.output_folder),
+            "cell_columns": mcds.cell_columns,
+            "microenvironment_columns": mcds.microenvironment_columns,
+            "mesh_coordinates": [c.tolist() for c in mcds.get_mesh_coordinates()],
+            "times": [t for t, _ in self.snapshots],
+            "time_units": mcds.time_units,
+            "spatial_units": mcds.spatial_units,
+            "phases_dict": {str(k): v for k, v in mcds.phases_dict.items()},
+        }
+
+    def cells(self, snapshot):
+        with self._lock:
+            if snapshot in self._entries:
+                self._entries.move_to_end(snapshot)
+                profiling.count("cache_hits")
+                return self._entries[snapshot]
+            snapshots = self.snapshots
+        profiling.count("cache_misses")
+        _, matfile = snapshots[snapshot]
+        with profiling.timer("loadmat"):
+            data = readers.read_physicell_cells(matfile)
+        with self._lock:
+            if self.snapshots is not snapshots:
+                # The index was refreshed meanwhile, data is not cached
+                return data
+            if snapshot in self._entries:
+                # Loaded by another thread meanwhile
+                self._entries.move_to_end(snapshot)
+                return self._entries[snapshot]
+            self._entries[snapshot] = data
+            self._bytes += data.nbytes
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= old.nbytes
+        return data
+
+    def columns(self, snapshot, columns=None):
+        data = self.cells(snapshot)
+        if columns is None:
+            return data
+        rows = [self.mcds.cell_columns.index(c) for c in columns]
+        return data[:, rows]
+
+    def _shared(self, name, build):
+        # Value built from the MultiCellDS by the first request that needs it;
+        # requests arriving meanwhile wait for it instead of building it again
+        with self._build_locks[name]:
+            with self._lock:
+                mcds = self.mcds
+                value = getattr(self, name)
+            if value is None:
+                value = build(mcds)
+                with self._lock:
+                    if self.mcds is mcds:
+                        # Not cached if the index was refreshed meanwhile
+                        setattr(self, name, value)
+        return value
+
+    def time_course(self):
+        def build(mcds):
+            df = mcds.get_cells_summary_frame()
+            return df[["time"] + sorted(c for c in df.columns if c != "time")]
+        return self._shared("_time_course", build)
+
+    def microenvironment(self, substrate, axis="z", position=0.0, snapshot=None):
+        cube = self._shared("_cube", lambda mcds: mcds.get_substrate_cube())
+        time = None if snapshot is None else cube.times[snapshot]
+        return cube.get_slice(substrate, axis=axis, position=position, time=time)
+
+
+def _npy_payload(array):
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(array), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def _arrow_payload(array, columns):
+    pa = readers._load_pyarrow()[0]
+    array = np.asarray(array)
+    if array.ndim == 1:
+        array = array[:, None]
+    if columns is None:
+        # Planes are sent as a single column with the shape in the metadata
+        table = pa.table({"values": array.reshape(-1)}, metadata={"shape": json.dumps(list(array.shape))})
+    else:
+        table = pa.table({c: array[:, i] for i, c in enumerate(columns)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _payload(array, columns, fmt):
+    headers = {}
+    if fmt == "arrow":
+        if not readers._load_pyarrow():
+            raise ValueError("format=arrow requires pyarrow")
+        return _arrow_payload(array, columns), "application/vnd.apache.arrow.stream", headers
+    if columns is not None:
+        headers["X-Pctk-Columns"] = json.dumps(columns)
+    return _npy_payload(array), "application/octet-stream", headers
+
+
+def _snapshot_index(query):
+    snapshot = int(query["snapshot"])
+    if snapshot < 0:
+        raise ValueError(f"Invalid snapshot {snapshot}")
+    return snapshot
+
+
+class AnalysisServer(object):
+
+    def __init__(self, output_folder, host="127.0.0.1", port=DEFAULT_PORT, cache_bytes=2**30):
+        self.cache = SnapshotCache(output_folder, max_bytes=cache_bytes)
+        self.host = host
+        self.port = port
+
+    def handle(self, path, query):
+        # Returns (status, body, content type, headers); runs in a worker thread
+        fmt = query.get("format", "npy")
+        if path == "/index":
+            return 200, json.dumps(self.cache.index()).encode(), "application/json", {}
+        if path == "/cells":
+            snapshot = _snapshot_index(query)
+            columns = query["columns"].split(",") if query.get("columns") else None
+            data = self.cache.columns(snapshot, columns)
+            names = columns if columns is not None else self.cache.mcds.cell_columns
+            body, content_type, headers = _payload(data, names, fmt)
+            headers["X-Pctk-Time"] = str(self.cache.snapshots[snapshot][0])
+            return 200, body, content_type, headers
+        if path == "/time-course":
+            df = self.cache.time_course()
+            return (200,) + _payload(df.values.astype(np.int64), list(df.columns), fmt)
+        if path == "/microenvironment":
+            snapshot = _snapshot_index(query) if "snapshot" in query else None
+            plane = self.cache.microenvironment(query["substrate"], axis=query.get("axis", "z"),
+                                                position=float(query.get("position", 0.0)), snapshot=snapshot)
+            return (200,) + _payload(plane, None, fmt)
+        if path == "/refresh":
+            self.cache.refresh()
+            return 200, b"{}", "application/json", {}
+        return 404, json.dumps({"error": f"Unknown path {path}"}).encode(), "application/json", {}
+
+    async def _respond(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            # A blank request line has no headers after it
+            while request_line.strip():
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            try:
+                method, target, version = request_line.decode("latin-1").split()
+                url = urlsplit(target)
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            except ValueError:
+                # The connection is closed after answering a malformed request line
+                version = None
+                status, body, content_type, extra = 400, b'{"error": "Malformed request line"}', "application/json", {}
+            else:
+                if method != "GET":
+                    status, body, content_type, extra = 405, b'{"error": "Only GET is supported"}', "application/json", {}
+                else:
+                    try:
+                        # Decoding happens in a thread so other clients are served meanwhile
+                        status, body, content_type, extra = await loop.run_in_executor(None, self.handle, url.path, query)
+                    except FileNotFoundError as e:
+                        status, body, content_type, extra = 404, json.dumps({"error": str(e)}).encode(), "application/json", {}
+                    except (KeyError, ValueError, IndexError) as e:
+                        status, body, content_type, extra = 400, json.dumps({"error": repr(e)}).encode(), "application/json", {}
+                    except Exception as e:
+                        status, body, content_type, extra = 500, json.dumps({"error": repr(e)}).encode(), "application/json", {}
+
+            keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+            reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                      500: "Internal Server Error"}[status]
+            lines = [f"HTTP/1.1 {status} {reason}", f"Content-Type: {content_type}",
+                     f"Content-Length: {len(body)}", "Connection: " + ("keep-alive" if keep_alive else "close")]
+            lines += [f"{k}: {v}" for k, v in extra.items()]
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+            if not keep_alive:
+                break
+        writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self._respond, self.host, self.port)
+        print(f"Serving {self.cache.output_folder} ({len(self.cache.snapshots)} snapshots) "
+              f"on http://{self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+
+def serve(output_folder, host="127.0.0.1", port=DEFAULT_PORT, cache_mb=1024):
+    AnalysisServer(output_folder, host=host, port=port, cache_bytes=cache_mb * 2**20).run()
+
+
+class RemoteMultiCellDS(object):
+    # Client of pctk serve with the reading API of MultiCellDS
+    def __init__(self, url=f"http://127.0.0.1:{DEFAULT_PORT}", format="npy"):
+        parts = urlsplit(url)
+        self._connection = http.client.HTTPConnection(parts.hostname, parts.port or 80)
+        self._format = format
+        self._index = json.loads(self._get("/index")[0])
+        self._phases_dict = {int(k): v for k, v in self._index["phases_dict"].items()}
+
+    def _get(self, path, **query):
+        if query:
+            path = path + "?" + urlencode(query)
+        self._connection.request("GET", path)
+        response = self._connection.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise RuntimeError(f"pctk serve: {response.status} {body.decode(errors='replace')}")
+        return body, response
+
+    def _array(self, path, **query):
+        if self._format == "arrow":
+            query["format"] = "arrow"
+        body, response = self._get(path, **query)
+        if self._format != "arrow":
+            return np.load(io.BytesIO(body), allow_pickle=False), response
+        pa = readers._load_pyarrow()[0]
+        table = pa.ipc.open_stream(body).read_all()
+        metadata = table.schema.metadata or {}
+        if b"shape" in metadata:
+            return table.column("values").to_numpy().reshape(json.loads(metadata[b"shape"])), response
+        return np.column_stack([table.column(i).to_numpy() for i in range(table.num_columns)]), response
+
+    @property
+    def cell_columns(self):
+        return self._index["cell_columns"]
+
+    @property
+    def microenvironment_columns(self):
+        return [tuple(c) for c in self._index["microenvironment_columns"]]
+
+    @property
+    def phases_dict(self):
+        return self._phases_dict
+
+    @property
+    def time_units(self):
+        return self._index["time_units"]
+
+    @property
+    def spatial_units(self):
+        return self._index["spatial_units"]
+
+    @property
+    def times(self):
+        return self._index["times"]
+
+    def get_mesh_coordinates(self):
+        return tuple(np.array(c) for c in self._index["mesh_coordinates"])
+
+    def cells_file_count(self):
+        return len(self.times)
+
+    def get_cells(self, snapshot, columns=None):
+        query = {"snapshot": snapshot}
+        if columns is not None:
+            query["columns"] = ",".join(columns)
+        return self._array("/cells", **query)[0]
+
+    def cells_as_matrix_iterator(self, columns=None):
+        for i, time in enumerate(self.times):
+            yield time, self.get_cells(i, columns)
+
+    def cells_as_frames_iterator(self, columns=None):
+        columns = self.cell_columns if columns is None else list(columns)
+        if "ID" not in columns:
+            columns = ["ID"] + columns
+        for time, data in self.cells_as_matrix_iterator(columns):
+            yield time, pd.DataFrame(data, columns=columns).set_index("ID")
+
+    def get_cells_summary_frame(self):
+        if self._format == "arrow":
+            body, _ = self._get("/time-course", format="arrow")
+            return readers._load_pyarrow()[0].ipc.open_stream(body).read_all().to_pandas()
+        data, response = self._array("/time-course")
+        return pd.DataFrame(data, columns=json.loads(response.getheader("X-Pctk-Columns")))
+
+    def get_microenvironment_slice(self, substrate, axis="z", position=0.0, snapshot=None):
+        query = {"substrate": substrate, "axis": axis, "position": position}
+        if snapshot is not None:
+            query["snapshot"] = snapshot
+        return self._array("/microenvironment", **query)[0]
+
+    def close(self):
+        self._connection.close()
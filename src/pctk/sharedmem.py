@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import weakref
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import pandas as pd
+
+from pctk import profiling
+
+
+# Snapshots decoded by worker processes are handed over in shared memory
+# blocks instead of being pickled back to the parent. Workers return a
+# SnapshotHandle (block name, shape, dtype, columns and time), a few hundred
+# bytes whatever the number of cells, and any process of the pipeline maps
+# the block as a NumPy array without copying it. SharedSnapshots, in the
+# parent process, owns the blocks: it counts the references to each of them
+# and unlinks a block when its last reference is released.
+
+
+class SnapshotHandle(object):
+    # Picklable description of a snapshot stored in a shared memory block
+    def __init__(self, name, shape, dtype, columns, time):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).str
+        self.columns = list(columns)
+        self.time = time
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+    def __repr__(self):
+        return f"SnapshotHandle(name={self.name!r}, shape={self.shape}, dtype={self.dtype!r}, time={self.time})"
+
+    def attach(self):
+        # Cells matrix of the snapshot (cells x columns) mapped from the
+        # block. The block stays mapped while the array, or any view of it,
+        # is alive, also after its owner unlinks it.
+        shm = _open_block(self.name)
+        cells = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+        # Views of cells keep cells as their base, so the mapping is closed
+        # when the last of them is collected
+        weakref.finalize(cells, shm.close)
+        return cells
+
+    def attach_frame(self):
+        # Same as attach, as a DataFrame over the shared array
+        return pd.DataFrame(self.attach(), columns=self.columns, copy=False)
+
+
+def _open_block(name):
+    try:
+        # Python >= 3.13: attaching processes do not track the block, its
+        # owner unlinks it
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def share_array(cells, columns, time=None):
+    # Copies a cells matrix into a new shared memory block and returns its
+    # handle. The block is registered with the resource tracker of the
+    # process tree, which unlinks it if its owner dies without doing so.
+    cells = np.ascontiguousarray(cells)
+    shm = shared_memory.SharedMemory(create=True, size=max(cells.nbytes, 1))
+    try:
+        np.ndarray(cells.shape, dtype=cells.dtype, buffer=shm.buf)[...] = cells
+        return SnapshotHandle(shm.name, cells.shape, cells.dtype, columns, time)
+    finally:
+        shm.close()
+
+
+def _load_task(args):
+    backend, snapshot, columns = args
+    with profiling.timer("load_columns"):
+        data = backend.load_columns(snapshot, columns)
+    with profiling.timer("shared_memory_copy"):
+        return share_array(data, columns, backend.get_time(snapshot))
+
+
+def _consume_task(args):
+    func, handle = args
+    return func(handle, handle.attach())
+
+
+class SharedSnapshots(object):
+    # Loads the snapshots of a backend (see pctk.backends) into shared memory
+    # and owns the blocks. Each handle starts with one reference, held by
+    # this object; acquire adds one and release drops one, unlinking the
+    # block when none is left. close (or leaving a with statement) unlinks
+    # every remaining block.
+    def __init__(self, backend):
+        # Worker processes must share the resource tracker of this process,
+        # otherwise the tracker of a worker would unlink its blocks when the
+        # worker exits
+        resource_tracker.ensure_running()
+        self._backend = backend
+        self._refs = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._refs)
+
+    @property
+    def nbytes(self):
+        # Bytes held in shared memory
+        return sum(handle.nbytes for handle, _ in self._refs.values())
+
+    def load(self, columns=None, snapshots=None, processes=1):
+        # Handles of the snapshots (all of them by default) with the given
+        # columns, in order, decoded in a pool of processes
+        backend = self._backend
+        names = backend.columns if columns is None else [backend.resolve(c) for c in columns]
+        if snapshots is None:
+            snapshots = backend.list_snapshots()
+        tasks = [(backend, snapshot, names) for snapshot in snapshots]
+        if processes > 1 and len(tasks) > 1:
+            with mp.Pool(processes) as pool:
+                results = profiling.collect(pool.imap(profiling.task(_load_task), tasks))
+                handles = [self._own(handle) for handle in results]
+        else:
+            handles = [self._own(_load_task(task)) for task in tasks]
+        profiling.count("snapshots", len(handles))
+        profiling.count("cells", sum(handle.shape[0] for handle in handles))
+        return handles
+
+    def _own(self, handle):
+        with self._lock:
+            self._refs[handle.name] = [handle, 1]
+        return handle
+
+    def acquire(self, handle):
+        with self._lock:
+            self._refs[handle.name][1] += 1
+        return handle
+
+    def release(self, handle):
+        with self._lock:
+            entry = self._refs[handle.name]
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._refs[handle.name]
+        self._unlink(handle.name)
+
+    def _unlink(self, name):
+        shm = shared_memory.SharedMemory(name=name)
+        shm.unlink()
+        shm.close()
+
+    def imap(self, func, handles, processes=1, release=False):
+        # Calls func(handle, cells) on every handle in a pool of processes,
+        # cells being the array mapped from the shared block, and yields the
+        # results in order. Each block is referenced while its task runs;
+        # with release the reference of this object is dropped as well, so
+        # each block is freed as soon as its result is back.
+        handles = list(handles)
+        for handle in handles:
+            self.acquire(handle)
+            if release:
+                self.release(handle)
+        tasks = [(func, handle) for handle in handles]
+        if processes > 1 and len(tasks) > 1:
+            with mp.Pool(processes) as pool:
+                results = profiling.collect(pool.imap(profiling.task(_consume_task), tasks))
+                for handle, result in zip(handles, results):
+                    self.release(handle)
+                    yield result
+        else:
+            for handle, task in zip(handles, tasks):
+                result = _consume_task(task)
+                self.release(handle)
+                yield result
+
+    def close(self):
+        with self._lock:
+            names = list(self._refs)
+            self._refs.clear()
+        for name in names:
+            self._unlink(name)
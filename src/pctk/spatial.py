@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import numpy as np
+import pandas as pd
+
+from pctk import column_stats
+from pctk.config import phases_dict, phase_grouping
+from pctk.reducers import Reducer
+
+
+PLANES = {"xy": (0, 1), "xz": (0, 2), "yz": (1, 2)}
+
+
+def mesh_edges(x_coordinates, y_coordinates, z_coordinates):
+    # Voxel edges of each axis from the voxel centers of the microenvironment mesh
+    edges = []
+    for centers in (x_coordinates, y_coordinates, z_coordinates):
+        centers = np.asarray(centers, dtype=float)
+        if len(centers) == 1:
+            edges.append(np.array([centers[0] - 0.5, centers[0] + 0.5]))
+            continue
+        middle = (centers[1:] + centers[:-1]) / 2
+        first = centers[0] - (middle[0] - centers[0])
+        last = centers[-1] + (centers[-1] - middle[-1])
+        edges.append(np.concatenate([[first], middle, [last]]))
+    return tuple(edges)
+
+
+def radial_edges(bin_width, max_radius):
+    # Shells of bin_width covering [0, max_radius], max_radius included
+    num_bins = int(np.floor(max_radius / bin_width)) + 1
+    return np.arange(num_bins + 1) * bin_width
+
+
+def radial_profile(positions, edges, center=None, phase=None):
+    # Number of cells in each spherical shell around center (the centroid of
+    # the cells by default) and, if the phase codes are given, the number of
+    # cells of each phase group. Returns (counts, group_counts).
+    positions = np.asarray(positions, dtype=float)
+    if center is None:
+        center = positions.mean(axis=0) if len(positions) else np.zeros(positions.shape[1])
+    num_bins = len(edges) - 1
+    radius = np.sqrt(((positions - np.asarray(center)) ** 2).sum(axis=1))
+    bins = np.searchsorted(edges, radius, side="right") - 1
+    inside = (bins >= 0) & (bins < num_bins)
+    counts = np.bincount(bins[inside], minlength=num_bins)
+    if phase is None:
+        return counts, None
+
+    groups = column_stats.PHASE_GROUPS
+    lookup = column_stats.phase_group_lookup(phases_dict, phase_grouping)
+    keys = column_stats.phase_groups(np.asarray(phase)[inside], lookup, len(groups) - 1)
+    group_counts = np.bincount(bins[inside] * len(groups) + keys, minlength=num_bins * len(groups))
+    return counts, group_counts.reshape(num_bins, len(groups))
+
+
+def shell_volumes(edges, dimensions=3):
+    edges = np.asarray(edges, dtype=float)
+    if dimensions == 2:
+        return np.pi * np.diff(edges ** 2)
+    return 4 / 3 * np.pi * np.diff(edges ** 3)
+
+
+def projection_2d(positions, edges, plane="xy", weights=None):
+    # Number of cells (or sum of weights) of each pixel of the plane, with
+    # the first axis of the plane along the rows. edges are the (x, y, z) edges.
+    first, second = PLANES[plane]
+    positions = np.asarray(positions, dtype=float)
+    return np.histogram2d(positions[:, first], positions[:, second], bins=[edges[first], edges[second]],
+                          weights=weights)[0]
+
+
+def voxel_grid(positions, edges, weights=None):
+    # Number of cells (or sum of weights) in each voxel, as a (nz, ny, nx)
+    # array so that its flattened layout matches the microenvironment matrix
+    positions = np.asarray(positions, dtype=float)
+    return np.histogramdd(positions[:, ::-1], bins=list(edges[::-1]), weights=weights)[0]
+
+
+def _position_columns(backend):
+    return [backend.resolve("x"), backend.resolve("y"), backend.resolve("z")]
+
+
+def radial_profiles(backend, bin_width=20.0, max_radius=None, center=None, processes=1):
+    # Radial cell density and phase group fractions of every snapshot of a
+    # backend (see pctk.backends), decoded in a pool of processes. Returns a
+    # long table with one row per snapshot and shell.
+    columns = _position_columns(backend) + [backend.phase_column]
+    groups = column_stats.PHASE_GROUPS
+    tables = []
+    for time, data in backend.iter_columns(columns, processes=processes):
+        positions = data[:, :3]
+        snapshot_center = positions.mean(axis=0) if center is None and len(positions) else center
+        if snapshot_center is None:
+            snapshot_center = np.zeros(3)
+        radius = max_radius
+        if radius is None:
+            distances = np.sqrt(((positions - snapshot_center) ** 2).sum(axis=1))
+            radius = distances.max() if len(distances) else bin_width
+        edges = radial_edges(bin_width, radius)
+        counts, group_counts = radial_profile(positions, edges, center=snapshot_center, phase=data[:, 3])
+
+        table = pd.DataFrame({"time": time, "r_low": edges[:-1], "r_high": edges[1:], "count": counts})
+        table["density"] = counts / shell_volumes(edges)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for i, group in enumerate(groups):
+                table[f"{group}_fraction"] = group_counts[:, i] / counts
+        tables.append(table)
+    if len(tables) == 0:
+        return pd.DataFrame(columns=["time", "r_low", "r_high", "count", "density"])
+    return pd.concat(tables, ignore_index=True)
+
+
+def density_maps(backend, edges, plane=None, processes=1):
+    # Cell counts of every snapshot on a 2D projection (plane "xy", "xz" or
+    # "yz") or, if plane is None, on the 3D grid given by edges (e.g. the
+    # mesh_edges of the microenvironment). Returns the times and a
+    # preallocated (snapshots, ...) array.
+    columns = _position_columns(backend)
+    snapshots = len(backend)
+    if plane is None:
+        shape = tuple(len(e) - 1 for e in edges[::-1])
+    else:
+        first, second = PLANES[plane]
+        shape = (len(edges[first]) - 1, len(edges[second]) - 1)
+    maps = np.zeros((snapshots,) + shape)
+    times = np.zeros(snapshots)
+    for i, (time, positions) in enumerate(backend.iter_columns(columns, processes=processes)):
+        times[i] = time
+        if plane is None:
+            maps[i] = voxel_grid(positions, edges)
+        else:
+            maps[i] = projection_2d(positions, edges, plane=plane)
+    return times, maps
+
+
+class RadialReducer(Reducer):
+    # Radial profile for MultiCellDS.reduce_cells_iterator. Cells arrive in
+    # blocks, so the center must be given (the origin by default).
+    def __init__(self, edges, center=(0, 0, 0), phase="current_phase",
+                 position=("x_position", "y_position", "z_position"), where=None):
+        self.position = list(position)
+        self.phase = phase
+        super().__init__(self.position + ([phase] if phase else []), where=where)
+        self.edges = np.asarray(edges, dtype=float)
+        self.center = np.asarray(center, dtype=float)
+        num_bins = len(self.edges) - 1
+        self.counts = np.zeros(num_bins, dtype=np.int64)
+        self.group_counts = np.zeros((num_bins, len(column_stats.PHASE_GROUPS)), dtype=np.int64) if phase else None
+
+    def update(self, chunk, index):
+        chunk = self._select(chunk, index)
+        positions = chunk[:, [index[c] for c in self.position]]
+        phase = chunk[:, index[self.phase]] if self.phase else None
+        counts, group_counts = radial_profile(positions, self.edges, center=self.center, phase=phase)
+        self.counts += counts
+        if self.phase:
+            self.group_counts += group_counts
+
+    def merge(self, other):
+        self.counts += other.counts
+        if self.phase:
+            self.group_counts += other.group_counts
+        return self
+
+    def result(self):
+        return self.counts, self.group_counts
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import os
+import glob
+import json
+import numpy as np
+import pandas as pd
+
+from pctk import profiling
+
+
+# The substrate grids of every snapshot are stored once in a single .npy
+# array of shape (time, substrate, nz, ny, nx), memory mapped when read,
+# next to a JSON sidecar with the times, the substrates names and units,
+# the mesh and the modification time of each snapshot XML. The cube is
+# rebuilt when snapshots are added or modified.
+CUBE_NAME = "substrates"
+
+
+def _cube_fnames(cache_folder, name=CUBE_NAME):
+    return os.path.join(cache_folder, f"{name}.npy"), os.path.join(cache_folder, f"{name}.json")
+
+
+def _sources(mcds):
+    xml_list = sorted(glob.glob(mcds._globing))
+    return [[os.path.basename(f), os.path.getmtime(f)] for f in xml_list]
+
+
+def build_substrate_cube(mcds, cache_folder=None, dtype=np.float64, rebuild=False):
+    # Writes the substrate grids of every snapshot of a MultiCellDS into the
+    # cube (by default in <output_folder>/.pctk_cache) and returns it as a
+    # SubstrateCube. An up to date cube is reused unless rebuild.
+    if cache_folder is None:
+        cache_folder = os.path.join(mcds._output_folder, ".pctk_cache")
+    os.makedirs(cache_folder, exist_ok=True)
+    npy_fname, json_fname = _cube_fnames(cache_folder)
+
+    sources = _sources(mcds)
+    if not rebuild and os.path.exists(json_fname):
+        with open(json_fname) as fh:
+            sidecar = json.load(fh)
+        if sidecar["sources"] == sources and sidecar["dtype"] == np.dtype(dtype).name:
+            return SubstrateCube(cache_folder)
+
+    x, y, z = mcds.get_mesh_coordinates()
+    substrates = mcds.microenvironment_columns
+    shape = (len(sources), len(substrates), len(z), len(y), len(x))
+    print(f"Writing substrate cube {shape} into {npy_fname}")
+    # Written next to the old cube, which may still be mapped by a reader,
+    # and removed if a snapshot cannot be read
+    tmp_npy_fname = npy_fname + ".tmp"
+    cube = np.lib.format.open_memmap(tmp_npy_fname, mode="w+", dtype=dtype, shape=shape)
+    times = []
+    voxel_volume = None
+    try:
+        for i, (xml_fname, _) in enumerate(sources):
+            info = mcds._parse_snapshot(os.path.join(mcds._output_folder, xml_fname),
+                                        sections=("time", "microenvironment"))
+            matrix = mcds._read_microenvironment_matrix(info["microenvironment_fname"])
+            if matrix is None:
+                matfile = os.path.join(mcds._output_folder, info["microenvironment_fname"])
+                raise FileNotFoundError(f"Cannot read the microenvironment file {matfile} of {xml_fname}")
+            # Rows x, y, z, voxel volume and one row per substrate, x varying fastest
+            with profiling.timer("substrate_cube"):
+                cube[i] = matrix[4:4 + len(substrates)].reshape(shape[1:])
+            if voxel_volume is None:
+                voxel_volume = float(matrix[3].mean())
+            times.append(info["time"])
+        cube.flush()
+        del cube
+        os.replace(tmp_npy_fname, npy_fname)
+    finally:
+        cube = None
+        if os.path.exists(tmp_npy_fname):
+            os.remove(tmp_npy_fname)
+
+    sidecar = {
+        "shape": list(shape),
+        "dtype": np.dtype(dtype).name,
+        "times": times,
+        "time_units": mcds.time_units,
+        "substrates": [{"name": name, "units": units, "ID": ID} for name, units, ID in substrates],
+        "x_coordinates": x.tolist(),
+        "y_coordinates": y.tolist(),
+        "z_coordinates": z.tolist(),
+        "spatial_units": mcds.spatial_units,
+        "voxel_volume": voxel_volume,
+        "sources": sources,
+    }
+    # The sidecar is written last, so a partially written cube is never used
+    tmp_fname = json_fname + ".tmp"
+    with open(tmp_fname, "w") as fh:
+        json.dump(sidecar, fh, indent=1)
+    os.replace(tmp_fname, json_fname)
+    return SubstrateCube(cache_folder)
+
+
+class SubstrateCube(object):
+    # Read-only view of a substrate cube. data is the memory mapped
+    # (time, substrate, nz, ny, nx) array; only the parts of it used by each
+    # query are read from disk.
+    def __init__(self, cache_folder, name=CUBE_NAME):
+        npy_fname, json_fname = _cube_fnames(cache_folder, name)
+        with open(json_fname) as fh:
+            self._sidecar = json.load(fh)
+        self._data = np.load(npy_fname, mmap_mode="r")
+        self._times = np.array(self._sidecar["times"], dtype=float)
+        self._coordinates = tuple(np.array(self._sidecar[f"{axis}_coordinates"]) for axis in "xyz")
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def times(self):
+        return self._times
+
+    @property
+    def substrates(self):
+        return [s["name"] for s in self._sidecar["substrates"]]
+
+    @property
+    def units(self):
+        return {s["name"]: s["units"] for s in self._sidecar["substrates"]}
+
+    @property
+    def coordinates(self):
+        return self._coordinates
+
+    @property
+    def voxel_volume(self):
+        return self._sidecar["voxel_volume"]
+
+    def substrate_index(self, substrate):
+        if isinstance(substrate, str):
+            return self.substrates.index(substrate)
+        return int(substrate)
+
+    def time_index(self, time):
+        # Snapshot closest to the given time
+        return int(np.abs(self._times - time).argmin())
+
+    def voxel_index(self, x, y, z):
+        # (k, j, i) of the voxel whose center is closest to the position
+        x_c, y_c, z_c = self._coordinates
+        return (int(np.abs(z_c - z).argmin()), int(np.abs(y_c - y).argmin()), int(np.abs(x_c - x).argmin()))
+
+    def voxel_series(self, substrate, x, y, z):
+        # Concentration in the voxel containing (x, y, z) along the whole run
+        s = self.substrate_index(substrate)
+        k, j, i = self.voxel_index(x, y, z)
+        values = np.array(self._data[:, s, k, j, i])
+        return pd.Series(values, index=pd.Index(self._times, name="time"), name=self.substrates[s])
+
+    def totals(self, substrates=None, weighted=False):
+        # Sum of each substrate over the domain in every snapshot, times the
+        # voxel volume if weighted (the amount of substrate). One snapshot is
+        # read at a time.
+        if substrates is None:
+            substrates = self.substrates
+        index = [self.substrate_index(s) for s in substrates]
+        totals = np.empty((len(self._times), len(index)))
+        for t in range(len(self._times)):
+            totals[t] = self._data[t, index].reshape(len(index), -1).sum(axis=1)
+        if weighted:
+            totals *= self.voxel_volume
+        names = [self.substrates[i] for i in index]
+        return pd.DataFrame(totals, index=pd.Index(self._times, name="time"), columns=names)
+
+    def get_slice(self, substrate, axis="z", position=0.0, time=None):
+        # Plane of the voxels closest to position along axis ("x", "y" or
+        # "z"), for the snapshot closest to time or, if time is None, for
+        # every snapshot (time first). Planes keep the (z, y, x) axes order.
+        s = self.substrate_index(substrate)
+        coordinates = self._coordinates["xyz".index(axis)]
+        plane = int(np.abs(coordinates - position).argmin())
+        selection = {"z": (plane,), "y": (slice(None), plane), "x": (slice(None), slice(None), plane)}[axis]
+        if time is None:
+            return np.array(self._data[(slice(None), s) + selection])
+        return np.array(self._data[(self.time_index(time), s) + selection])
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import os
+import glob
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+
+from pctk import backends
+from pctk import profiling
+from pctk.config import phases_dict, phase_grouping, default_cell_colors
+
+
+PHASE_GROUPS = ["alive", "apoptotic", "necrotic"]
+
+
+def read_manifest(fname):
+    # One output folder per line, optionally followed by the parameters of the
+    # run as key=value pairs. Blank lines and lines starting with # are skipped
+    # and relative folders are taken from the manifest location. A folder or
+    # glob matching nothing is an error, not an empty run.
+    runs = []
+    base = os.path.dirname(os.path.abspath(fname))
+    with open(fname) as fh:
+        for lineno, line in enumerate(fh, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split()
+            params = {}
+            for field in fields[1:]:
+                key, sep, value = field.partition("=")
+                if not sep or not key:
+                    raise ValueError(f"{fname}, line {lineno}: invalid parameter {field!r}, expected key=value")
+                params[key] = value
+            folders = sorted(glob.glob(os.path.join(base, fields[0])))
+            if not folders:
+                raise ValueError(f"{fname}, line {lineno}: {fields[0]!r} matches no folder")
+            for folder in folders:
+                runs.append((folder, params))
+    return runs
+
+
+def find_output_folders(spec):
+    # spec is either a manifest file or a glob pattern matching output folders
+    if os.path.isfile(spec):
+        return read_manifest(spec)
+    return [(folder, {}) for folder in sorted(glob.glob(spec)) if os.path.isdir(folder)]
+
+
+def phase_counts(phase):
+    counts = dict.fromkeys(PHASE_GROUPS, 0)
+    codes, totals = np.unique(phase.astype(int), return_counts=True)
+    for code, total in zip(codes, totals):
+        name = phases_dict.get(code)
+        if name in phase_grouping:
+            counts[phase_grouping[name]] += int(total)
+    return counts
+
+
+def _summary_digest(backend, columns):
+    # Changes when the format, the requested columns or any snapshot changes
+    items = [backend.format, list(columns)]
+    for snapshot in backend.list_snapshots():
+        stat = os.stat(backend.snapshot_source(snapshot))
+        items.append([os.path.basename(snapshot), stat.st_mtime_ns, stat.st_size])
+    return hashlib.sha1(json.dumps(items).encode()).hexdigest()
+
+
+def summarize_folder(output_folder, format="physicell", columns=[], cache=True, cache_folder=None):
+    # Long-format table (time, variable, statistic, value) with the phase
+    # group counts and the mean and std of the given columns in every snapshot
+    backend = backends.get_backend(output_folder, format=format)
+    names = [backend.phase_column] + [backend.resolve(c) for c in columns]
+
+    cache_fname = None
+    if cache:
+        if cache_folder is None:
+            cache_folder = os.path.join(output_folder, ".pctk_cache")
+        digest = _summary_digest(backend, names)
+        cache_fname = os.path.join(cache_folder, f"sweep_summary_{digest}.csv")
+        if os.path.exists(cache_fname):
+            return pd.read_csv(cache_fname)
+
+    rows = []
+    for t, data in backend.iter_columns(names):
+        for group, count in phase_counts(data[:, 0]).items():
+            rows.append((t, group, "count", count))
+        for i, column in enumerate(columns, start=1):
+            values = data[:, i]
+            rows.append((t, column, "mean", values.mean() if len(values) else np.nan))
+            rows.append((t, column, "std", values.std() if len(values) else np.nan))
+    df = pd.DataFrame(rows, columns=["time", "variable", "statistic", "value"])
+
+    if cache_fname:
+        try:
+            os.makedirs(cache_folder, exist_ok=True)
+            tmp_fname = cache_fname + ".tmp"
+            df.to_csv(tmp_fname, index=False)
+            os.replace(tmp_fname, cache_fname)
+        except OSError:
+            print(f"Warning: could not cache the summary of {output_folder}")
+    return df
+
+
+def _summarize_task(args):
+    folder, format, columns, cache = args
+    return summarize_folder(folder, format=format, columns=columns, cache=cache)
+
+
+def summarize_sweep(runs, format="physicell", columns=[], cache=True, processes=1):
+    # runs is a list of (output_folder, params) as returned by find_output_folders.
+    # The folders are summarized in a pool of processes and concatenated into one
+    # long-format table with the folder and the parameters of each run.
+    tasks = [(folder, format, list(columns), cache) for folder, _ in runs]
+    if processes > 1 and len(tasks) > 1:
+        with mp.Pool(min(processes, len(tasks))) as pool:
+            frames = list(profiling.collect(pool.map(profiling.task(_summarize_task), tasks)))
+    else:
+        frames = [_summarize_task(task) for task in tasks]
+
+    param_names = []
+    for _, params in runs:
+        param_names += [k for k in params if k not in param_names]
+
+    tables = []
+    for (folder, params), df in zip(runs, frames):
+        print(f"\t{folder}: {df.time.nunique()} snapshots")
+        df.insert(0, "folder", folder)
+        for i, name in enumerate(param_names, start=1):
+            df.insert(i, name, params.get(name))
+        tables.append(df)
+    if len(tables) == 0:
+        return pd.DataFrame(columns=["folder"] + param_names + ["time", "variable", "statistic", "value"])
+    return pd.concat(tables, ignore_index=True)
+
+
+def aggregate_replicates(df, by=None, confidence=0.95):
+    # Mean and confidence interval of each value across the replicates sharing
+    # the same parameters (by), using the t distribution
+    from scipy import stats
+
+    if by is None:
+        fixed = ["folder", "time", "variable", "statistic", "value"]
+        by = [c for c in df.columns if c not in fixed]
+    keys = list(by) + ["time", "variable", "statistic"]
+    grouped = df.groupby(keys, dropna=False)["value"]
+    agg = grouped.agg(["mean", "std", "count"]).reset_index()
+    agg = agg.rename(columns={"count": "n"})
+
+    sem = agg["std"] / np.sqrt(agg["n"])
+    t = stats.t.ppf(0.5 + confidence / 2, np.maximum(agg["n"] - 1, 1))
+    half_width = np.where(agg["n"] > 1, t * sem, 0.0)
+    agg["ci_low"] = agg["mean"] - half_width
+    agg["ci_high"] = agg["mean"] + half_width
+    return agg
+
+
+def plot_sweep_summary(agg, fig_fname="sweep_summary.png", by=None):
+    # One panel per summarized variable, one line per parameter set with its
+    # confidence interval as a shaded band
+    from pctk.plot import get_pyplot
+    plt = get_pyplot()
+
+    if by is None:
+        fixed = ["time", "variable", "statistic", "mean", "std", "n", "ci_low", "ci_high"]
+        by = [c for c in agg.columns if c not in fixed]
+
+    panels = agg[["variable", "statistic"]].drop_duplicates()
+    panels = panels[panels.statistic.isin(["count", "mean"])].values.tolist()
+    fig, axes = plt.subplots(len(panels), 1, figsize=(8, 3 * len(panels)), dpi=150, squeeze=False)
+
+    groups = agg.groupby(list(by), dropna=False) if by else [((), agg)]
+    for ax, (variable, statistic) in zip(axes[:, 0], panels):
+        for key, df in groups:
+            df = df[(df.variable == variable) & (df.statistic == statistic)].sort_values("time")
+            key = key if isinstance(key, tuple) else (key,)
+            label = ", ".join(f"{k}={v}" for k, v in zip(by, key)) or variable
+            color = default_cell_colors.get(variable) if not by else None
+            line, = ax.plot(df.time, df["mean"], "-", c=color, label=label)
+            ax.fill_between(df.time, df.ci_low, df.ci_high, color=line.get_color(), alpha=0.25, linewidth=0)
+        ax.set_xlabel("Time (min)")
+        ax.set_ylabel("Nº of cells" if statistic == "count" else f"Mean {variable}")
+        ax.set_title(variable)
+        ax.spines['right'].set_visible(False)
+        ax.spines['top'].set_visible(False)
+        ax.yaxis.grid(linestyle='dotted')
+        ax.legend()
+
+    fig.tight_layout()
+    fig.savefig(fig_fname)
+    plt.close(fig)
+    print("Saving fig as %s" % fig_fname)
+
+
+def sweep_summary(spec, format="physicell", columns=[], csv_fname="sweep_summary.csv",
+                  fig_fname=None, cache=True, processes=1, confidence=0.95):
+    runs = find_output_folders(spec)
+    print("Summarizing %i output folders from %s" % (len(runs), spec))
+    df = summarize_sweep(runs, format=format, columns=columns, cache=cache, processes=processes)
+    if csv_fname:
+        df.to_csv(csv_fname, sep="\t", index=False)
+        print("Saving csv as %s" % csv_fname)
+    if fig_fname and len(df):
+        agg = aggregate_replicates(df, confidence=confidence)
+        plot_sweep_summary(agg, fig_fname=fig_fname)
+    return df
@@ -0,0 +1,89 @@
+import os
+import importlib.util
+
+import numpy as np
+import pytest
+
+from pctk.archive import CellArchive, write_archive
+from pctk.multicellds import MultiCellDS
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+CODECS = ["zlib", pytest.param("zstd", marks=pytest.mark.skipif(
+    importlib.util.find_spec("zstandard") is None, reason="needs zstandard"))]
+
+
+class _Snapshots(object):
+    # Minimal MultiCellDS over a list of cells matrices
+    cell_columns = ["ID", "x_position", "total_volume", "current_phase"]
+    time_units = "min"
+
+    def __init__(self, matrices):
+        self.matrices = matrices
+
+    def cells_as_matrix_iterator(self):
+        for i, cells in enumerate(self.matrices):
+            yield 60.0 * i, cells
+
+
+def _cells(ids, rng):
+    cells = rng.random((len(ids), 4))
+    cells[:, 0] = ids
+    cells[:, 3] = rng.integers(0, 20, len(ids))
+    return cells
+
+
+def _snapshots(rng):
+    # Cells dividing, dying and shuffled, snapshots without cells followed by
+    # snapshots with cells, and a single cell with ID 0
+    ids = np.arange(200)
+    matrices = []
+    for step in range(12):
+        if step in (3, 4, 8):
+            matrices.append(np.zeros((0, 4)))
+            continue
+        if step == 9:
+            matrices.append(_cells(np.array([0]), rng))
+            continue
+        ids = np.concatenate([ids[rng.random(len(ids)) > 0.1], ids.max() + 1 + np.arange(30)])
+        ids = rng.permutation(ids)
+        cells = _cells(ids, rng)
+        if matrices and len(matrices[-1]) == len(ids) and step % 2:
+            cells = matrices[-1].copy()
+            cells[:, 1] += 1e-3
+        matrices.append(cells)
+    return matrices
+
+
+@pytest.mark.parametrize("codec", CODECS)
+@pytest.mark.parametrize("keyframe_interval", [1, 3, 100])
+def test_round_trip(tmp_path, codec, keyframe_interval):
+    matrices = _snapshots(np.random.default_rng(keyframe_interval))
+    archive = write_archive(_Snapshots(matrices), str(tmp_path / "cells.pctka"),
+                            keyframe_interval=keyframe_interval, codec=codec)
+    assert len(archive) == len(matrices)
+    for (time, cells), expected in zip(archive.cells_as_matrix_iterator(), matrices):
+        assert np.array_equal(cells, expected)
+
+    # Random access, in reverse and with a subset of the columns
+    archive = CellArchive(str(tmp_path / "cells.pctka"))
+    for i in reversed(range(len(matrices))):
+        cells = archive.load(i, ["total_volume", "ID"])
+        assert np.array_equal(cells, matrices[i][:, [2, 0]])
+
+
+def test_empty_snapshot_followed_by_cells(tmp_path):
+    rng = np.random.default_rng(0)
+    matrices = [_cells(np.arange(10), rng), np.zeros((0, 4)), _cells(np.arange(5, 20), rng)]
+    archive = write_archive(_Snapshots(matrices), str(tmp_path / "cells.pctka"), codec="zlib")
+    assert archive.load(1).shape == (0, 4)
+    assert np.array_equal(archive.load(2), matrices[2])
+
+
+def test_output_round_trip(tmp_path):
+    mcds = MultiCellDS(output_folder=OUTPUT)
+    archive = write_archive(mcds, str(tmp_path / "output.pctka"), keyframe_interval=3)
+    assert archive.columns == mcds.cell_columns
+    for (time, cells), (expected_time, expected) in zip(archive.cells_as_matrix_iterator(),
+                                                          mcds.cells_as_matrix_iterator()):
+        assert time == expected_time
+        assert np.array_equal(cells, expected)
@@ -0,0 +1,99 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pctk import backends
+from pctk.archive import write_archive
+from pctk.multicellds import MultiCellDS
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+COLUMNS = ["ID", "x", "phase", "cell_type"]
+
+
+def _physicell_expected():
+    mcds = MultiCellDS(output_folder=OUTPUT)
+    return mcds.cell_columns, list(mcds.cells_as_matrix_iterator())
+
+
+def _backends(tmp_path):
+    archive_fname = str(tmp_path / "cells.pctka")
+    write_archive(MultiCellDS(output_folder=OUTPUT), archive_fname, keyframe_interval=2)
+    return {
+        "physicell": backends.get_backend(OUTPUT),
+        "archive": backends.get_backend(archive_fname, format="archive"),
+        "physicell_cache": backends.get_backend(OUTPUT, cache=True, cache_folder=str(tmp_path / "cache")),
+        "archive_cache": backends.get_backend(archive_fname, format="archive", cache=True,
+                                              cache_folder=str(tmp_path / "cache")),
+    }
+
+
+def test_physicell_backends_match_multicellds(tmp_path):
+    cell_columns, expected = _physicell_expected()
+    rows = [cell_columns.index(c) for c in ["ID", "x_position", "current_phase", "cell_type"]]
+    for name, backend in _backends(tmp_path).items():
+        assert backend.columns == cell_columns, name
+        # Twice, so the cached backends also read their cache
+        for _ in range(2):
+            snapshots = backend.list_snapshots()
+            assert len(snapshots) == len(expected)
+            for snapshot, (time, cells) in zip(snapshots, expected):
+                assert backend.get_time(snapshot) == time, name
+                assert np.array_equal(backend.load_columns(snapshot), cells), name
+                assert np.array_equal(backend.load_columns(snapshot, COLUMNS), cells[:, rows]), name
+
+
+def test_parallel_iteration(tmp_path):
+    for name, backend in _backends(tmp_path).items():
+        serial = list(backend.iter_columns(COLUMNS))
+        parallel = list(backend.iter_columns(COLUMNS, processes=2))
+        assert [t for t, _ in serial] == [t for t, _ in parallel], name
+        assert all(np.array_equal(a, b) for (_, a), (_, b) in zip(serial, parallel)), name
+
+
+def test_physiboss_backend_matches_pandas(tmp_path):
+    for backend in (backends.get_backend(OUTPUT, format="physiboss"),
+                    backends.get_backend(OUTPUT, format="physiboss", cache=True, cache_folder=str(tmp_path))):
+        snapshots = backend.list_snapshots()
+        assert len(snapshots) == 5
+        for _ in range(2):
+            for snapshot in snapshots:
+                df = pd.read_csv(snapshot, sep=";")
+                assert backend.get_time(snapshot) == df["Time"].iloc[0]
+                assert np.allclose(backend.load_columns(snapshot), df.values)
+                frame = backend.load_frame(snapshot, ["ID", "x", "phase"])
+                assert list(frame.columns) == ["ID", "x", "phase"]
+                assert np.allclose(frame.values, df[["ID", "x", "phase"]].values)
+
+
+def test_cache_rebuilds_modified_snapshots(tmp_path):
+    output_folder = str(tmp_path / "output")
+    shutil.copytree(OUTPUT, output_folder)
+    backend = backends.get_backend(output_folder, cache=True)
+    snapshot = backend.list_snapshots()[1]
+    backend.load_columns(snapshot)
+
+    # Another snapshot's cells written over the source of this one
+    source = backend.snapshot_source(snapshot)
+    shutil.copy(backend.snapshot_source(backend.list_snapshots()[3]), source)
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    expected = backends.get_backend(output_folder).load_columns(snapshot)
+    assert np.array_equal(backend.load_columns(snapshot), expected)
+    assert np.array_equal(backends.get_backend(output_folder, cache=True).load_columns(snapshot), expected)
+
+
+def test_no_columns(tmp_path):
+    backend = backends.get_backend(OUTPUT, cache=True, cache_folder=str(tmp_path))
+    snapshot = backend.list_snapshots()[1]
+    num_cells = len(backend.backend.load_columns(snapshot, ["ID"]))
+    # Before and after the snapshot is cached
+    for _ in range(2):
+        assert backend.load_columns(snapshot, []).shape == (num_cells, 0)
+
+
+def test_invalid_format():
+    with pytest.raises(ValueError, match="Invalid format"):
+        backends.get_backend(OUTPUT, format="vtk")
@@ -0,0 +1,17 @@
+import os
+import shutil
+
+from pctk.benchmark import run_benchmarks
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+
+
+def test_existing_folder_is_not_modified(tmp_path):
+    output_folder = str(tmp_path / "output")
+    shutil.copytree(OUTPUT, output_folder)
+    before = sorted(os.listdir(output_folder))
+    report = run_benchmarks(output_folder, existing=True, repeat=1,
+                            cases=["POVWriter.write_pov_file", "CellArchive.cells_as_matrix_iterator"])
+    assert set(report["results"]) == {"POVWriter.write_pov_file", "CellArchive.cells_as_matrix_iterator"}
+    assert all("min" in result for result in report["results"].values())
+    assert sorted(os.listdir(output_folder)) == before
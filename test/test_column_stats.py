@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pctk import column_stats
+from pctk.multicellds import MultiCellDS
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+STATISTICS = ("count", "mean", "std", "min", "max")
+
+
+def _pandas_statistics(values, keys, quantiles):
+    grouped = pd.DataFrame(values).groupby(keys)
+    expected = {"count": grouped.count(), "mean": grouped.mean(), "std": grouped.std(),
+                "min": grouped.min(), "max": grouped.max()}
+    for q in quantiles:
+        expected[column_stats.quantile_name(q)] = grouped.quantile(q)
+    return expected
+
+
+def test_grouped_statistics_match_pandas():
+    rng = np.random.default_rng(1)
+    values = rng.normal(size=(500, 3))
+    values[rng.random(values.shape) < 0.1] = np.nan
+    # Group 1 is empty, group 4 has a single cell
+    keys = rng.choice([0, 2, 3], 500)
+    keys[17] = 4
+    quantiles = (0.1, 0.5, 0.9)
+    results = column_stats.grouped_statistics(values, keys, 6, statistics=STATISTICS, quantiles=quantiles)
+    for name, frame in _pandas_statistics(values, keys, quantiles).items():
+        expected = frame.reindex(range(6)).values
+        if name == "count":
+            expected = np.nan_to_num(expected)
+        assert np.allclose(results[name], expected, equal_nan=True), name
+
+
+def test_phase_groups():
+    lookup = column_stats.phase_group_lookup({0: "a", 2: "b", 3: "c"}, {"a": "alive", "b": "necrotic"})
+    groups = column_stats.phase_groups(np.array([0, 2, 3, 1, -1, 99.0]), lookup, 3)
+    assert groups.tolist() == [0, 2, 3, 3, 3, 3]
+
+
+def _cells_frame(mcds, columns):
+    # Cells of every snapshot with their time and phase group, for pandas
+    lookup = column_stats.phase_group_lookup(mcds.phases_dict, mcds.phase_grouping)
+    frames = []
+    for time, df in mcds.cells_as_frames_iterator():
+        df = df[columns + ["current_phase", "cell_type"]].copy()
+        groups = column_stats.phase_groups(df["current_phase"].values, lookup, len(column_stats.PHASE_GROUPS) - 1)
+        df["phase_group"] = np.array(column_stats.PHASE_GROUPS)[groups]
+        df["time"] = time
+        frames.append(df)
+    return pd.concat(frames)
+
+
+@pytest.mark.parametrize("group_by", [("phase_group", "cell_type"), ("phase_group",), ("cell_type",)])
+def test_column_statistics_match_pandas(group_by):
+    mcds = MultiCellDS(output_folder=OUTPUT)
+    columns = ["total_volume", "nuclear_volume"]
+    table = mcds.get_column_statistics(columns, statistics=STATISTICS, quantiles=(0.5,), group_by=group_by)
+    grouped = _cells_frame(mcds, columns).groupby(["time"] + list(group_by))
+    for column in columns:
+        expected = grouped[column].agg(["count", "mean", "std", "min", "max"])
+        expected["q50"] = grouped[column].median()
+        actual = table[column]
+        actual.columns = list(actual.columns)
+        assert list(actual.index) == list(expected.index)
+        assert np.allclose(actual.values, expected.values, equal_nan=True)
+
+
+def test_column_histograms_match_numpy():
+    mcds = MultiCellDS(output_folder=OUTPUT)
+    edges = np.linspace(0, 5000, 21)
+    table = mcds.get_column_histograms("total_volume", edges, group_by=("phase_group",))
+    cells = _cells_frame(mcds, ["total_volume"])
+    for (time, group), counts in table.iterrows():
+        selected = cells[(cells["time"] == time) & (cells["phase_group"] == group)]
+        assert np.array_equal(counts.values, np.histogram(selected["total_volume"], bins=edges)[0])
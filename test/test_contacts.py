@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pytest
+from scipy.spatial.distance import pdist, squareform
+
+from pctk import backends, contacts
+from pctk.multicellds import MultiCellDS
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+
+
+def _brute_force(positions, radii, tolerance):
+    # Every pair of cells, and the clusters grown one contact at a time
+    touching = squareform(pdist(positions)) < radii[:, None] + radii[None, :] + tolerance
+    np.fill_diagonal(touching, False)
+    labels = np.arange(len(positions))
+    for i, j in zip(*np.nonzero(np.triu(touching))):
+        labels[labels == labels[j]] = labels[i]
+    return touching, labels
+
+
+def _same_partition(a, b):
+    _, a = np.unique(a, return_inverse=True)
+    _, b = np.unique(b, return_inverse=True)
+    pairs = set(zip(a.tolist(), b.tolist()))
+    return len(pairs) == len(set(a.tolist())) == len(set(b.tolist()))
+
+
+@pytest.mark.parametrize("tolerance", [0.0, 2.0])
+def test_contacts_match_brute_force(tolerance):
+    mcds = MultiCellDS(output_folder=OUTPUT)
+    frames = list(mcds.cells_as_frames_iterator())
+    stats, sizes = contacts.contact_statistics(backends.get_backend(OUTPUT), tolerance=tolerance)
+    for (time, df), (_, row) in zip(frames[::2], stats.iloc[::2].iterrows()):
+        positions = df[["x_position", "y_position", "z_position"]].values
+        radii = contacts.cell_radii(df["total_volume"].values)
+        touching, labels = _brute_force(positions, radii, tolerance)
+
+        pairs = contacts.contact_pairs(positions, radii, tolerance=tolerance)
+        assert {tuple(sorted(p)) for p in pairs.tolist()} == set(zip(*np.nonzero(np.triu(touching))))
+        neighbors, clusters = contacts.snapshot_contacts(positions, radii, tolerance=tolerance)
+        assert np.array_equal(neighbors, touching.sum(axis=1))
+        assert _same_partition(clusters, labels)
+
+        cluster_sizes = np.unique(labels, return_counts=True)[1]
+        assert row["time"] == time
+        assert row["num_cells"] == len(df)
+        assert row["num_contacts"] == touching.sum() // 2
+        assert row["num_clusters"] == len(cluster_sizes)
+        assert row["largest_cluster"] == cluster_sizes.max()
+        assert row["isolated_cells"] == (touching.sum(axis=1) == 0).sum()
+        expected_sizes = dict(zip(*np.unique(cluster_sizes, return_counts=True)))
+        snapshot_sizes = sizes[sizes["time"] == time]
+        assert dict(zip(snapshot_sizes["cluster_size"], snapshot_sizes["num_clusters"])) == expected_sizes
+
+
+def test_few_cells():
+    assert contacts.contact_pairs(np.zeros((1, 3)), np.ones(1)).shape == (0, 2)
+    neighbors, labels = contacts.snapshot_contacts(np.zeros((0, 3)), np.zeros(0))
+    assert len(neighbors) == len(labels) == 0
+    stats, sizes = contacts.cluster_statistics(neighbors, labels)
+    assert stats["num_cells"] == 0 and sizes == {}
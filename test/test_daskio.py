@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pctk import daskio, readers
+from pctk.multicellds import MultiCellDS
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+
+
+def test_missing_dask(monkeypatch):
+    monkeypatch.setattr(daskio, "_dask", False)
+    with pytest.raises(ImportError, match=r"pip install pctk\[dask\]"):
+        MultiCellDS(output_folder=OUTPUT).to_dask()
+
+
+class _DataFrames(object):
+    # Stands for dask.dataframe, from_map only records its arguments
+    def from_map(self, func, iterable, args=(), **kwargs):
+        self.func, self.inputs, self.args, self.kwargs = func, list(iterable), list(args), kwargs
+        return self
+
+
+def test_cells_partitions(monkeypatch):
+    # The partition layout is checked without dask: one input per snapshot,
+    # in time order, each loaded by its own call with the query columns
+    dd = _DataFrames()
+    monkeypatch.setattr(daskio, "_dask", (None, None, dd))
+    mcds = MultiCellDS(output_folder=OUTPUT)
+    assert mcds.to_dask(columns=["x_position", "cell_type"]) is dd
+    frames = list(mcds.cells_as_frames_iterator())
+    assert [time for time, _ in dd.inputs] == [time for time, _ in frames]
+    assert len(set(fname for _, fname in dd.inputs)) == len(frames)
+    assert dd.kwargs["columns"] == ["time", "x_position", "cell_type"]
+    assert dd.kwargs["label"] == "pctk-cells"
+    meta = dd.kwargs["meta"]
+    assert len(meta) == 0 and list(meta.columns) == dd.kwargs["columns"]
+
+    # Only the rows of the projected columns are read
+    read_rows = []
+    read = readers.read_physicell_cells
+    def counted(fname, rows=None, **kwargs):
+        read_rows.append(rows)
+        return read(fname, rows=rows, **kwargs)
+    monkeypatch.setattr(readers, "read_physicell_cells", counted)
+    for snapshot, (time, frame) in zip(dd.inputs, frames):
+        partition = dd.func(snapshot, *dd.args, columns=["time", "cell_type"])
+        assert (partition["time"] == time).all()
+        pd.testing.assert_series_equal(partition["cell_type"], frame["cell_type"].reset_index(drop=True),
+                                       check_names=False)
+        assert partition.dtypes.equals(meta[["time", "cell_type"]].dtypes)
+    assert read_rows == [[mcds.cell_columns.index("cell_type")]] * len(frames)
+
+
+def test_cells_to_dask():
+    pytest.importorskip("dask.dataframe")
+    mcds = MultiCellDS(output_folder=OUTPUT)
+    df = mcds.to_dask(columns=["x_position", "cell_type"]).compute()
+    frames = list(mcds.cells_as_frames_iterator())
+    expected = np.concatenate([frame[["x_position", "cell_type"]].values for _, frame in frames])
+    assert list(df.columns) == ["time", "x_position", "cell_type"]
+    assert np.array_equal(df[["x_position", "cell_type"]].values, expected)
+    assert np.array_equal(df["time"].unique(), [time for time, _ in frames])
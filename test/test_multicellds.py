@@ -0,0 +1,18 @@
+import os
+
+import numpy as np
+
+from pctk.multicellds import MultiCellDS
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+
+
+def test_float32_frames_are_compact():
+    mcds = MultiCellDS(output_folder=OUTPUT)
+    frames = zip(mcds.cells_as_frames_iterator(), mcds.cells_as_frames_iterator(float32=True))
+    for (time, df), (time32, df32) in frames:
+        assert time == time32
+        assert df32["current_phase"].dtype == "category"
+        assert df32["total_volume"].dtype == np.float32
+        assert df32.memory_usage(deep=True).sum() < 0.6 * df.memory_usage(deep=True).sum()
+        assert np.allclose(df32["total_volume"], df["total_volume"], rtol=1e-6)
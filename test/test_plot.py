@@ -0,0 +1,60 @@
+import os
+import sys
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from pctk.multicellds import MultiCellDS
+from pctk.plot import get_timeserie_mean, plot_snapshots
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+
+
+def test_timeserie_mean_without_alive_cells():
+    mcds = MultiCellDS(output_folder=OUTPUT)
+    mcds._phase_grouping = {name: "necrotic" for name in mcds.phase_grouping}
+    df = get_timeserie_mean(mcds)
+    assert len(df) == 5
+    assert df["total_volume"].isna().all()
+    assert np.array_equal(df["time"], [0, 60, 120, 180, 240])
+
+
+def _backend_after_get_pyplot(env, setup=""):
+    # get_pyplot in a fresh interpreter, as the pctk command calls it. The
+    # backend is read without resolving it, which would pick one on its own
+    code = setup + ("from pctk.plot import get_pyplot; import matplotlib; get_pyplot(); "
+                    "print(dict.__getitem__(matplotlib.rcParams, 'backend'))")
+    env = {**{k: v for k, v in os.environ.items() if k not in ("MPLBACKEND", "DISPLAY")}, **env}
+    env["PYTHONPATH"] = os.pathsep.join(sys.path)
+    return subprocess.check_output([sys.executable, "-c", code], env=env, text=True).strip().lower()
+
+
+def test_get_pyplot_without_display():
+    assert _backend_after_get_pyplot({}) == "agg"
+    # An explicit backend, or a pyplot already in use, is kept
+    assert _backend_after_get_pyplot({"MPLBACKEND": "svg"}) == "svg"
+    setup = "import matplotlib; matplotlib.use('pdf'); import matplotlib.pyplot; "
+    assert _backend_after_get_pyplot({}, setup) == "pdf"
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+@pytest.mark.parametrize("time_range, indexes", [((60, 180), [1, 2, 3]), ((None, 60), [0, 1]), ((200, None), [4])])
+def test_plot_snapshots_time_range(tmp_path, processes, time_range, indexes):
+    output_folder = str(tmp_path / "output")
+    shutil.copytree(OUTPUT, output_folder)
+    out_folder = str(tmp_path / "frames")
+    fnames = plot_snapshots(output_folder, out_folder, plane="xz", time_range=time_range,
+                            processes=processes, size=2, dpi=50)
+    expected = [os.path.join(out_folder, "output%08i_xz.png" % i) for i in indexes]
+    assert fnames == expected
+    assert sorted(os.listdir(out_folder)) == [os.path.basename(fname) for fname in expected]
+    images = []
+    for fname in fnames:
+        with Image.open(fname) as image:
+            assert image.format == "PNG" and image.size == (100, 100)
+            images.append(np.asarray(image))
+    # Each frame is drawn from its own snapshot
+    assert all((a != b).any() for a, b in zip(images, images[1:]))
@@ -0,0 +1,100 @@
+import io
+import os
+import shutil
+import contextlib
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+
+from pctk.column_stats import PHASE_GROUPS
+from pctk.config import phases_dict, phase_grouping
+from pctk.multicellds import MultiCellDS
+from pctk.pointcloud import write_point_clouds
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+VTK_TYPES = {"Float32": "<f4", "Int32": "<i4", "Int64": "<i8"}
+PLY_TYPES = {"float": "<f4", "int": "<i4"}
+
+
+def _expected(index):
+    # Point attributes of each snapshot computed from the cells frames
+    expected = {}
+    for i, (time, df) in enumerate(MultiCellDS(output_folder=OUTPUT).cells_as_frames_iterator()):
+        if i not in index:
+            continue
+        group = df.current_phase.map(lambda code: phase_grouping.get(phases_dict.get(int(code)), "other"))
+        expected[i] = (time, {
+            "Points": df[["x_position", "y_position", "z_position"]].values.astype("<f4"),
+            "radius": np.cbrt(3 / (4 * np.pi) * df.total_volume.values).astype("<f4"),
+            "nuclear_radius": np.cbrt(3 / (4 * np.pi) * df.nuclear_volume.values).astype("<f4"),
+            "cell_type": df.cell_type.values.astype(int),
+            "phase": df.current_phase.values.astype(int),
+            "phase_group": group.map(PHASE_GROUPS.index).values,
+        })
+    return expected
+
+
+def _read_vtp(fname):
+    # Arrays of the appended raw section, each one after its uint64 size
+    with open(fname, "rb") as fh:
+        content = fh.read()
+    header, data = content.split(b'<AppendedData encoding="raw">\n_', 1)
+    assert data.endswith(b"\n</AppendedData>\n</VTKFile>\n")
+    piece = ET.fromstring(header.decode() + "</VTKFile>").find("PolyData/Piece")
+    arrays = {}
+    for array in piece.iter("DataArray"):
+        offset = int(array.get("offset"))
+        size = int(np.frombuffer(data, "<u8", 1, offset)[0])
+        values = np.frombuffer(data, VTK_TYPES[array.get("type")], offset=offset + 8,
+                               count=size // np.dtype(VTK_TYPES[array.get("type")]).itemsize)
+        arrays[array.get("Name")] = values.reshape(-1, int(array.get("NumberOfComponents")))
+    return int(piece.get("NumberOfPoints")), arrays
+
+
+def _read_ply(fname):
+    with open(fname, "rb") as fh:
+        content = fh.read()
+    header, data = content.split(b"end_header\n", 1)
+    lines = header.decode().splitlines()
+    assert lines[:2] == ["ply", "format binary_little_endian 1.0"]
+    count = int(next(line for line in lines if line.startswith("element vertex")).split()[-1])
+    fields = [(name, PLY_TYPES[ply_type]) for _, ply_type, name in
+              (line.split() for line in lines if line.startswith("property"))]
+    vertices = np.frombuffer(data, dtype=fields)
+    assert len(vertices) == count
+    arrays = {name: vertices[name].reshape(-1, 1) for name, _ in fields if name not in "xyz"}
+    arrays["Points"] = np.stack([vertices[axis] for axis in "xyz"], axis=1)
+    return count, arrays
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+@pytest.mark.parametrize("file_format", ["vtp", "ply"])
+def test_point_clouds_read_back(tmp_path, file_format, processes):
+    output_folder = str(tmp_path / "output")
+    shutil.copytree(OUTPUT, output_folder)
+    out_folder = str(tmp_path / "clouds")
+    with contextlib.redirect_stdout(io.StringIO()):
+        fnames = write_point_clouds(output_folder, index_list=[0, 2, 4], out_folder=out_folder,
+                                    file_format=file_format, processes=processes)
+
+    expected = _expected([0, 2, 4])
+    clouds = [os.path.join(out_folder, "output%08i_cells_physicell.%s" % (i, file_format)) for i in expected]
+    if file_format == "vtp":
+        assert fnames == clouds + [os.path.join(out_folder, "cells.pvd")]
+        datasets = ET.parse(fnames[-1]).getroot().find("Collection")
+        assert [(float(d.get("timestep")), d.get("file")) for d in datasets] == \
+            [(time, os.path.basename(fname)) for (time, _), fname in zip(expected.values(), clouds)]
+    else:
+        assert fnames == clouds
+
+    read = _read_vtp if file_format == "vtp" else _read_ply
+    for fname, (time, attributes) in zip(clouds, expected.values()):
+        count, arrays = read(fname)
+        assert count == len(attributes["Points"])
+        for name, values in attributes.items():
+            assert np.allclose(arrays[name].reshape(values.shape), values, rtol=1e-6), name
+        if file_format == "vtp":
+            # One vertex cell per point
+            assert np.array_equal(arrays["connectivity"].ravel(), np.arange(count))
+            assert np.array_equal(arrays["offsets"].ravel(), np.arange(1, count + 1))
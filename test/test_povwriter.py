@@ -0,0 +1,193 @@
+import io
+import os
+import shutil
+import hashlib
+import contextlib
+
+import numpy as np
+import pytest
+from scipy.io import savemat
+
+from pctk.archive import write_archive
+from pctk.multicellds import MultiCellDS
+from pctk.readers import read_physicell_cells, read_snapshot_metadata
+from pctk.povwriter import POV_Options, POVWriter, create_defulat_config
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+# sha1 of the .pov file of snapshot 2 written with the default config by
+# pctk before culling, views and column resolution were added
+BASELINE_POV_SHA1 = "aa12d43988976d7422d27ba763b6bb5f87dd6ab6"
+
+
+@pytest.fixture
+def writer(tmp_path):
+    output_folder = str(tmp_path / "output")
+    shutil.copytree(OUTPUT, output_folder)
+    config = os.path.join(output_folder, "povwriter.xml")
+    create_defulat_config(config, output_folder)
+    return POVWriter(config)
+
+
+def _write(writer, idx=2):
+    with contextlib.redirect_stdout(io.StringIO()):
+        fname = writer.write_pov_file(idx)
+    with open(fname, "rb") as fh:
+        return fh.read()
+
+
+def _spheres(pov):
+    return {line for line in pov.decode().splitlines() if line.startswith(" <")}
+
+
+def test_pov_output_unchanged(writer):
+    assert hashlib.sha1(_write(writer)).hexdigest() == BASELINE_POV_SHA1
+
+
+def test_frustum_culling_drops_spheres_only(writer):
+    spheres = _spheres(_write(writer))
+    writer.options.frustum_culling = True
+    writer.pov_options.camera_distance /= 4
+    writer.pov_options.set_camera_from_spherical_location()
+    culled = _spheres(_write(writer))
+    assert culled < spheres and len(culled) > 0
+
+
+@pytest.mark.parametrize("source", ["archive", "cache"])
+def test_backends_write_the_same_pov(writer, source):
+    expected = _write(writer)
+    output_folder = writer.options.output_folder
+    config = os.path.join(output_folder, "povwriter.xml")
+    if source == "archive":
+        # The config points to the archive instead of the output folder
+        archive_fname = os.path.join(output_folder, "cells.pctka")
+        write_archive(MultiCellDS(output_folder=output_folder), archive_fname)
+        create_defulat_config(config, archive_fname)
+        writer = POVWriter(config, format="archive")
+    else:
+        writer = POVWriter(config, cache=True)
+    for _ in range(2):
+        assert _write(writer) == expected
+    if source == "archive":
+        assert writer.pov_file_name(2) == os.path.join(output_folder, "cells_00000002.pov")
+
+
+def test_columns_resolved_by_label(writer):
+    expected = _write(writer)
+    output_folder = writer.options.output_folder
+    xml_fname = os.path.join(output_folder, "output00000002.xml")
+    mat_fname = os.path.join(output_folder, "output00000002_cells_physicell.mat")
+    labels = read_snapshot_metadata(xml_fname, sections=("cells",))["labels"]
+    cells = read_physicell_cells(mat_fname)
+
+    # The labels in reverse order after an extra vector, with the columns
+    # of the cells matrix moved to their new indexes
+    blocks = [np.ones((len(cells), 2))]
+    with open(xml_fname) as fh:
+        xml = fh.read()
+    index = 2
+    for name, old_index, size in reversed(labels):
+        blocks.append(cells[:, old_index:old_index + size])
+        old = f'<label index="{old_index}" size="{size}">{name}</label>'
+        xml = xml.replace(old, f'<label index="{index}" size="{size}">{name}</label>')
+        index += size
+    xml = xml.replace("<labels>", '<labels><label index="0" size="2">extra</label>')
+    with open(xml_fname, "w") as fh:
+        fh.write(xml)
+    savemat(mat_fname, {"cells": np.hstack(blocks).T}, format="4")
+
+    writer = POVWriter(os.path.join(output_folder, "povwriter.xml"))
+    assert _write(writer) == expected
+
+
+VIEWS = """
+	<views>
+		<view name="front">
+			<clipping_planes/>
+		</view>
+		<view name="cut"/>
+		<view name="top">
+			<camera>
+				<distance_from_origin units="micron">750</distance_from_origin>
+				<xy_angle>3.92699081699</xy_angle>
+				<yz_angle>0.01</yz_angle>
+			</camera>
+		</view>
+	</views>
+"""
+
+
+def _location(pov):
+    return [line.strip() for line in pov.decode().splitlines() if line.strip().startswith("location")][0]
+
+
+def test_one_pov_per_view(writer, monkeypatch):
+    expected = _write(writer)
+    config = os.path.join(writer.options.output_folder, "povwriter.xml")
+    with open(config) as fh:
+        xml = fh.read()
+    with open(config, "w") as fh:
+        fh.write(xml.replace("</povwriter_settings>", VIEWS + "</povwriter_settings>"))
+
+    reads = []
+    read_cells = POVWriter.read_cells
+    def counted(self, idx):
+        reads.append(idx)
+        return read_cells(self, idx)
+    monkeypatch.setattr(POVWriter, "read_cells", counted)
+    with contextlib.redirect_stdout(io.StringIO()):
+        writer = POVWriter(config)
+        fnames = writer.write_pov_views(2)
+    # The cells file is read once for the three views
+    assert reads == [2]
+    base = writer.options.output_base(2)
+    assert fnames == [f"{base}_{view}.pov" for view in ("front", "cut", "top")]
+    front, cut, top = [open(fname, "rb").read() for fname in fnames]
+
+    # cut keeps the top-level camera and planes, front drops the planes
+    # and keeps the camera, top moves the camera only
+    assert cut == expected
+    assert _spheres(cut) < _spheres(front)
+    assert _spheres(top) == _spheres(cut)
+    location = [_location(pov) for pov in (front, cut, top)]
+    assert location[0] == location[1] != location[2]
+    assert location[2] == "location <-5.000,-5.000,749.000>"
+
+
+def _unit(v):
+    return v / np.linalg.norm(v)
+
+
+def test_camera_basis_handedness():
+    options = POV_Options()
+    direction = _unit(options.camera_look_at - options.camera_position)
+    left_handed_right = _unit(np.cross(options.camera_sky, direction))
+
+    # camera_right <-1,0,0> mirrors POV-Ray's left-handed frame
+    d, right, up = options.camera_basis()
+    assert np.allclose(d, direction)
+    assert np.allclose(right, -left_handed_right)
+    assert np.allclose(np.cross(right, up), -direction)
+    assert np.dot(up, options.camera_sky) > 0
+
+    # Left-handed up and right vectors keep POV-Ray's default frame
+    options.camera_up = np.array([0, 1, 0])
+    options.camera_right = np.array([1, 0, 0])
+    d, right, up2 = options.camera_basis()
+    assert np.allclose(right, left_handed_right)
+    assert np.allclose(up2, up)
+
+
+def test_camera_basis_default_camera():
+    # The default up <0,0,1> is parallel to POV-Ray's default direction, so
+    # the handedness product is exactly 0 and right is flipped like POV-Ray does
+    options = POV_Options()
+    assert np.dot(np.cross(options.camera_up, [0, 0, 1]), options.camera_right) == 0
+    d, right, up = options.camera_basis()
+    assert np.allclose(right, _unit(np.array([1, -1, 0])))
+    assert np.isclose(up[0], up[1]) and up[2] > 0
+    assert np.allclose(np.cross(right, up), -d)
+
+    # A positive product keeps right = sky x direction
+    options.camera_up = np.array([0, -1, 0])
+    _, right, _ = options.camera_basis()
+    assert np.allclose(right, _unit(np.array([-1, 1, 0])))
@@ -0,0 +1,69 @@
+import os
+import glob
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.io import loadmat, savemat
+
+from pctk import readers
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+CELLS_FNAMES = sorted(glob.glob(os.path.join(OUTPUT, "output*_cells_physicell.mat")))
+
+
+def _chunked(fname, chunk_size, rows=None, variable="cells"):
+    chunks = list(readers.iter_physicell_cells_chunks(fname, chunk_size=chunk_size, rows=rows, variable=variable))
+    assert all(len(chunk) <= chunk_size for chunk in chunks)
+    return np.concatenate(chunks)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 1000, 2**18])
+def test_mat4_chunks_match_loadmat(chunk_size):
+    # PhysiCell writes level 4 files
+    for fname in CELLS_FNAMES[:2]:
+        expected = loadmat(fname)["cells"].T
+        assert np.array_equal(_chunked(fname, chunk_size), expected)
+        assert np.array_equal(_chunked(fname, chunk_size, rows=[5, 1, 7]), expected[:, [5, 1, 7]])
+
+
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("chunk_size", [1, 999, 2**18])
+def test_mat5_chunks_match_loadmat(tmp_path, compress, chunk_size):
+    cells = loadmat(CELLS_FNAMES[0])["cells"]
+    fname = str(tmp_path / "cells.mat")
+    # Other variables before and after the cells
+    savemat(fname, {"a_label": np.arange(3.0), "cells": cells, "z_other": np.ones((2, 2))},
+            do_compression=compress)
+    expected = loadmat(fname)["cells"].T
+    assert np.array_equal(_chunked(fname, chunk_size), expected)
+    assert np.array_equal(_chunked(fname, chunk_size, rows=[0, 4]), expected[:, [0, 4]])
+
+
+def test_mat5_integer_and_empty_matrices(tmp_path):
+    fname = str(tmp_path / "cells.mat")
+    savemat(fname, {"cells": np.arange(24, dtype=np.int32).reshape(4, 6), "empty": np.zeros((4, 0))})
+    assert np.array_equal(_chunked(fname, 4), np.arange(24).reshape(4, 6).T)
+    assert list(readers.iter_physicell_cells_chunks(fname, variable="empty")) == []
+
+
+def test_read_physicell_cells_rows():
+    expected = loadmat(CELLS_FNAMES[0])["cells"].T
+    assert np.array_equal(readers.read_physicell_cells(CELLS_FNAMES[0], rows=[2, 0]), expected[:, [2, 0]])
+
+
+def test_physiboss_file_matches_pandas(monkeypatch):
+    fname = readers.physiboss_fnames(OUTPUT)[1]
+    expected = pd.read_csv(fname, sep=";")
+    for pyarrow in (readers._load_pyarrow(), False):
+        # With and without pyarrow
+        monkeypatch.setattr(readers, "_pyarrow", pyarrow)
+        names, data = readers.read_physiboss_file(fname, columns=["ID", "x", 14])
+        assert names == ["ID", "x", "phase"]
+        assert np.allclose(data, expected[names].values)
+
+
+def test_snapshot_metadata():
+    info = readers.read_snapshot_metadata(os.path.join(OUTPUT, "output00000002.xml"))
+    assert float(info["current_time"]) == 120
+    assert info["cells_fname"] == "output00000002_cells_physicell.mat"
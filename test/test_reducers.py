@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pctk.multicellds import MultiCellDS
+from pctk.plot import get_timeserie_mean
+from pctk.reducers import CountReducer, Filter, HistogramReducer, InFilter, MeanReducer, SpatialBinReducer
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+INDEX = {"x": 0, "y": 1, "z": 2, "volume": 3, "phase": 4}
+
+
+@pytest.fixture
+def cells():
+    rng = np.random.default_rng(0)
+    cells = np.empty((1000, 5))
+    cells[:, :3] = rng.uniform(-100, 100, (1000, 3))
+    cells[:, 3] = rng.uniform(1000, 3000, 1000)
+    cells[:, 4] = rng.integers(0, 5, 1000)
+    return cells
+
+
+def _reducers():
+    edges = [np.linspace(-100, 100, 5)] * 2
+    return [CountReducer("phase"), MeanReducer(["volume", "x"], where=InFilter("phase", [1, 3])),
+            HistogramReducer("volume", np.linspace(1000, 3000, 11), where=Filter("x", high=0)),
+            SpatialBinReducer(edges, value="volume", position=("x", "y"))]
+
+
+def _check(reducers, cells):
+    count, mean, histogram, spatial = reducers
+    values, counts = np.unique(cells[:, 4], return_counts=True)
+    assert count.result() == dict(zip(values.tolist(), counts.tolist()))
+
+    selected = cells[np.isin(cells[:, 4], [1, 3])][:, [3, 0]]
+    assert np.allclose(mean.result(), selected.mean(axis=0))
+    assert np.allclose(mean.std(), selected.std(axis=0))
+    assert mean.count == len(selected)
+
+    counts, edges = histogram.result()
+    assert np.array_equal(counts, np.histogram(cells[cells[:, 0] <= 0, 3], bins=edges)[0])
+
+    grid, means = spatial.result()
+    expected, _, _ = np.histogram2d(cells[:, 0], cells[:, 1], bins=spatial.edges)
+    sums, _, _ = np.histogram2d(cells[:, 0], cells[:, 1], bins=spatial.edges, weights=cells[:, 3])
+    assert np.array_equal(grid, expected)
+    assert np.allclose(means, sums / expected)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1000])
+def test_chunked_updates(cells, chunk_size):
+    reducers = _reducers()
+    for start in range(0, len(cells), chunk_size):
+        for reducer in reducers:
+            reducer.update(cells[start:start + chunk_size], INDEX)
+    _check(reducers, cells)
+
+
+def test_merge_partial_results(cells):
+    parts = [_reducers() for _ in range(3)]
+    for part, chunk in zip(parts, np.array_split(cells, [100, 101])):
+        for reducer in part:
+            reducer.update(chunk, INDEX)
+    merged = parts[0]
+    for part in parts[1:]:
+        merged = [a.merge(b) for a, b in zip(merged, part)]
+    _check(merged, cells)
+
+
+def test_empty_mean():
+    reducer = MeanReducer(["volume"])
+    reducer.update(np.zeros((0, 5)), INDEX)
+    assert np.isnan(reducer.result()).all()
+    assert np.isnan(reducer.std()).all()
+
+
+def test_chunked_summaries_match_frames():
+    mcds = MultiCellDS(output_folder=OUTPUT)
+    pd.testing.assert_frame_equal(mcds.get_cells_summary_frame(chunk_size=500), mcds.get_cells_summary_frame())
+    chunked = get_timeserie_mean(mcds, chunk_size=500)
+    frames = get_timeserie_mean(mcds)
+    assert list(chunked.columns) == list(frames.columns)
+    assert np.allclose(chunked.values, frames.values, equal_nan=True)
@@ -0,0 +1,131 @@
+import io
+import os
+import shutil
+import subprocess
+import contextlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from pctk import render
+from pctk.povwriter import POVWriter, create_defulat_config
+from pctk.render import animate_pngs, render_preview, write_pov_files
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+
+
+def _cells(writer, rows):
+    # (x, y, z, radius, phase) rows as the columns read by POVWriter
+    index = {key: i for i, key in enumerate(writer.options.columns_names_dict)}
+    cells = np.zeros((len(rows), len(index)))
+    for i, (x, y, z, radius, phase) in enumerate(rows):
+        cells[i, [index["x"], index["y"], index["z"]]] = x, y, z
+        cells[i, index["cyto_volume"]] = 4 / 3 * np.pi * radius**3
+        cells[i, index["nuc_volume"]] = 4 / 3 * np.pi * (radius / 2)**3
+        cells[i, index["phase"]] = phase
+    return cells
+
+
+def test_preview_pixels():
+    # Default camera 2500 away from the origin, looking at it along
+    # <1,1,-1.22>; with a right handed frame +x-y is on the right of the image
+    writer = POVWriter(None)
+    cells = _cells(writer, [(0, 0, 0, 100, 14), (400, -400, 0, 60, 100)])
+    image = render_preview(writer, cells, width=256, height=256)
+    assert image.shape == (256, 256, 3) and image.dtype == np.uint8
+
+    # The live cell is green at the center, the apoptotic one red at
+    # 256 * (0.5 + 400 * sqrt(2) / 2500) pixels from the left
+    red, green, blue = image[128, 128].astype(int)
+    assert green > red and green > blue
+    red, green, blue = image[128, 186].astype(int)
+    assert red > green and red > blue
+    assert (image[128, 70] == 255).all()
+    assert (image[5, 5] == 255).all()
+
+
+def test_incremental_pov_files(tmp_path, monkeypatch):
+    output_folder = str(tmp_path / "output")
+    shutil.copytree(OUTPUT, output_folder)
+    config = os.path.join(output_folder, "povwriter.xml")
+    create_defulat_config(config, output_folder)
+
+    def write():
+        with contextlib.redirect_stdout(io.StringIO()):
+            fnames = write_pov_files(config, [0, 1], num_of_threads=1, incremental=True)
+        return {fname: os.stat(fname).st_mtime_ns for fname in fnames}
+
+    first = write()
+    assert len(first) == 2
+
+    # Nothing changed, each frame is checked once and none is written again
+    checks = []
+    is_up_to_date = POVWriter.is_up_to_date
+    def counted(self, idx, view=None):
+        checks.append((idx, view))
+        return is_up_to_date(self, idx, view)
+    monkeypatch.setattr(POVWriter, "is_up_to_date", counted)
+    assert write() == first
+    assert sorted(checks) == [(0, None), (1, None)]
+
+    # Only the frame whose cells file changed is written again
+    cells_file = POVWriter(config).options.create_file_name(1)
+    stat = os.stat(cells_file)
+    os.utime(cells_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    second = write()
+    changed = [fname for fname in first if second[fname] != first[fname]]
+    assert changed == [POVWriter(config).pov_file_name(1)]
+
+
+COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0)]
+
+
+def _pngs(tmp_path):
+    # One flat colored frame per color, the last one larger than the others
+    fnames = []
+    for i, color in enumerate(COLORS):
+        fname = str(tmp_path / ("frame%i.png" % i))
+        Image.new("RGB", (40, 30) if i < len(COLORS) - 1 else (80, 60), color).save(fname)
+        fnames.append(fname)
+    return fnames
+
+
+@pytest.mark.parametrize("threads", [1, 2])
+def test_animate_gif(tmp_path, threads):
+    gif_fname = str(tmp_path / "animation.gif")
+    with contextlib.redirect_stdout(io.StringIO()):
+        animate_pngs(_pngs(tmp_path), gif_fname, fps=5, threads=threads, loop=2)
+    with Image.open(gif_fname) as gif:
+        assert gif.n_frames == len(COLORS)
+        assert gif.info["loop"] == 2
+        for i, color in enumerate(COLORS):
+            gif.seek(i)
+            assert gif.info["duration"] == 200
+            # Every frame takes the size of the first one
+            assert gif.size == (40, 30)
+            assert gif.convert("RGB").getpixel((20, 15)) == color
+
+
+def test_animate_video(tmp_path):
+    if not render.check_ffmpeg():
+        pytest.skip("needs ffmpeg")
+    mp4_fname = str(tmp_path / "animation.mp4")
+    with contextlib.redirect_stdout(io.StringIO()):
+        animate_pngs(_pngs(tmp_path), mp4_fname, fps=5)
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is None:
+        assert os.path.getsize(mp4_fname) > 0
+        return
+    frames = subprocess.check_output([ffprobe, "-v", "error", "-count_frames", "-select_streams", "v:0",
+                                      "-show_entries", "stream=nb_read_frames,width,height", "-of", "csv=p=0",
+                                      mp4_fname], text=True)
+    assert frames.strip() == "40,30,%i" % len(COLORS)
+
+
+def test_animate_video_needs_ffmpeg(tmp_path, monkeypatch):
+    monkeypatch.setattr(render.shutil, "which", lambda exec: None)
+    with pytest.raises(RuntimeError, match="ffmpeg is required"):
+        animate_pngs(_pngs(tmp_path), str(tmp_path / "animation.mp4"))
+    with pytest.raises(ValueError, match="Unsupported animation format .avi"):
+        animate_pngs(_pngs(tmp_path), str(tmp_path / "animation.avi"))
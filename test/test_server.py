@@ -0,0 +1,168 @@
+import os
+import time
+import socket
+import shutil
+import asyncio
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pctk import readers
+from pctk.multicellds import MultiCellDS
+from pctk.server import AnalysisServer, RemoteMultiCellDS, SnapshotCache
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+
+
+def test_concurrent_misses_cached_once(monkeypatch):
+    cache = SnapshotCache(OUTPUT)
+    read = readers.read_physicell_cells
+    barrier = threading.Barrier(2)
+
+    def slow_read(*args, **kwargs):
+        # Both threads miss before either of them caches the snapshot
+        data = read(*args, **kwargs)
+        barrier.wait(timeout=10)
+        return data
+
+    monkeypatch.setattr(readers, "read_physicell_cells", slow_read)
+    results = [None, None]
+
+    def load(i):
+        results[i] = cache.cells(0)
+
+    threads = [threading.Thread(target=load, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results[0] is results[1]
+    assert list(cache._entries) == [0]
+    assert cache._bytes == results[0].nbytes
+
+
+class _Cube(object):
+    times = [0.0]
+
+    def get_slice(self, substrate, axis, position, time):
+        return np.zeros((2, 2))
+
+
+def test_shared_values_built_once(monkeypatch):
+    cache = SnapshotCache(OUTPUT)
+    calls = []
+
+    def slow(*args, **kwargs):
+        calls.append(threading.get_ident())
+        # Long enough for every thread to miss
+        time.sleep(0.2)
+        return _Cube()
+
+    monkeypatch.setattr(MultiCellDS, "get_substrate_cube", slow)
+    threads = [threading.Thread(target=cache.microenvironment, args=("oxygen",)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert isinstance(cache._cube, _Cube)
+
+
+def test_refresh_resets_state():
+    cache = SnapshotCache(OUTPUT)
+    mcds = cache.mcds
+    cells = cache.cells(1)
+    cache._cube = object()
+    cache.refresh()
+    assert cache.mcds is not mcds
+    assert cache._cube is None
+    assert cache._bytes == 0
+    assert np.array_equal(cache.cells(1), cells)
+
+
+async def _shutdown(listener):
+    # Stops listening and ends the connections still open
+    listener.close()
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@pytest.fixture(scope="module")
+def server_url(tmp_path_factory):
+    # Server on a free port of a copy of test/output, in a thread of its own
+    output_folder = str(tmp_path_factory.mktemp("server") / "output")
+    shutil.copytree(OUTPUT, output_folder)
+    server = AnalysisServer(output_folder)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    listener = asyncio.run_coroutine_threadsafe(asyncio.start_server(server._respond, "127.0.0.1", 0), loop).result()
+    yield "http://127.0.0.1:%i" % listener.sockets[0].getsockname()[1]
+    asyncio.run_coroutine_threadsafe(_shutdown(listener), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=10)
+    loop.close()
+
+
+@pytest.mark.parametrize("format", ["npy", "arrow"])
+def test_client_matches_multicellds(server_url, format):
+    if format == "arrow" and not readers._load_pyarrow():
+        pytest.skip("needs pyarrow")
+    mcds = MultiCellDS(output_folder=OUTPUT)
+    remote = RemoteMultiCellDS(server_url, format=format)
+    try:
+        assert remote.cell_columns == mcds.cell_columns
+        assert remote.phases_dict == mcds.phases_dict
+        assert remote.time_units == mcds.time_units
+        assert all(np.array_equal(a, b) for a, b in zip(remote.get_mesh_coordinates(), mcds.get_mesh_coordinates()))
+
+        expected = list(mcds.cells_as_matrix_iterator())
+        for (time, cells), (expected_time, expected_cells) in zip(remote.cells_as_matrix_iterator(), expected):
+            assert time == expected_time
+            assert np.array_equal(cells, expected_cells)
+        columns = ["x_position", "current_phase"]
+        rows = [mcds.cell_columns.index(c) for c in columns]
+        assert np.array_equal(remote.get_cells(2, columns), expected[2][1][:, rows])
+
+        frames = zip(remote.cells_as_frames_iterator(columns), mcds.cells_as_frames_iterator())
+        for (time, df), (expected_time, expected_df) in frames:
+            pd.testing.assert_frame_equal(df, expected_df[columns])
+
+        summary = remote.get_cells_summary_frame()
+        expected_summary = mcds.get_cells_summary_frame()
+        assert np.array_equal(summary[expected_summary.columns].values, expected_summary.values)
+    finally:
+        remote.close()
+
+
+def _raw_status(server_url, request):
+    host, port = server_url[len("http://"):].split(":")
+    with socket.create_connection((host, int(port)), timeout=10) as sock:
+        sock.sendall(request)
+        return sock.makefile("rb").readline()
+
+
+@pytest.mark.parametrize("request_line", [b"\r\n", b"GET\r\n\r\n", b"GET /index HTTP/1.1 extra\r\n\r\n"])
+def test_malformed_request_line(server_url, request_line):
+    assert _raw_status(server_url, request_line).startswith(b"HTTP/1.1 400")
+    # The server still answers other requests
+    assert _raw_status(server_url, b"GET /index HTTP/1.0\r\n\r\n").startswith(b"HTTP/1.1 200")
+
+
+def test_client_errors(server_url):
+    remote = RemoteMultiCellDS(server_url)
+    try:
+        with pytest.raises(RuntimeError, match="400"):
+            remote.get_cells(0, ["not_a_column"])
+        with pytest.raises(RuntimeError, match="400.*snapshot -1"):
+            remote.get_cells(-1)
+        # test/output has no microenvironment files
+        with pytest.raises(RuntimeError, match="404.*microenvironment"):
+            remote.get_microenvironment_slice("oxygen")
+    finally:
+        remote.close()
@@ -0,0 +1,87 @@
+import gc
+import os
+
+import numpy as np
+import pytest
+
+from pctk import backends
+from pctk.sharedmem import SharedSnapshots
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+COLUMNS = ["ID", "x", "total_volume"]
+
+
+def _first_rows(handle, cells):
+    return cells[:10]
+
+
+def _total_volume(handle, cells):
+    return handle.time, cells[:, handle.columns.index("total_volume")].sum()
+
+
+def _mapped(name):
+    with open("/proc/self/maps") as fh:
+        return name in fh.read()
+
+
+@pytest.fixture
+def backend():
+    return backends.get_backend(OUTPUT)
+
+
+def _expected(backend, snapshot):
+    return backend.load_columns(snapshot, [backend.resolve(c) for c in COLUMNS])
+
+
+def test_handles_match_backend(backend):
+    with SharedSnapshots(backend) as shared:
+        handles = shared.load(COLUMNS, processes=2)
+        assert len(shared) == len(backend)
+        for handle, snapshot in zip(handles, backend.list_snapshots()):
+            assert handle.time == backend.get_time(snapshot)
+            assert np.array_equal(handle.attach(), _expected(backend, snapshot))
+            assert list(handle.attach_frame().columns) == ["ID", "x_position", "total_volume"]
+    assert len(shared) == 0
+
+
+def test_arrays_outlive_attach_and_unlink(backend):
+    snapshot = backend.list_snapshots()[0]
+    expected = _expected(backend, snapshot)
+    with SharedSnapshots(backend) as shared:
+        handle = shared.load(COLUMNS, snapshots=[snapshot])[0]
+        cells = handle.attach()
+        view = cells[:, 1]
+        frame = handle.attach_frame()
+        del cells
+        gc.collect()
+        assert np.array_equal(view, expected[:, 1])
+        assert np.array_equal(frame.values, expected)
+    # The owner unlinked the block, the views keep it mapped
+    gc.collect()
+    assert np.array_equal(view, expected[:, 1])
+    assert np.array_equal(frame["total_volume"].values, expected[:, 2])
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/maps"), reason="needs /proc/self/maps")
+def test_mapping_released_with_last_view(backend):
+    with SharedSnapshots(backend) as shared:
+        handle = shared.load(COLUMNS, snapshots=backend.list_snapshots()[:1])[0]
+        view = handle.attach()[5:, 0]
+        gc.collect()
+        assert _mapped(handle.name)
+        del view
+        gc.collect()
+        assert not _mapped(handle.name)
+
+
+def test_imap_results_may_be_views(backend):
+    with SharedSnapshots(backend) as shared:
+        handles = shared.load(COLUMNS)
+        rows = list(shared.imap(_first_rows, handles))
+        totals = list(shared.imap(_total_volume, handles, processes=2, release=True))
+        assert len(shared) == 0
+    for snapshot, first, (time, total) in zip(backend.list_snapshots(), rows, totals):
+        expected = _expected(backend, snapshot)
+        assert np.array_equal(first, expected[:10])
+        assert time == backend.get_time(snapshot)
+        assert total == pytest.approx(expected[:, 2].sum())
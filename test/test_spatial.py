@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pytest
+
+from pctk import backends
+from pctk.config import phases_dict, phase_grouping
+from pctk.multicellds import MultiCellDS
+from pctk.spatial import RadialReducer, density_maps, radial_edges, radial_profile, radial_profiles, voxel_grid
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+POSITION = ["x_position", "y_position", "z_position"]
+
+
+def _frames():
+    return list(MultiCellDS(output_folder=OUTPUT).cells_as_frames_iterator())
+
+
+def test_radial_profile_values():
+    # Cells at known distances from the center, two of them on a shell edge
+    positions = np.array([[0, 0, 0], [5, 0, 0], [0, 10, 0], [0, 0, -15], [3, 4, 0], [30, 40, 0]])
+    phase = np.array([14, 100, 101, 14, 100, 14])
+    counts, group_counts = radial_profile(positions, np.array([0, 10, 20]), center=(0, 0, 0), phase=phase)
+    # r = 0, 5, 10, 15, 5 and 50 (outside the edges)
+    assert counts.tolist() == [3, 2]
+    assert group_counts.sum(axis=1).tolist() == [3, 2]
+    assert group_counts[:, 0].tolist() == [1, 1]
+
+    # The centroid is the default center
+    counts, group_counts = radial_profile(positions + 100, np.array([0, 10, 20, 60]))
+    assert group_counts is None and counts.sum() == len(positions)
+
+
+def test_radial_profiles_match_pandas():
+    profiles = radial_profiles(backends.get_backend(OUTPUT), bin_width=25.0)
+    groups = [c[:-len("_fraction")] for c in profiles.columns if c.endswith("_fraction")]
+    for time, df in _frames():
+        profile = profiles[profiles.time == time].reset_index(drop=True)
+        positions = df[POSITION].values
+        radius = np.sqrt(((positions - positions.mean(axis=0)) ** 2).sum(axis=1))
+        shell = np.floor(radius / 25.0).astype(int)
+        assert np.array_equal(profile.r_low, radial_edges(25.0, radius.max())[:-1])
+        assert np.array_equal(profile["count"], np.bincount(shell, minlength=len(profile)))
+        assert np.allclose(profile.density, profile["count"] / (4 / 3 * np.pi * (profile.r_high**3 - profile.r_low**3)))
+
+        group = df.current_phase.map(lambda code: phase_grouping.get(phases_dict.get(int(code)), "other"))
+        for name in groups:
+            counts = np.bincount(shell[(group == name).values], minlength=len(profile))
+            with np.errstate(invalid="ignore"):
+                assert np.allclose(profile[f"{name}_fraction"], counts / profile["count"], equal_nan=True)
+
+
+def test_density_maps_match_voxel_index():
+    frames = _frames()
+    positions = np.concatenate([df[POSITION].values for _, df in frames])
+    low, high = np.floor(positions.min(axis=0)) - 1, np.ceil(positions.max(axis=0)) + 1
+    edges = tuple(np.linspace(lo, hi, n + 1) for lo, hi, n in zip(low, high, (6, 5, 4)))
+    times, maps = density_maps(backends.get_backend(OUTPUT), edges)
+    assert maps.shape == (len(frames), 4, 5, 6)
+    assert np.array_equal(times, [time for time, _ in frames])
+
+    for (time, df), grid in zip(frames, maps):
+        # Voxel of each cell from its position, as (z, y, x)
+        index = [np.searchsorted(e, df[c].values, side="right") - 1 for e, c in zip(edges, POSITION)]
+        expected = np.zeros((4, 5, 6))
+        np.add.at(expected, (index[2], index[1], index[0]), 1)
+        assert np.array_equal(grid, expected)
+        assert grid.sum() == len(df)
+
+    _, projections = density_maps(backends.get_backend(OUTPUT), edges, plane="xz")
+    assert np.array_equal(projections, maps.sum(axis=2).transpose(0, 2, 1))
+
+
+def test_voxel_grid_weights():
+    edges = (np.array([0, 1, 2]), np.array([0, 1]), np.array([0, 1, 2, 3]))
+    positions = np.array([[0.5, 0.5, 0.5], [1.5, 0.5, 2.5], [1.5, 0.5, 2.5]])
+    grid = voxel_grid(positions, edges, weights=np.array([1.0, 2.0, 3.0]))
+    assert grid.shape == (3, 1, 2)
+    assert grid[0, 0, 0] == 1 and grid[2, 0, 1] == 5 and grid.sum() == 6
+
+
+@pytest.mark.parametrize("chunk_size", [100, 2**18])
+def test_radial_reducer_matches_profile(chunk_size):
+    mcds = MultiCellDS(output_folder=OUTPUT)
+    edges = radial_edges(50.0, 600.0)
+    results = mcds.reduce_cells_iterator(lambda: [RadialReducer(edges)], chunk_size=chunk_size)
+    for (time, (reducer,)), (expected_time, df) in zip(results, _frames()):
+        assert time == expected_time
+        counts, group_counts = reducer.result()
+        expected, expected_groups = radial_profile(df[POSITION].values, edges, center=(0, 0, 0),
+                                                   phase=df.current_phase.values)
+        assert np.array_equal(counts, expected)
+        assert np.array_equal(group_counts, expected_groups)
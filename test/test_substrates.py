@@ -0,0 +1,18 @@
+import os
+import shutil
+
+import pytest
+
+from pctk.multicellds import MultiCellDS
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+
+
+def test_missing_microenvironment_file(tmp_path):
+    # test/output has no microenvironment files
+    output_folder = str(tmp_path / "output")
+    shutil.copytree(OUTPUT, output_folder)
+    mcds = MultiCellDS(output_folder=output_folder)
+    with pytest.raises(FileNotFoundError, match="output00000000_microenvironment0.mat"):
+        mcds.get_substrate_cube()
+    assert os.listdir(os.path.join(output_folder, ".pctk_cache")) == []
@@ -0,0 +1,30 @@
+import os
+import re
+
+import pytest
+
+from pctk.sweep import read_manifest
+
+OUTPUT = os.path.join(os.path.dirname(__file__), "output")
+
+
+def test_read_manifest(tmp_path):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text(f"# runs\n\n{OUTPUT} rate=0.5 label=a=b\n")
+    assert read_manifest(str(manifest)) == [(OUTPUT, {"rate": "0.5", "label": "a=b"})]
+
+
+@pytest.mark.parametrize("field", ["rate", "=0.5"])
+def test_read_manifest_invalid_parameter(tmp_path, field):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text(f"# runs\n{OUTPUT} seed=1 {field}\n")
+    with pytest.raises(ValueError, match=rf"manifest.txt, line 2: invalid parameter '{field}'"):
+        read_manifest(str(manifest))
+
+
+@pytest.mark.parametrize("folder", ["missing", "missing_*"])
+def test_read_manifest_no_folder(tmp_path, folder):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text(f"{OUTPUT}\n{folder} seed=1\n")
+    with pytest.raises(ValueError, match=re.escape(f"manifest.txt, line 2: '{folder}' matches no folder")):
+        read_manifest(str(manifest))